@@ -0,0 +1,117 @@
+"""
+Benchmark the __slots__ Block representation through section assembly
+and postprocessing.
+
+The page layer of a corpus PDF is decoded once; then
+extract_structure_from_layout runs on it with the real Block and with
+the same class minus __slots__ (every instance then carries a __dict__),
+patched in as pfe.Block. Blocks are kept as objects (blocks_as_dicts=
+False), as for the cached JSON/NDJSON writers. Reported per variant:
+best-of-N wall time, tracemalloc peak and the memory still held by the
+result, after checking that both variants serialize to the same JSON.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import pdf_fast_extract as pfe  # noqa: E402
+from make_corpus import ensure_corpus  # noqa: E402
+
+SLOTTED_BLOCK = pfe.Block
+# Same methods, no __slots__ (nor the slot descriptors they create).
+DICT_BLOCK = type(
+    "Block",
+    (),
+    {
+        k: v
+        for k, v in vars(SLOTTED_BLOCK).items()
+        if k not in SLOTTED_BLOCK.__slots__ and k not in ("__slots__", "__dict__", "__weakref__")
+    },
+)
+VARIANTS = {"slots": SLOTTED_BLOCK, "no_slots": DICT_BLOCK}
+
+
+@contextmanager
+def block_class(cls: type) -> Iterator[None]:
+    pfe.Block = cls
+    try:
+        yield
+    finally:
+        pfe.Block = SLOTTED_BLOCK
+
+
+def run(layout: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return pfe.extract_structure_from_layout(layout, pdf_name="bench.pdf", blocks_as_dicts=False)
+
+
+def bench_variant(layout: List[Dict[str, Any]], cls: type, repeat: int) -> Dict[str, Any]:
+    with block_class(cls):
+        best = None
+        for _ in range(max(1, repeat)):
+            gc.collect()
+            t0 = time.perf_counter()
+            run(layout)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        data = run(layout)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blocks = sum(
+            len(sec["blocks"]) + len(sec.get("qcm_blocks", [])) for sec in data["sections"]
+        )
+    return {
+        "seconds": round(best, 4),
+        "peak_mb": round((peak - base) / 1e6, 3),
+        "retained_mb": round((current - base) / 1e6, 3),
+        "blocks": blocks,
+    }
+
+
+def main() -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("pdf", nargs="?", default=None, help="PDF (default: lecture-600)")
+    ap.add_argument("--corpus", default=os.path.join(HERE, "corpus"))
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    path = args.pdf
+    if path is None:
+        path = ensure_corpus(args.corpus, ["lecture-600"])["lecture-600"]
+    layout = pfe.decode_pdf_layout(path, fingerprints=False)
+
+    outputs = {}
+    for name, cls in VARIANTS.items():
+        with block_class(cls):
+            outputs[name] = json.dumps(run(layout), default=lambda b: b.to_dict())
+    if outputs["slots"] != outputs["no_slots"]:
+        print("[err] Results differ between Block variants")
+        sys.exit(1)
+
+    results = {name: bench_variant(layout, cls, args.repeat) for name, cls in VARIANTS.items()}
+    print(json.dumps({"pdf": os.path.basename(path), "variants": results}, indent=2))
+    fast, slow = results["slots"], results["no_slots"]
+    print(
+        f"[ok] __slots__ blocks: {fast['seconds']:.3f} s vs {slow['seconds']:.3f} s,"
+        f" peak {fast['peak_mb']} MB vs {slow['peak_mb']} MB"
+        f" ({100 * (1 - fast['peak_mb'] / slow['peak_mb']):.0f}% less),"
+        f" retained {fast['retained_mb']} MB vs {slow['retained_mb']} MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark text-only layout decoding on an image-heavy deck.
+
+decode_page_layout() asks get_text("dict") for text blocks only
+(TEXT_DICT_FLAGS); the default flags also materialize every image block
+with its encoded bytes, which the layout layer then throws away. This
+script decodes the same PDF both ways and reports best-of-N wall time
+and the tracemalloc peak of one page's decode, after checking that both
+modes produce the same layout.
+tracemalloc only sees Python objects; the images MuPDF decodes in C show
+up in the peak RSS, measured in a fresh spawned process per mode.
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+from typing import Any, Dict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fitz  # noqa: E402
+import pdf_fast_extract as pfe  # noqa: E402
+from make_corpus import ensure_corpus  # noqa: E402
+
+MODES = {
+    "text_only": pfe.TEXT_DICT_FLAGS,
+    "with_images": fitz.TEXTFLAGS_DICT,
+}
+
+
+def _rss_peak_mb(path: str, flags: int) -> float:
+    import resource
+
+    with fitz.open(path) as doc:
+        for page in doc:
+            pfe.decode_page_layout(page, text_flags=flags)
+    # ru_maxrss survives fork+exec (it would report the parent's peak);
+    # VmHWM belongs to this process image only.
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+
+
+def bench_mode(path: str, flags: int, repeat: int = 3) -> Dict[str, Any]:
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # A fresh interpreter per mode: the RSS high-water mark never goes down.
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+        rss_peak = ex.submit(_rss_peak_mb, path, flags).result()
+
+    with fitz.open(path) as doc:
+        best = None
+        for _ in range(max(1, repeat)):
+            t0 = time.perf_counter()
+            for page in doc:
+                pfe.decode_page_layout(page, text_flags=flags)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+
+        # Peak of a single page's decode: the get_text dict is transient.
+        peak = 0
+        tracemalloc.start()
+        for page in doc:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            pfe.decode_page_layout(page, text_flags=flags)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        pages = len(doc)
+    return {
+        "seconds": round(best, 4),
+        "pages_per_s": round(pages / best, 1) if best else None,
+        "page_peak_mb": round(peak / 1e6, 3),
+        "rss_peak_mb": rss_peak,
+    }
+
+
+def main() -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("pdf", nargs="?", default=None, help="PDF (default: slides-200-images)")
+    ap.add_argument("--corpus", default=os.path.join(HERE, "corpus"))
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    path = args.pdf
+    if path is None:
+        path = ensure_corpus(args.corpus, ["slides-200-images"])["slides-200-images"]
+
+    with fitz.open(path) as doc:
+        for page in doc:
+            a = pfe.decode_page_layout(page, text_flags=MODES["text_only"])
+            b = pfe.decode_page_layout(page, text_flags=MODES["with_images"])
+            if a != b:
+                print(f"[err] Layout differs on page {page.number + 1}")
+                sys.exit(1)
+
+    results = {name: bench_mode(path, flags, args.repeat) for name, flags in MODES.items()}
+    print(json.dumps({"pdf": os.path.basename(path), "modes": results}, indent=2))
+    fast, slow = results["text_only"], results["with_images"]
+    print(
+        f"[ok] text-only decode: {fast['seconds']:.3f} s vs {slow['seconds']:.3f} s"
+        f" ({100 * (1 - fast['seconds'] / slow['seconds']):.0f}% faster),"
+        f" page peak {fast['page_peak_mb']} MB vs {slow['page_peak_mb']} MB,"
+        f" RSS peak {fast['rss_peak_mb']} MB vs {slow['rss_peak_mb']} MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Check that postprocess_sections(engine="fused") matches engine="reference".
+
+Seeded random block sequences are drawn from lecture-like lines (lonely
+bullet markers, "o" and square sub-bullets, wrapped lines, "En France"
+labels, QCM questions and answers) and run through both engines over the
+whole option grid: merge_bullets x merge_wrap x qcm_mode. Blocks (as
+to_dict()), qcm_blocks, section keys and stats must be equal. The first
+mismatch is printed with its input and the script exits with status 1.
+"""
+import os
+import sys
+import random
+import itertools
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import pdf_fast_extract as pfe  # noqa: E402
+
+QCM_MODES = ("separate", "ignore", "include")
+LINES = (
+    [marker for marker in pfe.BULLET_ONLY]
+    + [f"{marker} texte du point" for marker in pfe.BULLET_ONLY]
+    + [
+        "o texte du sous point",
+        "• déjà puce",
+        "- tiret",
+        "– long tiret",
+        "  - déjà sous",
+        "de la suite",
+        "et encore",
+        "suite en minuscule",
+        "Phrase terminée.",
+        "Court",
+        "Titre Propre",
+        "Conclusion :",
+        "Définition",
+        "Attention",
+        "Le foie-",
+        "rein",
+        "l'alcool tue",
+        "123",
+        "Question 3 : quoi",
+        "Réponses : A B",
+        "réponse",
+        "Bilan En France la prévalence est très élevée chez les jeunes",
+        "Santé Publique En France beaucoup de personnes consomment du tabac",
+    ]
+)
+
+
+def random_sections(rng: random.Random) -> List[List[Any]]:
+    sections = []
+    for _ in range(rng.randint(1, 3)):
+        page = 1
+        blocks = []
+        for _ in range(rng.randint(0, 30)):
+            if rng.random() < 0.15:
+                page += 1
+            blocks.append((page, rng.choice(LINES)))
+        sections.append(blocks)
+    return sections
+
+
+def run(sections: List[List[Any]], options: tuple, engine: str) -> tuple:
+    secs: List[Dict[str, Any]] = [
+        {"title": "t", "blocks": [pfe.Block(page, text) for page, text in blocks]}
+        for blocks in sections
+    ]
+    stats = pfe.postprocess_sections(secs, *options, engine=engine)
+    snapshot = [
+        (
+            [blk.to_dict() for blk in sec["blocks"]],
+            [blk.to_dict() for blk in sec.get("qcm_blocks", [])],
+            list(sec),
+        )
+        for sec in secs
+    ]
+    return stats, snapshot
+
+
+def main() -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--iterations", type=int, default=2000)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    grid = list(itertools.product((True, False), (True, False), QCM_MODES))
+    checked = 0
+    for _ in range(args.iterations):
+        sections = random_sections(rng)
+        for options in grid:
+            if run(sections, options, "reference") != run(sections, options, "fused"):
+                merge_bullets, merge_wrap, qcm_mode = options
+                print(
+                    f"[err] Engines differ: merge_bullets={merge_bullets}"
+                    f" merge_wrap={merge_wrap} qcm_mode={qcm_mode}"
+                )
+                print([[text for _, text in blocks] for blocks in sections])
+                sys.exit(1)
+            checked += 1
+    print(f"[ok] fused == reference on {checked} cases (seed {args.seed})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Deterministic synthetic course PDFs for benchmarking pdf_fast_extract.
+
+Each profile fixes a seed, so the same profile always produces the same
+text, layout and images. Pages mimic the lecture packs we ingest: repeated
+header/footer lines and page numbers, numbered titles, bullets and "o"
+sub-bullets, lonely bullet markers, wrapped lines, a QCM tail, and
+optional images (a repeated logo, unique figures, or an image-heavy deck).
+"""
+import os
+import random
+from typing import Any, Dict, List
+
+import fitz  # PyMuPDF
+
+
+PAGE_W = 595.0
+PAGE_H = 842.0
+WORDS = (
+    "cellule membrane protéine récepteur hormone enzyme foie rein coeur "
+    "poumon sang glucose insuline tabac alcool dépendance sevrage "
+    "prévention dépistage santé publique incidence prévalence facteur "
+    "risque traitement diagnostic symptôme clinique patient population"
+).split()
+CONTINUATIONS = ["de la", "des", "et", "pour", "avec", "dans le cas", "qui"]
+FONT_MIXES: Dict[str, Dict[str, Any]] = {
+    "uniform": {"body": [11.0], "title": [20.0], "sub": [16.0]},
+    "mixed": {"body": [10.5, 11.0, 11.0, 12.0], "title": [18.0, 22.0, 24.0], "sub": [15.0]},
+    "small": {"body": [9.0, 9.0, 9.5], "title": [13.0, 14.0], "sub": [12.0]},
+}
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "small-10": {"pages": 10, "fonts": "uniform", "images": "logo", "seed": 10},
+    "lecture-120": {"pages": 120, "fonts": "mixed", "images": "logo", "seed": 120},
+    "lecture-600": {"pages": 600, "fonts": "mixed", "images": "figures", "seed": 600},
+    "pack-2000": {"pages": 2000, "fonts": "small", "images": "logo", "seed": 2000},
+    "slides-200-images": {"pages": 200, "fonts": "uniform", "images": "heavy", "seed": 201},
+}
+DEFAULT_PROFILES = ["small-10", "lecture-120", "lecture-600"]
+
+
+def _sentence(rng: random.Random, lo: int, hi: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(lo, hi)))
+
+
+def _pixmap(rng: random.Random, w: int, h: int) -> fitz.Pixmap:
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, w, h), False)
+    pix.clear_with(rng.randint(0, 255))
+    return pix
+
+
+def _page_lines(rng: random.Random, pno: int, pages: int, fonts: Dict[str, Any]) -> List[Any]:
+    """(text, fontsize, indent) tuples for the body of one page."""
+    lines: List[Any] = []
+    if pno % 4 == 0:
+        lines.append((f"{pno // 4 + 1}. {_sentence(rng, 2, 4).capitalize()}", rng.choice(fonts["title"]), 0))
+        if rng.random() < 0.3:  # title wrapped on two lines
+            lines.append((_sentence(rng, 1, 3), rng.choice(fonts["title"]), 0))
+    elif rng.random() < 0.3:
+        lines.append((_sentence(rng, 2, 4).capitalize(), rng.choice(fonts["sub"]), 0))
+    qcm_tail = pno >= pages - max(1, pages // 20)
+    for i in range(rng.randint(18, 34)):
+        body = rng.choice(fonts["body"])
+        r = rng.random()
+        if qcm_tail:
+            if i % 7 == 0:
+                lines.append((f"Question {pno * 5 + i // 7 + 1} : {_sentence(rng, 4, 9)} ?", body, 0))
+            else:
+                lines.append((f"{'ABCDE'[i % 7 % 5]}. {_sentence(rng, 3, 8)}", body, 14))
+            continue
+        if r < 0.08:
+            lines.append(("•", body, 0))  # lonely bullet marker, text on next line
+            lines.append((_sentence(rng, 3, 9), body, 14))
+        elif r < 0.30:
+            lines.append((f"• {_sentence(rng, 4, 12)}", body, 0))
+        elif r < 0.42:
+            lines.append((f"o {_sentence(rng, 3, 8)}", body, 14))
+        elif r < 0.47:
+            lines.append((rng.choice(["Conclusion :", "Définition", "À retenir :", "Remarque"]), body, 0))
+        elif r < 0.62:  # wrapped sentence
+            lines.append((_sentence(rng, 6, 11), body, 0))
+            lines.append((f"{rng.choice(CONTINUATIONS)} {_sentence(rng, 2, 6)}.", body, 0))
+        else:
+            lines.append((f"{_sentence(rng, 5, 14).capitalize()}.", body, 0))
+    return lines
+
+
+def make_pdf(path: str, pages: int, fonts: str = "uniform", images: str = "logo", seed: int = 0) -> None:
+    """
+    images: "none", "logo" (small logo repeated on every page), "figures"
+    (logo plus a unique figure every 5th page) or "heavy" (logo plus two
+    large unique images on every page, like exported slide decks).
+    """
+    rng = random.Random(seed)
+    mix = FONT_MIXES[fonts]
+    doc = fitz.open()
+    logo = _pixmap(rng, 48, 48)
+    logo_xref = 0
+    for pno in range(pages):
+        page = doc.new_page(width=PAGE_W, height=PAGE_H)
+        page.insert_text((50, 40), "Faculté de Médecine - UE Santé Société Humanité", fontsize=8)
+        page.insert_text((400, 40), "Année 2025-2026", fontsize=8)
+        if images != "none":
+            rect = fitz.Rect(520, 20, 560, 60)
+            if logo_xref:
+                page.insert_image(rect, xref=logo_xref)
+            else:
+                logo_xref = page.insert_image(rect, pixmap=logo)
+        tw = fitz.TextWriter(page.rect)
+        y = 90.0
+        for text, size, indent in _page_lines(rng, pno, pages, mix):
+            if y > PAGE_H - 110:
+                break
+            tw.append((50 + indent, y), text, fontsize=size)
+            y += size * 1.35
+        tw.write_text(page)
+        if images == "figures" and pno % 5 == 2:
+            page.insert_image(fitz.Rect(300, 500, 540, 700), pixmap=_pixmap(rng, 320, 240))
+        elif images == "heavy":
+            page.insert_image(fitz.Rect(60, 420, 300, 620), pixmap=_pixmap(rng, 800, 600))
+            page.insert_image(fitz.Rect(310, 420, 550, 620), pixmap=_pixmap(rng, 800, 600))
+        page.insert_text((50, PAGE_H - 40), "Pr. Martin - Cours magistral", fontsize=8)
+        page.insert_text((PAGE_W - 80, PAGE_H - 40), f"{pno + 1} / {pages}", fontsize=8)
+    doc.set_metadata({"producer": "bench/make_corpus.py", "creationDate": "", "modDate": ""})
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def ensure_corpus(out_dir: str, profiles: List[str]) -> Dict[str, str]:
+    """Generate missing profiles; returns {profile: pdf path}."""
+    paths: Dict[str, str] = {}
+    for name in profiles:
+        spec = PROFILES[name]
+        path = os.path.join(out_dir, f"{name}.pdf")
+        if not os.path.exists(path):
+            make_pdf(path, spec["pages"], spec["fonts"], spec["images"], spec["seed"])
+        paths[name] = path
+    return paths
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "corpus"))
+    ap.add_argument(
+        "--profiles",
+        default=",".join(DEFAULT_PROFILES),
+        help=f"Comma-separated profiles among: {', '.join(PROFILES)}",
+    )
+    ap.add_argument("--force", action="store_true", help="Regenerate existing files")
+    args = ap.parse_args()
+
+    names = [n for n in args.profiles.split(",") if n]
+    if args.force:
+        for n in names:
+            path = os.path.join(args.out, f"{n}.pdf")
+            if os.path.exists(path):
+                os.remove(path)
+    for name, path in ensure_corpus(args.out, names).items():
+        print(f"[ok] {name}: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark pdf_fast_extract on the synthetic corpus (see make_corpus.py).
+
+For each PDF: best-of-N wall time of extract_structure_fast, pages/s,
+tracemalloc peak of a separate traced run, and per-stage times from a
+Profiler run (decode, text stats, header/footer, assembly, and each
+postprocess stage of the reference engine next to the fused one).
+Results are written as JSON; with --baseline, any metric worse than the
+baseline by more than --tolerance is reported and the exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import platform
+from typing import Any, Dict, List
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fitz  # noqa: E402
+import pdf_fast_extract as pfe  # noqa: E402
+from make_corpus import DEFAULT_PROFILES, PROFILES, ensure_corpus  # noqa: E402
+
+
+def bench_pdf(path: str, repeat: int = 3) -> Dict[str, Any]:
+    import tracemalloc
+
+    with fitz.open(path) as doc:
+        pages = len(doc)
+
+    best = None
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        pfe.extract_structure_fast(path)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    pfe.extract_structure_fast(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    stages: Dict[str, float] = {}
+    for engine in ("fused", "reference"):
+        prof = pfe.Profiler(trace_memory=False)
+        layout = pfe.decode_pdf_layout(path, profiler=prof)
+        pfe.extract_structure_from_layout(
+            layout, pdf_name=os.path.basename(path), postprocess_engine=engine, profiler=prof
+        )
+        for name, rec in prof.report()["phases"].items():
+            if engine == "fused" or name.startswith("postprocess."):
+                stages[name] = rec["wall_ms"]
+        if engine == "fused":
+            page_decode = prof.report()["pages"]
+
+    return {
+        "pages": pages,
+        "bytes": os.path.getsize(path),
+        "sha256": pfe.sha256_file(path),
+        "extract_s": round(best, 4),
+        "pages_per_s": round(pages / best, 1) if best else None,
+        "peak_mb": round(peak / (1024 * 1024), 3),
+        "stages_ms": stages,
+        "page_decode_ms": {k: page_decode[k] for k in ("p50_ms", "p90_ms", "p99_ms", "max_ms")},
+    }
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """Regressions: slower extract, lower pages/s or higher peak beyond tolerance."""
+    out: List[str] = []
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if base.get("sha256") != cur["sha256"]:
+            out.append(f"{name}: corpus file differs from baseline, not comparable")
+            continue
+        for key, higher_is_worse in (("extract_s", True), ("peak_mb", True), ("pages_per_s", False)):
+            b, c = base.get(key), cur.get(key)
+            if not b or c is None:
+                continue
+            change = (c - b) / b if higher_is_worse else (b - c) / b
+            if change > tolerance:
+                out.append(f"{name}: {key} {b} -> {c} ({change * 100:+.1f}% worse)")
+    return out
+
+
+def main():
+    import argparse
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument(
+        "--profiles",
+        default=",".join(DEFAULT_PROFILES),
+        help=f"Comma-separated profiles among: {', '.join(PROFILES)}",
+    )
+    ap.add_argument("--corpus", default=os.path.join(HERE, "corpus"))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", default=os.path.join(HERE, "results", "latest.json"))
+    ap.add_argument("--baseline", default=None, help="Baseline JSON to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown")
+    ap.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Also write the results to --baseline",
+    )
+    args = ap.parse_args()
+
+    names = [n for n in args.profiles.split(",") if n]
+    corpus = ensure_corpus(args.corpus, names)
+    results: Dict[str, Any] = {}
+    for name, path in corpus.items():
+        res = bench_pdf(path, repeat=args.repeat)
+        results[name] = res
+        print(
+            f"[bench] {name}: {res['pages']} pages | {res['extract_s']:.3f} s | "
+            f"{res['pages_per_s']} pages/s | peak {res['peak_mb']} MB"
+        )
+
+    current = {
+        "meta": {
+            "python": platform.python_version(),
+            "pymupdf": fitz.VersionBind,
+            "platform": platform.platform(),
+            "extractor_version": pfe.EXTRACTOR_VERSION,
+            "repeat": args.repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"[ok] Wrote: {args.out}")
+
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"[ok] Baseline saved: {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        for r in regressions:
+            print(f"[regression] {r}")
+        if regressions:
+            sys.exit(1)
+        print(f"[ok] No regression beyond {args.tolerance * 100:.0f}% vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Token-budgeted chunking of extraction results into LLM-ready payloads.
+
+Sections are packed whole into chunks under a token budget; a section
+that does not fit in one chunk is split between blocks, never inside a
+bullet group (a bullet with its sub-bullets, a line ending with ':' and
+what it introduces, a label and the block it labels). Each chunk carries
+its page range and "[p. N]" markers in its text, so the model can fill
+evidence.page. qcm_blocks and images flagged is_repeated_logo are left
+out. Chunks can be posted in parallel to a model endpoint; "stub" runs a
+local stand-in endpoint for tests.
+"""
+import re
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from pdf_fast_extract import load_result, norm_text, result_exists, result_stem
+
+
+# French course text runs at roughly 3.5 characters per token; estimating
+# on the high side keeps chunks under the budget.
+CHARS_PER_TOKEN = 3.5
+PAGE_MARKER_TOKENS = 4
+SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?;])\s+")
+
+
+def estimate_tokens(text: str, chars_per_token: float = CHARS_PER_TOKEN) -> int:
+    return int(math.ceil(len(text) / chars_per_token)) + 1  # + newline
+
+
+def block_units(blocks: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Group blocks into units that a chunk boundary should not split."""
+    units: List[List[Dict[str, Any]]] = []
+    for blk in blocks:
+        if units:
+            prev = units[-1][-1]
+            if (
+                (blk.get("kind") == "bullet" and (blk.get("bullet_level") or 0) > 0)
+                or prev.get("kind") in ("label", "title")
+                or prev["text"].rstrip().endswith(":")
+            ):
+                units[-1].append(blk)
+                continue
+        units.append([blk])
+    return units
+
+
+def _split_block(blk: Dict[str, Any], budget: int, cpt: float) -> List[Dict[str, Any]]:
+    # Last resort for a single block over budget: cut between sentences,
+    # then hard-cut sentences that are still too long.
+    max_chars = max(1, int((budget - 1) * cpt))
+    pieces: List[str] = []
+    cur = ""
+    for sentence in SENTENCE_SPLIT_RE.split(blk["text"]):
+        while len(sentence) > max_chars:
+            if cur:
+                pieces.append(cur)
+                cur = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if cur and len(cur) + 1 + len(sentence) > max_chars:
+            pieces.append(cur)
+            cur = ""
+        cur = f"{cur} {sentence}" if cur else sentence
+    if cur:
+        pieces.append(cur)
+    return [{**blk, "text": piece} for piece in pieces]
+
+
+class _Chunk:
+    def __init__(self) -> None:
+        self.sections: List[Dict[str, Any]] = []
+        self.tokens = 0
+
+    def open_section(self, sec: Dict[str, Any], continued: bool, header_tokens: int) -> None:
+        self.sections.append(
+            {
+                "title": sec["title"],
+                "page_start": sec["page_start"],
+                "continued": continued,
+                "blocks": [],
+            }
+        )
+        self.tokens += header_tokens
+
+    def add(self, unit: List[Dict[str, Any]], tokens: int) -> None:
+        self.sections[-1]["blocks"].extend(unit)
+        self.tokens += tokens
+
+
+def pack_sections(
+    sections: List[Dict[str, Any]],
+    max_tokens: int = 3000,
+    chars_per_token: float = CHARS_PER_TOKEN,
+) -> List[_Chunk]:
+    chunks: List[_Chunk] = []
+    cur = _Chunk()
+
+    def flush() -> _Chunk:
+        if cur.sections:
+            chunks.append(cur)
+            return _Chunk()
+        return cur
+
+    for sec in sections:
+        units = block_units(sec.get("blocks", []))
+        if not units:
+            continue
+        header = estimate_tokens(f"## {sec['title']}", chars_per_token)
+        costs = [
+            sum(estimate_tokens(b["text"], chars_per_token) for b in unit) + PAGE_MARKER_TOKENS
+            for unit in units
+        ]
+        total = header + sum(costs)
+        if cur.tokens + total > max_tokens:
+            cur = flush()
+        if total <= max_tokens:
+            cur.open_section(sec, False, header)
+            for unit, cost in zip(units, costs):
+                cur.add(unit, cost)
+            continue
+        # Too big for any chunk: split at unit boundaries.
+        cur.open_section(sec, False, header)
+        for unit, cost in zip(units, costs):
+            if header + cost > max_tokens:
+                budget = max_tokens - header - PAGE_MARKER_TOKENS
+                unit = [p for b in unit for p in _split_block(b, budget, chars_per_token)]
+                pieces = [[p] for p in unit]
+            else:
+                pieces = [unit]
+            for piece in pieces:
+                piece_cost = (
+                    sum(estimate_tokens(b["text"], chars_per_token) for b in piece)
+                    + PAGE_MARKER_TOKENS
+                )
+                if cur.tokens + piece_cost > max_tokens and cur.sections[-1]["blocks"]:
+                    cur = flush()
+                    cur.open_section(sec, True, header)
+                cur.add(piece, piece_cost)
+    flush()
+    return chunks
+
+
+def render_chunk(sections: List[Dict[str, Any]]) -> str:
+    lines: List[str] = []
+    for sec in sections:
+        suffix = " (suite)" if sec["continued"] else ""
+        lines.append(f"## {sec['title']}{suffix}")
+        page = None
+        for blk in sec["blocks"]:
+            if blk["page"] != page:
+                page = blk["page"]
+                lines.append(f"[p. {page}]")
+            lines.append(blk["text"])
+        lines.append("")
+    return "\n".join(lines).rstrip() + "\n"
+
+
+def chunk_payloads(
+    data: Dict[str, Any],
+    max_tokens: int = 3000,
+    chars_per_token: float = CHARS_PER_TOKEN,
+) -> List[Dict[str, Any]]:
+    """
+    Cut an extraction result into LLM-ready payloads:
+    {"pdf", "sha256", "chunk", "chunks", "page_start", "page_end", "tokens",
+     "sections": [{"title", "page_start", "page_end", "continued"}],
+     "images": [...], "text"}
+    """
+    chunks = pack_sections(data.get("sections", []), max_tokens, chars_per_token)
+    images = [img for img in data.get("images", []) if not img.get("is_repeated_logo")]
+    payloads = []
+    for i, chunk in enumerate(chunks):
+        pages = [b["page"] for sec in chunk.sections for b in sec["blocks"]]
+        lo, hi = min(pages), max(pages)
+        text = render_chunk(chunk.sections)
+        payloads.append(
+            {
+                "pdf": data.get("pdf"),
+                "sha256": data.get("sha256"),
+                "chunk": i,
+                "chunks": len(chunks),
+                "page_start": lo,
+                "page_end": hi,
+                "tokens": estimate_tokens(text, chars_per_token),
+                "sections": [
+                    {
+                        "title": sec["title"],
+                        "page_start": min(b["page"] for b in sec["blocks"]),
+                        "page_end": max(b["page"] for b in sec["blocks"]),
+                        "continued": sec["continued"],
+                    }
+                    for sec in chunk.sections
+                ],
+                "images": [
+                    img
+                    for img in images
+                    if any(lo <= p <= hi for p in (img.get("pages") or [img.get("page")]) if p)
+                ],
+                "text": text,
+            }
+        )
+    return payloads
+
+
+def post_chunks(
+    payloads: List[Dict[str, Any]],
+    endpoint: str,
+    concurrency: int = 4,
+    timeout: float = 180.0,
+) -> List[Dict[str, Any]]:
+    """POST each payload as JSON to endpoint, concurrently; results in order."""
+    import urllib.request
+
+    def post(payload: Dict[str, Any]) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        req = urllib.request.Request(
+            endpoint,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        rec: Dict[str, Any] = {"chunk": payload["chunk"]}
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as res:
+                rec["response"] = json.loads(res.read().decode("utf-8"))
+        except Exception as e:
+            rec["error"] = f"{type(e).__name__}: {e}"
+        rec["seconds"] = round(time.perf_counter() - t0, 3)
+        return rec
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as ex:
+        return list(ex.map(post, payloads))
+
+
+def stub_response(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Deterministic stand-in for the model: one question per section."""
+    questions = []
+    page = None
+    title = ""
+    for line in payload.get("text", "").splitlines():
+        if line.startswith("[p. "):
+            page = int(line[4:-1])
+        elif line.startswith("## "):
+            title = line[3:]
+        elif page is not None and norm_text(line) and len(questions) < len(
+            payload.get("sections", [])
+        ):
+            questions.append(
+                {
+                    "type": "multi",
+                    "difficulty": "moyen",
+                    "question": f"À propos de : {title}",
+                    "options": [f"{c} Proposition {c}" for c in "ABCDE"],
+                    "answer_indices": [0],
+                    "explanation": "Réponse générée par le modèle de test.",
+                    "evidence": [{"page": page, "excerpt": line[:120]}],
+                }
+            )
+    return {"chunk": payload.get("chunk"), "questions": questions, "note": ""}
+
+
+def make_stub_handler(delay: float = 0.0):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self) -> None:
+            try:
+                length = int(self.headers.get("Content-Length", "0"))
+                payload = json.loads(self.rfile.read(length).decode("utf-8"))
+            except ValueError as e:
+                self._send(400, {"error": f"invalid JSON: {e}"})
+                return
+            if delay:
+                time.sleep(delay)  # simulated model latency
+            self._send(200, stub_response(payload))
+
+        def _send(self, code: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def stub_main(argv: List[str]) -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="pdf_chunker.py stub")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--delay-ms", type=float, default=0.0, help="Simulated latency")
+    args = ap.parse_args(argv)
+
+    server = ThreadingHTTPServer(
+        (args.host, args.port), make_stub_handler(args.delay_ms / 1000.0)
+    )
+    print(f"[ok] Stub model endpoint on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+    import sys
+
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "stub":
+        stub_main(argv[1:])
+        return
+
+    ap = argparse.ArgumentParser(prog="pdf_chunker.py")
+    ap.add_argument(
+        "result", help="Cached extraction result (.json, .ndjson, .pack or store ref)"
+    )
+    ap.add_argument("--max-tokens", type=int, default=3000)
+    ap.add_argument("--chars-per-token", type=float, default=CHARS_PER_TOKEN)
+    ap.add_argument(
+        "--chunks", default=None, help="Output JSONL (default: <result>.chunks.jsonl)"
+    )
+    ap.add_argument("--endpoint", default=None, help="POST each chunk to this URL")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--timeout", type=float, default=180.0)
+    args = ap.parse_args(argv)
+
+    if not result_exists(args.result):
+        print(f"[err] Result not found: {args.result}")
+        return
+    payloads = chunk_payloads(
+        load_result(args.result), args.max_tokens, args.chars_per_token
+    )
+    stem = result_stem(args.result)
+    chunks_path = args.chunks or f"{stem}.chunks.jsonl"
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        for payload in payloads:
+            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    tokens = [p["tokens"] for p in payloads]
+    print(
+        f"[ok] Chunks: {len(payloads)} | tokens max {max(tokens, default=0)}"
+        f" / total {sum(tokens)} -> {chunks_path}"
+    )
+
+    if args.endpoint:
+        t0 = time.perf_counter()
+        results = post_chunks(payloads, args.endpoint, args.concurrency, args.timeout)
+        responses_path = f"{stem}.responses.jsonl"
+        with open(responses_path, "w", encoding="utf-8") as f:
+            for rec in results:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        errors = sum(1 for r in results if "error" in r)
+        print(
+            f"[ok] Posted {len(results)} chunks in {time.perf_counter() - t0:.2f} s"
+            f" | errors: {errors} -> {responses_path}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Evidence verification for generated questions.
+
+Generated questions cite evidence as [{page, excerpt}]. EvidenceIndex is
+built once from an extraction result: normalized text per page plus an
+inverted index of word shingles over each page's titles and blocks, in
+reading order. A batch of (page, excerpt) pairs is then checked with
+dictionary lookups only: each pair gets the share of its shingles found
+on the cited page, the best page and the best block.
+"""
+import os
+import re
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pdf_fast_extract import load_result, norm_text, normalize_label_key, result_exists
+
+
+SHINGLE_WORDS = 3
+MATCH_THRESHOLD = 0.8
+NON_WORD_RE = re.compile(r"[^\w]+")
+PAGE_NUMBER_RE = re.compile(r"[0-9]+")
+
+
+def evidence_key(text: str) -> str:
+    """norm_text + normalize_label_key, punctuation folded to spaces."""
+    return NON_WORD_RE.sub(" ", normalize_label_key(norm_text(text))).strip()
+
+
+def shingles(key: str, k: int = SHINGLE_WORDS) -> List[str]:
+    words = key.split()
+    return [" ".join(words[i : i + k]) for i in range(len(words) - k + 1)]
+
+
+class EvidenceIndex:
+    """
+    entries[i] = (page, section index, block index or None for the title);
+    postings: shingle -> {page: entry ids whose words it covers}. Shingles
+    run over each page's words in reading order, across block boundaries,
+    so an excerpt spanning two lines is found like a single-line one.
+    """
+
+    def __init__(self, k: int = SHINGLE_WORDS) -> None:
+        self.k = k
+        self.entries: List[Tuple[int, int, Optional[int]]] = []
+        self.postings: Dict[str, Dict[int, List[int]]] = {}
+        self.page_text: Dict[int, str] = {}
+
+    @classmethod
+    def from_result(cls, data: Dict[str, Any], k: int = SHINGLE_WORDS) -> "EvidenceIndex":
+        index = cls(k)
+        pages: Dict[int, List[Tuple[str, int]]] = {}
+        for si, sec in enumerate(data.get("sections", [])):
+            index._add(sec["page_start"], si, None, sec["title"], pages)
+            for bi, blk in enumerate(sec.get("blocks", [])):
+                index._add(blk["page"], si, bi, blk["text"], pages)
+        for page, words in pages.items():
+            for i in range(len(words) - k + 1):
+                window = words[i : i + k]
+                ids = index.postings.setdefault(" ".join(w for w, _ in window), {})
+                ids = ids.setdefault(page, [])
+                for _, entry in window:
+                    if entry not in ids:
+                        ids.append(entry)
+        index.page_text = {p: " ".join(w for w, _ in words) for p, words in pages.items()}
+        return index
+
+    def _add(
+        self,
+        page: int,
+        section: int,
+        block: Optional[int],
+        text: str,
+        pages: Dict[int, List[Tuple[str, int]]],
+    ) -> None:
+        key = evidence_key(text)
+        if not key:
+            return
+        entry = len(self.entries)
+        self.entries.append((page, section, block))
+        pages.setdefault(page, []).extend((w, entry) for w in key.split())
+
+    def verify(self, page: Optional[int], excerpt: str) -> Dict[str, Any]:
+        key = evidence_key(excerpt)
+        grams = set(shingles(key, self.k))
+        rec: Dict[str, Any] = {"page": page, "score": 0.0, "best_page": None, "best_score": 0.0}
+        if not grams:
+            # Too short for a shingle: substring check on the cited page only.
+            if key and page is not None and key in self.page_text.get(page, ""):
+                rec.update({"score": 1.0, "best_page": page, "best_score": 1.0})
+            rec["match"] = rec["score"] >= MATCH_THRESHOLD
+            return rec
+
+        page_hits: Counter = Counter()
+        found = []
+        for sh in grams:
+            by_page = self.postings.get(sh)
+            if by_page:
+                page_hits.update(by_page.keys())
+                found.append(by_page)
+        n = float(len(grams))
+        if page_hits:
+            # Ties go to the cited page, then to the earliest page.
+            best_page = max(page_hits, key=lambda p: (page_hits[p], p == page, -p))
+            # The block covered by most of the matched shingles.
+            entry_hits: Counter = Counter()
+            for by_page in found:
+                entry_hits.update(by_page.get(best_page, ()))
+            best_entry = max(entry_hits, key=lambda i: (entry_hits[i], -i))
+            _, section, block = self.entries[best_entry]
+            rec.update(
+                {
+                    "score": round(page_hits.get(page, 0) / n, 3),
+                    "best_page": best_page,
+                    "best_score": round(page_hits[best_page] / n, 3),
+                    "section": section,
+                    "block": block,
+                }
+            )
+        rec["match"] = rec["score"] >= MATCH_THRESHOLD
+        return rec
+
+    def verify_batch(
+        self, pairs: Iterable[Tuple[Optional[int], str]]
+    ) -> List[Dict[str, Any]]:
+        return [self.verify(page, excerpt) for page, excerpt in pairs]
+
+
+def parse_page(page: Any) -> Optional[int]:
+    """
+    Cited page as an int: 3, "3", "p. 3" and "3-4" (first page) give 3;
+    anything without a number is None, as if no page was given.
+    """
+    if isinstance(page, bool):
+        return None
+    if isinstance(page, int):
+        return page
+    if isinstance(page, float):
+        return int(page) if page.is_integer() else None
+    m = PAGE_NUMBER_RE.search(str(page)) if page is not None else None
+    return int(m.group()) if m else None
+
+
+def iter_question_evidence(
+    questions: Iterable[Dict[str, Any]],
+) -> Iterable[Tuple[int, int, Optional[int], str]]:
+    """(question index, evidence index, page, excerpt) over generated questions."""
+    for qi, q in enumerate(questions):
+        for ei, ev in enumerate(q.get("evidence") or []):
+            yield (qi, ei, parse_page(ev.get("page")), ev.get("excerpt", ""))
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    Questions from a JSON list, a {"questions": [...]} document, or JSONL
+    of either (e.g. the responses written by pdf_chunker.py --endpoint).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    try:
+        docs = [json.loads(text)]
+    except ValueError:
+        docs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    questions: List[Dict[str, Any]] = []
+    for doc in docs:
+        if isinstance(doc, list):
+            questions.extend(doc)
+        elif "questions" in doc:
+            questions.extend(doc["questions"])
+        elif "response" in doc:
+            questions.extend(doc["response"].get("questions", []))
+        else:
+            questions.append(doc)
+    return questions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="pdf_evidence.py")
+    ap.add_argument(
+        "result", help="Cached extraction result (.json, .ndjson, .pack or store ref)"
+    )
+    ap.add_argument("questions", help="Generated questions (JSON or JSONL)")
+    ap.add_argument("--report", default=None, help="Write per-evidence results (JSONL)")
+    args = ap.parse_args(argv)
+
+    if not result_exists(args.result):
+        print(f"[err] Result not found: {args.result}")
+        return
+    if not os.path.isfile(args.questions):
+        print(f"[err] File not found: {args.questions}")
+        return
+    t0 = time.perf_counter()
+    index = EvidenceIndex.from_result(load_result(args.result))
+    t1 = time.perf_counter()
+    refs = list(iter_question_evidence(load_questions(args.questions)))
+    results = index.verify_batch((page, excerpt) for _, _, page, excerpt in refs)
+    t2 = time.perf_counter()
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            for (qi, ei, _, excerpt), rec in zip(refs, results):
+                out = {"question": qi, "evidence": ei, "excerpt": excerpt, **rec}
+                f.write(json.dumps(out, ensure_ascii=False) + "\n")
+    matched = sum(1 for r in results if r["match"])
+    moved = sum(1 for r in results if not r["match"] and r["best_score"] >= MATCH_THRESHOLD)
+    print(
+        f"[ok] Index: {len(index.entries)} blocks, {len(index.postings)} shingles"
+        f" ({(t1 - t0) * 1000:.1f} ms)"
+    )
+    print(
+        f"[ok] Evidence: {len(results)} checked in {(t2 - t1) * 1000:.1f} ms"
+        f" | matched: {matched} | wrong page: {moved}"
+        f" | not found: {len(results) - matched - moved}"
+    )
+    if args.report:
+        print(f"[ok] Report: {args.report}")
+
+
+if __name__ == "__main__":
+    main()
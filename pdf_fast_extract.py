@@ -1,12 +1,19 @@
 import os
 import re
 import json
+import gzip
 import math
+import shutil
+import time
 import hashlib
+import tracemalloc
 from collections import Counter
-from typing import Any, Dict, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 import fitz  # PyMuPDF
+import numpy as np
 
 
 PAGE_NUM_RE = re.compile(
@@ -15,6 +22,7 @@ PAGE_NUM_RE = re.compile(
 QCM_QUESTION_RE = re.compile(r"^question\s+\d+", re.IGNORECASE)
 QCM_ANSWER_RE = re.compile(r"^r[eé]ponses?\s*:?", re.IGNORECASE)
 PUNCT_END_RE = re.compile(r"[.:;!?…]$")
+EN_FRANCE_RE = re.compile(r"\bEn France\b")
 SUB_BULLET_PREFIX = "  - "
 BULLET_ONLY = {
     "": "• ",
@@ -26,6 +34,25 @@ BULLET_ONLY = {
 }
 SUB_BULLET_RE = re.compile(r"^[oO]\s+(.+)$")
 SUB_BULLET_SQUARE_RE = re.compile(r"^[]\s+(.+)$")
+# Bump when extraction output changes for the same inputs (invalidates result cache).
+EXTRACTOR_VERSION = "6"
+# Bump when the page-layout record changes (invalidates the layout cache tier).
+LAYOUT_VERSION = 3
+LAYOUT_CACHE_DIR = "layout"
+HASH_INDEX_DIR = "hashes"
+DIFF_DIR = "diffs"
+PARTIAL_DIR = "partial"
+# Assembly, cache save and JSON write per page, as a share of a page decode.
+PARTIAL_OVERHEAD_RATIO = 0.4
+# Batch: seconds past --timeout before a worker stuck in C is killed.
+BATCH_KILL_GRACE_S = 5.0
+RESULT_STORE_FILE = "results.sqlite"
+PAGE_THUMB_DIR = "thumbs"
+IMAGE_CACHE_DIR = "images"
+# Subdirectories of out/ holding cache files that evict_cache may drop.
+EVICTABLE_DIRS = (LAYOUT_CACHE_DIR, PARTIAL_DIR, DIFF_DIR, PAGE_THUMB_DIR, IMAGE_CACHE_DIR)
+# Document name of an in-memory PDF given without one.
+STREAM_PDF_NAME = "upload.pdf"
 SMALL_AREA_THRESHOLD = 200 * 200
 LOGO_REPEAT_RATIO = 0.6
 LABEL_KEYWORDS = {
@@ -46,16 +73,41 @@ LABEL_KEYWORDS = {
     "note",
     "notes",
 }
-
-
-def sha256_file(path: str) -> str:
-    h = hashlib.sha256()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b""):
-            h.update(chunk)
-    return h.hexdigest()
-
-
+
+
+# A PDF given by path, or in memory (bytes-like or binary file object).
+PdfSource = Union[str, bytes, bytearray, memoryview, BinaryIO]
+PdfBuffer = Union[bytes, memoryview]
+
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def pdf_buffer(source: Union[bytes, bytearray, memoryview, BinaryIO]) -> memoryview:
+    """
+    Byte view of an in-memory PDF, without copying: bytes-like objects are
+    wrapped as is and a BytesIO exposes its buffer; any other file object
+    is read once. Both hashlib and fitz.open(stream=...) take the view
+    without copying it (fitz copies a bytearray or BytesIO).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+    elif hasattr(source, "getbuffer"):
+        view = source.getbuffer()
+    else:
+        view = memoryview(source.read())
+    return view if view.format == "B" and view.ndim == 1 else view.cast("B")
+
+
+def pdf_display_name(pdf_path: Optional[str], pdf_name: Optional[str] = None) -> str:
+    return pdf_name or (os.path.basename(pdf_path) if pdf_path else STREAM_PDF_NAME)
+
+
 def norm_text(s: str) -> str:
     if not s:
         return ""
@@ -67,14 +119,14 @@ def norm_text(s: str) -> str:
     s = s.replace("\u200d", "")
     s = s.replace("\ufeff", "")
     return " ".join(s.split()).strip()
-
-
+
+
 def median(values: List[float]) -> float:
     vs = sorted(values)
     n = len(vs)
     if n == 0:
         return 0.0
-    mid = n // 2
+    mid = n // 2
     return vs[mid] if n % 2 == 1 else (vs[mid - 1] + vs[mid]) / 2.0
 
 
@@ -119,23 +171,271 @@ def is_new_bullet(text: str) -> bool:
     return False
 
 
-def normalize_sub_bullets(blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
-    out: List[Dict[str, Any]] = []
+class Profiler:
+    """
+    Opt-in per-phase instrumentation: wall time, CPU time and tracemalloc
+    peak per named phase (phases may nest; repeated phases accumulate),
+    plus per-page decode times and per-stage throughput (items/s).
+    on_phase(name, wall_s, cpu_s, peak_bytes) is called as each phase ends.
+    """
+
+    def __init__(
+        self,
+        trace_memory: bool = True,
+        on_phase: Optional[Callable[[str, float, float, Optional[int]], None]] = None,
+    ) -> None:
+        self.trace_memory = trace_memory
+        self.on_phase = on_phase
+        self.phases: Dict[str, Dict[str, Any]] = {}
+        self.page_times: List[Tuple[int, float]] = []
+        self.throughputs: Dict[str, Dict[str, Any]] = {}
+        self._peaks: List[int] = []
+        self._owns_tracing = False
+
+    def start(self) -> "Profiler":
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        return self
+
+    def stop(self) -> None:
+        if self._owns_tracing:
+            tracemalloc.stop()
+            self._owns_tracing = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # reset_peak() is global: hand the peak seen so far to the parent.
+            peak = tracemalloc.get_traced_memory()[1]
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            self._peaks.append(0)
+            tracemalloc.reset_peak()
+        w0 = time.perf_counter()
+        c0 = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - w0
+            cpu = time.process_time() - c0
+            peak_bytes = None
+            if tracing:
+                peak_bytes = max(tracemalloc.get_traced_memory()[1], self._peaks.pop())
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak_bytes)
+            self._add(name, 1, wall, cpu, peak_bytes)
+            if self.on_phase is not None:
+                self.on_phase(name, wall, cpu, peak_bytes)
+
+    def _add(
+        self, name: str, calls: int, wall: float, cpu: float, peak_bytes: Optional[int]
+    ) -> None:
+        rec = self.phases.setdefault(
+            name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "peak_bytes": None}
+        )
+        rec["calls"] += calls
+        rec["wall_s"] += wall
+        rec["cpu_s"] += cpu
+        if peak_bytes is not None:
+            rec["peak_bytes"] = max(rec["peak_bytes"] or 0, peak_bytes)
+
+    def page_time(self, page: int, seconds: float) -> None:
+        self.page_times.append((page, seconds))
+
+    def throughput(self, name: str, items: int, seconds: float, unit: str = "items") -> None:
+        """Record items processed by a stage (e.g. pages rendered) and its time."""
+        rec = self.throughputs.setdefault(name, {"items": 0, "seconds": 0.0, "unit": unit})
+        rec["items"] += items
+        rec["seconds"] += seconds
+
+    def merge(
+        self, phases: Dict[str, Dict[str, Any]], page_times: List[Tuple[int, float]]
+    ) -> None:
+        """Fold in phases and page times recorded by a worker process."""
+        for name, rec in phases.items():
+            self._add(name, rec["calls"], rec["wall_s"], rec["cpu_s"], rec["peak_bytes"])
+        self.page_times.extend(page_times)
+
+    def report(self, slowest: int = 5) -> Dict[str, Any]:
+        phases = {
+            name: {
+                "calls": rec["calls"],
+                "wall_ms": round(rec["wall_s"] * 1000.0, 3),
+                "cpu_ms": round(rec["cpu_s"] * 1000.0, 3),
+                "peak_mb": (
+                    round(rec["peak_bytes"] / (1024 * 1024), 3)
+                    if rec["peak_bytes"] is not None
+                    else None
+                ),
+            }
+            for name, rec in self.phases.items()
+        }
+        times = sorted(s for _, s in self.page_times)
+
+        def pct(q: float) -> float:
+            # nearest-rank percentile
+            if not times:
+                return 0.0
+            k = max(0, math.ceil(q * len(times)) - 1)
+            return round(times[k] * 1000.0, 3)
+
+        worst = sorted(self.page_times, key=lambda pt: -pt[1])[:slowest]
+        report: Dict[str, Any] = {
+            "phases": phases,
+            "pages": {
+                "count": len(times),
+                "p50_ms": pct(0.50),
+                "p90_ms": pct(0.90),
+                "p99_ms": pct(0.99),
+                "max_ms": pct(1.0),
+                "slowest": [
+                    {"page": p, "ms": round(s * 1000.0, 3)} for p, s in worst
+                ],
+            },
+        }
+        if self.throughputs:
+            report["throughput"] = {
+                name: {
+                    "items": rec["items"],
+                    "unit": rec["unit"],
+                    "seconds": round(rec["seconds"], 3),
+                    "per_s": (
+                        round(rec["items"] / rec["seconds"], 1)
+                        if rec["items"] and rec["seconds"]
+                        else None
+                    ),
+                }
+                for name, rec in self.throughputs.items()
+            }
+        return report
+
+
+def _phase(profiler: Optional[Profiler], name: str):
+    return profiler.phase(name) if profiler is not None else nullcontext()
+
+
+def _prom_label(value: Any) -> str:
+    # Exposition format: backslash, double quote and newline are escaped.
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_prometheus_textfile(
+    path: str, timings: Dict[str, Any], labels: Dict[str, str]
+) -> None:
+    """Write timings in the node_exporter textfile-collector format (atomically)."""
+    base = ",".join(f'{k}="{_prom_label(v)}"' for k, v in sorted(labels.items()))
+    out = [
+        "# HELP pdf_extract_phase_wall_seconds Wall time per extraction phase.",
+        "# TYPE pdf_extract_phase_wall_seconds gauge",
+    ]
+    for name, rec in timings["phases"].items():
+        out.append(
+            f'pdf_extract_phase_wall_seconds{{{base},phase="{_prom_label(name)}"}} '
+            f'{rec["wall_ms"] / 1000.0}'
+        )
+    out += [
+        "# HELP pdf_extract_phase_cpu_seconds CPU time per extraction phase.",
+        "# TYPE pdf_extract_phase_cpu_seconds gauge",
+    ]
+    for name, rec in timings["phases"].items():
+        out.append(
+            f'pdf_extract_phase_cpu_seconds{{{base},phase="{_prom_label(name)}"}} '
+            f'{rec["cpu_ms"] / 1000.0}'
+        )
+    out += [
+        "# HELP pdf_extract_phase_peak_bytes tracemalloc peak per extraction phase.",
+        "# TYPE pdf_extract_phase_peak_bytes gauge",
+    ]
+    for name, rec in timings["phases"].items():
+        if rec["peak_mb"] is not None:
+            out.append(
+                f'pdf_extract_phase_peak_bytes{{{base},phase="{_prom_label(name)}"}} '
+                f'{int(rec["peak_mb"] * 1024 * 1024)}'
+            )
+    pages = timings["pages"]
+    out += [
+        "# HELP pdf_extract_page_decode_seconds Per-page decode time quantiles.",
+        "# TYPE pdf_extract_page_decode_seconds gauge",
+    ]
+    for q, key in (("0.5", "p50_ms"), ("0.9", "p90_ms"), ("0.99", "p99_ms"), ("1", "max_ms")):
+        out.append(
+            f'pdf_extract_page_decode_seconds{{{base},quantile="{q}"}} {pages[key] / 1000.0}'
+        )
+    out += [
+        "# HELP pdf_extract_pages Pages decoded.",
+        "# TYPE pdf_extract_pages gauge",
+        f"pdf_extract_pages{{{base}}} {pages['count']}",
+    ]
+    throughput = timings.get("throughput", {})
+    if throughput:
+        out += [
+            "# HELP pdf_extract_stage_items_per_second Items per second per stage.",
+            "# TYPE pdf_extract_stage_items_per_second gauge",
+        ]
+        for name, rec in throughput.items():
+            if rec["per_s"] is not None:
+                out.append(
+                    f'pdf_extract_stage_items_per_second{{{base},stage="{_prom_label(name)}"}} '
+                    f'{rec["per_s"]}'
+                )
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("\n".join(out) + "\n")
+    os.replace(tmp, path)
+
+
+class Block:
+    """
+    One kept line of a section. The postprocess stages mutate blocks in
+    place; dicts are only built at serialization (to_dict / json_default).
+    """
+
+    __slots__ = ("page", "text", "kind", "bullet_level", "normalized_text")
+
+    def __init__(self, page: int, text: str) -> None:
+        self.page = page
+        self.text = text
+        self.kind: Optional[str] = None
+        self.bullet_level: Optional[int] = None
+        self.normalized_text: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.kind is None:
+            return {"page": self.page, "text": self.text}
+        return {
+            "page": self.page,
+            "text": self.text,
+            "kind": self.kind,
+            "bullet_level": self.bullet_level,
+            "normalized_text": self.normalized_text,
+        }
+
+
+def json_default(obj: Any) -> Any:
+    if isinstance(obj, Block):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def normalize_sub_bullet(blk: Block) -> bool:
+    t = blk.text.lstrip()
+    m = SUB_BULLET_RE.match(t) or SUB_BULLET_SQUARE_RE.match(t)
+    if m:
+        rest = m.group(1).strip()
+        if rest:
+            blk.text = f"{SUB_BULLET_PREFIX}{rest}"
+            return True
+    return False
+
+
+def normalize_sub_bullets(blocks: List[Block]) -> Tuple[List[Block], int]:
     count = 0
     for blk in blocks:
-        text = blk.get("text", "")
-        t = text.lstrip()
-        m = SUB_BULLET_RE.match(t) or SUB_BULLET_SQUARE_RE.match(t)
-        if m:
-            rest = m.group(1).strip()
-            if rest:
-                nb = dict(blk)
-                nb["text"] = f"{SUB_BULLET_PREFIX}{rest}"
-                out.append(nb)
-                count += 1
-                continue
-        out.append(blk)
-    return (out, count)
+        if normalize_sub_bullet(blk):
+            count += 1
+    return (blocks, count)
 
 
 def is_title_case_label(label: str) -> bool:
@@ -210,56 +510,62 @@ def parse_bullet(text: str) -> Tuple[bool, Optional[int], str]:
     return (False, None, text.strip())
 
 
-def annotate_blocks(blocks: List[Dict[str, Any]], kind_override: Optional[str] = None) -> None:
-    for blk in blocks:
-        text = blk.get("text", "")
-        is_bullet, level, norm = parse_bullet(text)
-        kind = kind_override
-        if not kind:
-            if is_qcm_line(text):
-                kind = "qcm"
-            elif is_bullet:
-                kind = "bullet"
-            elif is_label_line(text):
-                kind = "label"
-            elif is_title_line(text):
-                kind = "title"
-            else:
-                kind = "paragraph"
-        blk["kind"] = kind
-        blk["bullet_level"] = level
-        blk["normalized_text"] = norm
+def annotate_block(blk: Block, kind_override: Optional[str] = None) -> None:
+    text = blk.text
+    is_bullet, level, norm = parse_bullet(text)
+    kind = kind_override
+    if not kind:
+        if is_qcm_line(text):
+            kind = "qcm"
+        elif is_bullet:
+            kind = "bullet"
+        elif is_label_line(text):
+            kind = "label"
+        elif is_title_line(text):
+            kind = "title"
+        else:
+            kind = "paragraph"
+    blk.kind = kind
+    blk.bullet_level = level
+    blk.normalized_text = norm
 
 
-def split_label_lines(blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
-    out: List[Dict[str, Any]] = []
+def annotate_blocks(blocks: List[Block], kind_override: Optional[str] = None) -> None:
+    for blk in blocks:
+        annotate_block(blk, kind_override)
+
+
+def split_label_line(blk: Block) -> Optional[Block]:
+    """Split "Label En France ..." in place; returns the new rest block, if any."""
+    text = blk.text.strip()
+    if not text or is_new_bullet(text):
+        return None
+    m = EN_FRANCE_RE.search(text)
+    if not m:
+        return None
+    label = text[: m.start()].strip()
+    rest = text[m.start() :].strip()
+    if not label or not rest:
+        return None
+    if label.endswith((",", ":", ";", ".")):
+        return None
+    if not is_title_case_label(label):
+        return None
+    if len(rest) < 25 or len(rest) < (len(label) + 10):
+        return None
+    blk.text = label
+    return Block(blk.page, rest)
+
+
+def split_label_lines(blocks: List[Block]) -> Tuple[List[Block], int]:
+    out: List[Block] = []
     count = 0
     for blk in blocks:
-        text = blk.get("text", "").strip()
-        if not text or is_new_bullet(text):
-            out.append(blk)
-            continue
-        m = re.search(r"\bEn France\b", text)
-        if not m:
-            out.append(blk)
-            continue
-        label = text[: m.start()].strip()
-        rest = text[m.start() :].strip()
-        if not label or not rest:
-            out.append(blk)
-            continue
-        if label.endswith((",", ":", ";", ".")):
-            out.append(blk)
-            continue
-        if not is_title_case_label(label):
-            out.append(blk)
-            continue
-        if len(rest) < 25 or len(rest) < (len(label) + 10):
-            out.append(blk)
-            continue
-        out.append({"page": blk.get("page"), "text": label})
-        out.append({"page": blk.get("page"), "text": rest})
-        count += 1
+        rest = split_label_line(blk)
+        out.append(blk)
+        if rest is not None:
+            out.append(rest)
+            count += 1
     return (out, count)
 
 
@@ -330,56 +636,62 @@ def merge_line_text(text: str, next_text: str) -> str:
     return f"{lead}{t} {n}"
 
 
-def merge_bullets_blocks(blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
-    merged: List[Dict[str, Any]] = []
+def merge_bullets_blocks(blocks: List[Block]) -> Tuple[List[Block], int]:
+    # Compacts in place: w is the write index, always <= the read index i.
     merges = 0
+    n = len(blocks)
+    w = 0
     i = 0
-    while i < len(blocks):
+    while i < n:
         cur = blocks[i]
-        text = cur.get("text", "").strip()
+        text = cur.text.strip()
         if text in BULLET_ONLY:
-            page = cur.get("page")
+            page = cur.page
             j = i + 1
             merged_here = False
-            while j < len(blocks):
+            while j < n:
                 nxt = blocks[j]
-                if nxt.get("page") != page:
+                if nxt.page != page:
                     break
-                next_text = nxt.get("text", "").strip()
+                next_text = nxt.text.strip()
                 if not next_text:
                     j += 1
                     continue
                 if is_new_bullet(next_text):
                     break
-                merged.append(
-                    {"page": nxt["page"], "text": f"{BULLET_ONLY[text]}{next_text}"}
-                )
+                nxt.text = f"{BULLET_ONLY[text]}{next_text}"
+                blocks[w] = nxt
+                w += 1
                 merges += 1
                 i = j + 1
                 merged_here = True
                 break
             if merged_here:
                 continue
-        merged.append(cur)
+        blocks[w] = cur
+        w += 1
         i += 1
-    return (merged, merges)
+    del blocks[w:]
+    return (blocks, merges)
 
 
-def merge_wrap_blocks(blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
-    merged: List[Dict[str, Any]] = []
+def merge_wrap_blocks(blocks: List[Block]) -> Tuple[List[Block], int]:
+    # Compacts in place like merge_bullets_blocks; empty lines are dropped.
     merges = 0
+    n = len(blocks)
+    w = 0
     i = 0
-    while i < len(blocks):
+    while i < n:
         cur = blocks[i]
-        raw = cur.get("text", "")
+        raw = cur.text
         if not raw or not raw.strip():
             i += 1
             continue
-        page = cur.get("page")
+        page = cur.page
         out_text = raw.rstrip()
         j = i
-        while j + 1 < len(blocks) and blocks[j + 1].get("page") == page:
-            next_raw = blocks[j + 1].get("text", "")
+        while j + 1 < n and blocks[j + 1].page == page:
+            next_raw = blocks[j + 1].text
             if not next_raw or not next_raw.strip():
                 j += 1
                 continue
@@ -388,9 +700,12 @@ def merge_wrap_blocks(blocks: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]
             out_text = merge_line_text(out_text, next_raw)
             merges += 1
             j += 1
-        merged.append({"page": page, "text": out_text})
+        cur.text = out_text
+        blocks[w] = cur
+        w += 1
         i = j + 1
-    return (merged, merges)
+    del blocks[w:]
+    return (blocks, merges)
 
 
 def is_qcm_line(text: str) -> bool:
@@ -400,16 +715,16 @@ def is_qcm_line(text: str) -> bool:
 
 
 def split_qcm_blocks(
-    blocks: List[Dict[str, Any]], qcm_mode: str
-) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], bool]:
+    blocks: List[Block], qcm_mode: str
+) -> Tuple[List[Block], List[Block], bool]:
     if qcm_mode == "include":
         return (blocks, [], False)
-    course: List[Dict[str, Any]] = []
-    qcm: List[Dict[str, Any]] = []
+    course: List[Block] = []
+    qcm: List[Block] = []
     in_qcm = False
     found = False
     for blk in blocks:
-        text = blk.get("text", "").strip()
+        text = blk.text.strip()
         if not in_qcm and is_qcm_line(text):
             in_qcm = True
             found = True
@@ -421,12 +736,142 @@ def split_qcm_blocks(
     return (course, qcm, found)
 
 
+class FusedPostprocessor:
+    """
+    One streaming pass equivalent to the multi-pass pipeline (sub-bullet
+    normalization, lonely-bullet merge, wrap merge, label split, QCM split,
+    annotation). Lookahead is a held bullet marker plus any empty lines
+    behind it, and one pending line for wrap merging.
+    """
+
+    def __init__(
+        self,
+        merge_bullets: bool,
+        merge_wrap: bool,
+        qcm_mode: str,
+        stats: Dict[str, int],
+    ) -> None:
+        self.merge_bullets = merge_bullets
+        self.merge_wrap = merge_wrap
+        self.qcm_mode = qcm_mode
+        self.stats = stats
+
+    def run(self, blocks: List[Block]) -> Tuple[List[Block], List[Block], bool]:
+        self.course: List[Block] = []
+        self.qcm: List[Block] = []
+        self.in_qcm = False
+        self.found = False
+        self.held: List[Block] = []
+        self.wrap_cur: Optional[Block] = None
+        self.wrap_text = ""
+        for blk in blocks:
+            if self.merge_bullets:
+                if normalize_sub_bullet(blk):
+                    self.stats["o_normalized_count"] += 1
+                self._push_bullets(blk)
+            else:
+                self._push_wrap(blk)
+        while self.held:
+            held, self.held = self.held, []
+            self._push_wrap(held[0])
+            for blk in held[1:]:
+                self._push_bullets(blk)
+        if self.wrap_cur is not None:
+            self.wrap_cur.text = self.wrap_text
+            self._push_tail(self.wrap_cur)
+            self.wrap_cur = None
+        return (self.course, self.qcm, self.found)
+
+    def _push_bullets(self, blk: Block) -> None:
+        held = self.held
+        if not held:
+            if blk.text.strip() in BULLET_ONLY:
+                held.append(blk)
+            else:
+                self._push_wrap(blk)
+            return
+        marker = held[0]
+        if blk.page == marker.page:
+            next_text = blk.text.strip()
+            if not next_text:
+                held.append(blk)
+                return
+            if not is_new_bullet(next_text):
+                blk.text = f"{BULLET_ONLY[marker.text.strip()]}{next_text}"
+                self.held = []
+                self.stats["bullets_merged"] += 1
+                self.stats["lonely_bullets_merged_count"] += 1
+                self._push_wrap(blk)
+                return
+        # No merge: emit the marker alone and replay what was held behind it.
+        self.held = []
+        self._push_wrap(marker)
+        for b in held[1:]:
+            self._push_bullets(b)
+        self._push_bullets(blk)
+
+    def _push_wrap(self, blk: Block) -> None:
+        if not self.merge_wrap:
+            self._push_tail(blk)
+            return
+        raw = blk.text
+        cur = self.wrap_cur
+        if cur is not None:
+            if blk.page == cur.page:
+                if not raw or not raw.strip():
+                    return
+                if should_merge_lines(self.wrap_text, raw):
+                    self.wrap_text = merge_line_text(self.wrap_text, raw)
+                    self.stats["wraps_merged"] += 1
+                    return
+            cur.text = self.wrap_text
+            self.wrap_cur = None
+            self._push_tail(cur)
+        if not raw or not raw.strip():
+            return
+        self.wrap_cur = blk
+        self.wrap_text = raw.rstrip()
+
+    def _push_tail(self, blk: Block) -> None:
+        if not self.merge_wrap:
+            self._route(blk)
+            return
+        rest = split_label_line(blk)
+        self._route(blk)
+        if rest is not None:
+            self.stats["label_splits_count"] += 1
+            self._route(rest)
+
+    def _route(self, blk: Block) -> None:
+        if self.qcm_mode == "include":
+            annotate_block(blk)
+            self.course.append(blk)
+            return
+        if not self.in_qcm and is_qcm_line(blk.text.strip()):
+            self.in_qcm = True
+            self.found = True
+        if self.in_qcm:
+            if self.qcm_mode == "separate":
+                annotate_block(blk, kind_override="qcm")
+                self.qcm.append(blk)
+        else:
+            annotate_block(blk)
+            self.course.append(blk)
+
+
 def postprocess_sections(
     sections: List[Dict[str, Any]],
     merge_bullets: bool,
     merge_wrap: bool,
     qcm_mode: str,
+    engine: str = "fused",
+    profiler: Optional[Profiler] = None,
 ) -> Dict[str, int]:
+    """
+    engine="fused" runs FusedPostprocessor; engine="reference" runs the
+    stage functions one after the other. Both give the same blocks and stats.
+    With a profiler, the reference engine is timed stage by stage.
+    """
     stats = {
         "o_normalized_count": 0,
         "bullets_merged": 0,
@@ -436,59 +881,326 @@ def postprocess_sections(
         "qcm_sections": 0,
         "qcm_blocks": 0,
     }
+    fused = FusedPostprocessor(merge_bullets, merge_wrap, qcm_mode, stats)
     for sec in sections:
         blocks = sec.get("blocks", [])
+        if engine == "fused":
+            with _phase(profiler, "postprocess.fused"):
+                course, qcm, found = fused.run(blocks)
+            sec["blocks"] = course
+            if qcm_mode == "separate":
+                sec["qcm_blocks"] = qcm
+                stats["qcm_blocks"] += len(qcm)
+            if found:
+                stats["qcm_sections"] += 1
+            continue
         if merge_bullets:
-            blocks, m = normalize_sub_bullets(blocks)
+            with _phase(profiler, "postprocess.normalize_sub_bullets"):
+                blocks, m = normalize_sub_bullets(blocks)
             stats["o_normalized_count"] += m
-            blocks, m = merge_bullets_blocks(blocks)
+            with _phase(profiler, "postprocess.merge_bullets"):
+                blocks, m = merge_bullets_blocks(blocks)
             stats["bullets_merged"] += m
             stats["lonely_bullets_merged_count"] += m
         if merge_wrap:
-            blocks, m = merge_wrap_blocks(blocks)
+            with _phase(profiler, "postprocess.merge_wrap"):
+                blocks, m = merge_wrap_blocks(blocks)
             stats["wraps_merged"] += m
-            blocks, m = split_label_lines(blocks)
+            with _phase(profiler, "postprocess.split_labels"):
+                blocks, m = split_label_lines(blocks)
             stats["label_splits_count"] += m
-        course, qcm, found = split_qcm_blocks(blocks, qcm_mode)
+        with _phase(profiler, "postprocess.split_qcm"):
+            course, qcm, found = split_qcm_blocks(blocks, qcm_mode)
         sec["blocks"] = course
-        annotate_blocks(sec["blocks"])
+        with _phase(profiler, "postprocess.annotate"):
+            annotate_blocks(sec["blocks"])
+            if qcm_mode == "separate":
+                annotate_blocks(qcm, kind_override="qcm")
         if qcm_mode == "separate":
             sec["qcm_blocks"] = qcm
-            annotate_blocks(sec["qcm_blocks"], kind_override="qcm")
             stats["qcm_blocks"] += len(qcm)
         if found:
             stats["qcm_sections"] += 1
     return stats
 
 
-def compute_text_stats(
-    doc: fitz.Document, sample_pages: int = 8
-) -> Tuple[float, float]:
+# Line record of the page-layout layer: (text, y0, y1, max_size, median_size).
+LineRecord = Tuple[str, float, float, float, float]
+
+# get_text("dict") flags without TEXT_PRESERVE_IMAGES: image blocks (and
+# their encoded bytes) are never materialized. Image metadata comes from
+# page.get_images(full=True) instead.
+TEXT_DICT_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+
+def _xref_digest(doc: fitz.Document, xref: int, cache: Dict[Any, str]) -> str:
+    digest = cache.get(xref)
+    if digest is None:
+        if doc.xref_is_stream(xref):
+            raw = doc.xref_stream_raw(xref) or b""
+        else:
+            raw = doc.xref_object(xref, compressed=True).encode("utf-8")
+        digest = cache[xref] = hashlib.sha256(raw).hexdigest()
+    return digest
+
+
+def _image_digest(doc: fitz.Document, xref: int, cache: Dict[Any, str]) -> str:
+    # The image dictionary (size, filters, /Length of the encoded stream),
+    # not its bytes: reading every image stream would cost more than the
+    # text decode on image-heavy pages.
+    key = ("image", xref)
+    digest = cache.get(key)
+    if digest is None:
+        raw = doc.xref_object(xref, compressed=True).encode("utf-8")
+        digest = cache[key] = hashlib.sha256(raw).hexdigest()
+    return digest
+
+
+def _font_digest(doc: fitz.Document, font: Tuple[Any, ...], cache: Dict[Any, str]) -> str:
+    key = ("font", font[0])
+    digest = cache.get(key)
+    if digest is None:
+        digest = f"{font[3]}:{font[5]}:"
+        kind, value = doc.xref_get_key(font[0], "ToUnicode")
+        if kind == "xref":
+            digest += _xref_digest(doc, int(value.split()[0]), cache)
+        cache[key] = digest
+    return digest
+
+
+def page_fingerprint(
+    page: fitz.Page,
+    xref_hashes: Optional[Dict[Any, str]] = None,
+    images: Optional[List[Tuple[Any, ...]]] = None,
+) -> str:
     """
-    Heuristic: gather font sizes from first pages, pick a robust body size,
-    set title threshold = max(body + 2.5, body * 1.18)
+    Fingerprint of a page's source content, cheap enough to compute without
+    decoding it: geometry, content stream, the bytes of the ToUnicode maps
+    and form XObjects it uses, and the dictionaries of its images (an
+    image replaced by one with the same size, filters and encoded length
+    goes unnoticed; text changes never do). Resources are keyed by their
+    name on the page rather than their xref number, so an edition saved
+    again (with renumbered objects) keeps the fingerprints of its
+    unchanged pages. xref_hashes caches object digests across pages, and
+    the font and form digests of a /Resources object shared by several
+    pages; images is page.get_images(full=True) when the caller already
+    has it.
+    """
+    doc = page.parent
+    cache = {} if xref_hashes is None else xref_hashes
+    h = hashlib.sha256()
+    h.update(f"{tuple(page.rect)}|{page.rotation}|".encode("ascii"))
+    h.update(page.read_contents())
+    kind, value = doc.xref_get_key(page.xref, "Resources")
+    res_key = ("resources", value) if kind == "xref" else None
+    fonts_xobjects = cache.get(res_key) if res_key else None
+    if fonts_xobjects is None:
+        fonts = "".join(
+            f"|F{font[4]}:{_font_digest(doc, font, cache)}"
+            for font in page.get_fonts(full=True)
+        )
+        xobjects = "".join(
+            f"|X{xobj[1]}:{_xref_digest(doc, xobj[0], cache)}"
+            for xobj in page.get_xobjects()
+        )
+        fonts_xobjects = (fonts.encode("utf-8"), xobjects.encode("utf-8"))
+        if res_key:
+            cache[res_key] = fonts_xobjects
+    h.update(fonts_xobjects[0])
+    if images is None:
+        images = page.get_images(full=True)
+    for img in images:
+        h.update(f"|I{img[7]}:{_image_digest(doc, img[0], cache)}".encode("utf-8"))
+    h.update(fonts_xobjects[1])
+    return h.hexdigest()[:16]
+
+
+def _page_images(raw: List[Tuple[Any, ...]]) -> List[List[Any]]:
+    return [[img[0], img[2], img[3], img[4], str(img[5])] for img in raw]
+
+
+def decode_page_layout(
+    page: fitz.Page,
+    profiler: Optional[Profiler] = None,
+    text_flags: int = TEXT_DICT_FLAGS,
+    xref_hashes: Optional[Dict[Any, str]] = None,
+    fingerprint: bool = True,
+) -> Dict[str, Any]:
+    """
+    Decode one page into the compact layout record shared by font stats,
+    header/footer detection and extraction:
+    {"height", "lines": [LineRecord], "span_sizes": [[size, count]], "images",
+     "fingerprint"}
+    The fingerprint (see page_fingerprint) is only needed to diff editions;
+    without fingerprint, it is None.
     """
-    sizes: List[float] = []
+    lines: List[LineRecord] = []
     size_counts: Counter = Counter()
-    for i in range(min(sample_pages, len(doc))):
-        page = doc[i]
-        d = page.get_text("dict")
+    with _phase(profiler, "decode.text"):
+        d = page.get_text("dict", flags=text_flags)
         for b in d.get("blocks", []):
-            if b.get("type") != 0:
+            if b.get("type") != 0:  # 0=text, 1=image, 2=drawing
                 continue
             for line in b.get("lines", []):
-                for sp in line.get("spans", []):
-                    t = norm_text(sp.get("text", ""))
-                    if t:
-                        size = float(sp.get("size", 0.0))
-                        if size > 0:
-                            sizes.append(size)
-                            size_counts[quantize_size(size)] += 1
-
-    body_median = median(sizes) or 12.0
+                spans = line.get("spans", [])
+                if not spans:
+                    continue
+                sizes = [float(sp.get("size", 0.0)) for sp in spans]
+                for sp, size in zip(spans, sizes):
+                    if size > 0 and norm_text(sp.get("text", "")):
+                        size_counts[size] += 1
+                text = spans_text(spans)
+                if not text:
+                    continue
+                y0, y1 = line_y_range(line, spans)
+                lines.append((text, y0, y1, max(sizes), median(sizes)))
+    with _phase(profiler, "decode.images"):
+        raw_images = page.get_images(full=True)
+        images = _page_images(raw_images)
+    digest = None
+    if fingerprint:
+        with _phase(profiler, "decode.fingerprint"):
+            digest = page_fingerprint(page, xref_hashes, raw_images)
+    return {
+        "height": float(page.rect.height),
+        "lines": lines,
+        "span_sizes": [[s, c] for s, c in sorted(size_counts.items())],
+        "images": images,
+        "fingerprint": digest,
+    }
+
+
+def decode_layout(
+    doc: fitz.Document,
+    start: int = 0,
+    stop: Optional[int] = None,
+    profiler: Optional[Profiler] = None,
+    fingerprints: bool = True,
+) -> List[Dict[str, Any]]:
+    if stop is None:
+        stop = len(doc)
+    xref_hashes: Dict[Any, str] = {}
+    if profiler is None:
+        return [
+            decode_page_layout(doc[pno], xref_hashes=xref_hashes, fingerprint=fingerprints)
+            for pno in range(start, stop)
+        ]
+    layout = []
+    for pno in range(start, stop):
+        t0 = time.perf_counter()
+        layout.append(
+            decode_page_layout(
+                doc[pno], profiler, xref_hashes=xref_hashes, fingerprint=fingerprints
+            )
+        )
+        profiler.page_time(pno + 1, time.perf_counter() - t0)
+    return layout
+
+
+def _decode_layout_range(
+    pdf_path: str, start: int, stop: int, timed: bool = False, fingerprints: bool = True
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[Dict[str, Any], List[Tuple[int, float]]]]]:
+    # Runs in a worker process: each worker opens its own document.
+    profiler = Profiler(trace_memory=False) if timed else None
+    with fitz.open(pdf_path) as doc:
+        layout = decode_layout(doc, start, stop, profiler=profiler, fingerprints=fingerprints)
+    if profiler is None:
+        return (layout, None)
+    return (layout, (profiler.phases, profiler.page_times))
+
+
+def decode_layout_parallel(
+    pdf_path: str,
+    page_count: int,
+    workers: int,
+    profiler: Optional[Profiler] = None,
+    fingerprints: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Decode page ranges across a process pool and concatenate them in page
+    order, so the result equals decode_layout() on the whole document.
+    """
+    # A few ranges per worker keeps the pool busy when page costs are uneven.
+    chunk = max(1, math.ceil(page_count / (workers * 4)))
+    starts = list(range(0, page_count, chunk))
+    stops = [min(s + chunk, page_count) for s in starts]
+    layout: List[Dict[str, Any]] = []
+    timed = [profiler is not None] * len(starts)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        for part, timings in ex.map(
+            _decode_layout_range,
+            [pdf_path] * len(starts),
+            starts,
+            stops,
+            timed,
+            [fingerprints] * len(starts),
+        ):
+            layout.extend(part)
+            if timings is not None:
+                profiler.merge(*timings)
+    return layout
+
+
+def median_from_counts(counts: Dict[float, int]) -> float:
+    """Same result as median() over the expanded values, without expanding them."""
+    items = sorted(counts.items())
+    n = sum(c for _, c in items)
+    if n == 0:
+        return 0.0
+
+    def nth(k: int) -> float:
+        seen = 0
+        for value, c in items:
+            seen += c
+            if k < seen:
+                return value
+        return 0.0
+
+    mid = n // 2
+    return nth(mid) if n % 2 == 1 else (nth(mid - 1) + nth(mid)) / 2.0
+
+
+def size_histogram(
+    layout: List[Dict[str, Any]], sample_pages: int = 8
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(span sizes, span counts) over the first sample_pages pages."""
+    pairs = [sc for page in layout[: max(0, sample_pages)] for sc in page["span_sizes"]]
+    if not pairs:
+        return (np.zeros(0), np.zeros(0))
+    arr = np.asarray(pairs, dtype=np.float64)
+    return (arr[:, 0], arr[:, 1])
+
+
+def weighted_median(values: np.ndarray, counts: np.ndarray) -> float:
+    """Same result as median_from_counts() over (value, count) arrays."""
+    uniq, inv = np.unique(values, return_inverse=True)
+    cum = np.cumsum(np.bincount(inv, weights=counts))
+    n = int(cum[-1]) if len(cum) else 0
+    if n == 0:
+        return 0.0
+    mid = n // 2
+    hi = float(uniq[np.searchsorted(cum, mid, side="right")])
+    if n % 2 == 1:
+        return hi
+    return (float(uniq[np.searchsorted(cum, mid - 1, side="right")]) + hi) / 2.0
+
+
+def compute_text_stats(
+    layout: List[Dict[str, Any]], sample_pages: int = 8
+) -> Tuple[float, float]:
+    """
+    Heuristic: gather font sizes from first pages, pick a robust body size,
+    set title threshold = max(body + 2.5, body * 1.18)
+    """
+    sizes, counts = size_histogram(layout, sample_pages)
+    body_median = weighted_median(sizes, counts) or 12.0
     body_mode = None
-    if size_counts:
-        body_mode = max(size_counts.items(), key=lambda kv: (kv[1], -kv[0]))[0]
+    if len(sizes):
+        # quantize_size() on the array; np.round also rounds half to even.
+        quantized = np.where(sizes > 0, np.round(sizes / 0.5) * 0.5, 0.0)
+        uniq, inv = np.unique(quantized, return_inverse=True)
+        # argmax takes the first maximum: the smallest size among ties.
+        body_mode = float(uniq[np.argmax(np.bincount(inv, weights=counts))])
 
     body = body_mode if body_mode else body_median
     if body_mode and body_median:
@@ -500,46 +1212,96 @@ def compute_text_stats(
     return (body, title_threshold)
 
 
+LINE_IN_HEADER = 1
+LINE_IN_FOOTER = 2
+LINE_TITLE_SIZE = 4  # font sizes and length allow a title
+LINE_SHORT = 8  # under 20 characters
+LINE_SHORT_CHARS = 20
+
+
+def line_arrays(layout: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Columnar view of the line layer, one row per line in page order:
+    y0, y1, max_size, median_size, length, height (of its page) as arrays,
+    plus the texts as a list.
+    """
+    counts = np.fromiter((len(p["lines"]) for p in layout), dtype=np.int64, count=len(layout))
+    lines = [ln for page in layout for ln in page["lines"]]
+    texts = [ln[0] for ln in lines]
+    heights = np.fromiter((p["height"] for p in layout), dtype=np.float64, count=len(layout))
+    # One pass per column: zip(*lines) is slower on long documents.
+    arrays: Dict[str, Any] = {
+        name: np.array([ln[i] for ln in lines], dtype=np.float64)
+        for i, name in enumerate(("y0", "y1", "max_size", "median_size"), 1)
+    }
+    arrays["length"] = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    arrays["height"] = np.repeat(heights, counts)
+    arrays["text"] = texts
+    return arrays
+
+
+def line_flags(
+    arrays: Dict[str, Any],
+    header_band: float,
+    footer_band: float,
+    title_threshold: float,
+    max_title_chars: int,
+) -> np.ndarray:
+    """
+    LINE_* bits per line from batched comparisons: header/footer bands,
+    the size and length tests of is_title_candidate, short lines. The
+    text tests (PAGE_NUM_RE, has_alpha, repeated texts) stay per line.
+    """
+    h = arrays["height"]
+    mx, md = arrays["max_size"], arrays["median_size"]
+    flags = np.zeros(len(h), dtype=np.uint8)
+    flags[arrays["y0"] < header_band * h] |= LINE_IN_HEADER
+    flags[arrays["y1"] > (1.0 - footer_band) * h] |= LINE_IN_FOOTER
+    # If only one span is large, avoid false positives (drop caps, etc.)
+    drop_cap = (md < (title_threshold * 0.85)) & ((mx - md) > 2.0)
+    title = (arrays["length"] <= max_title_chars) & (mx >= title_threshold) & ~drop_cap
+    flags[title] |= LINE_TITLE_SIZE
+    flags[arrays["length"] < LINE_SHORT_CHARS] |= LINE_SHORT
+    return flags
+
+
 def collect_repeated_header_footer_texts(
-    doc: fitz.Document,
+    layout: List[Dict[str, Any]],
     header_band: float,
     footer_band: float,
     title_threshold: float,
     repeat_ratio: float = 0.6,
     min_repeat_pages: int = 3,
     max_len: int = 120,
+    arrays: Optional[Dict[str, Any]] = None,
 ) -> Tuple[Set[str], Set[str], Dict[str, Any]]:
+    """arrays: line_arrays(layout), when the caller already has them."""
+    if arrays is None:
+        arrays = line_arrays(layout)
     header_counts: Counter = Counter()
     footer_counts: Counter = Counter()
-    page_count = len(doc)
-
-    for pno in range(page_count):
-        page = doc[pno]
-        h = float(page.rect.height)
-        d = page.get_text("dict")
-        for b in d.get("blocks", []):
-            if b.get("type") != 0:
-                continue
-            for line in b.get("lines", []):
-                spans = line.get("spans", [])
-                if not spans:
-                    continue
-                y0, y1 = line_y_range(line, spans)
-                text = spans_text(spans)
-                if not text:
-                    continue
-                if len(text) > max_len:
-                    continue
-                if PAGE_NUM_RE.match(text):
-                    continue
-                # Do not consider large text for repeated headers/footers (likely titles)
-                max_size = max(float(sp.get("size", 0.0)) for sp in spans)
-                if max_size >= title_threshold:
-                    continue
-                if y0 < header_band * h:
-                    header_counts[text] += 1
-                elif y1 > (1.0 - footer_band) * h:
-                    footer_counts[text] += 1
+    page_count = len(layout)
+
+    h = arrays["height"]
+    in_header = arrays["y0"] < header_band * h
+    in_footer = arrays["y1"] > (1.0 - footer_band) * h
+    # Do not consider large text for repeated headers/footers (likely titles)
+    candidates = (
+        (in_header | in_footer)
+        & (arrays["length"] <= max_len)
+        & (arrays["max_size"] < title_threshold)
+    )
+    texts = arrays["text"]
+    for i, header in zip(
+        np.flatnonzero(candidates).tolist(), in_header[candidates].tolist()
+    ):
+        text = texts[i]
+        if PAGE_NUM_RE.match(text):
+            continue
+        if header:
+            header_counts[text] += 1
+        else:
+            footer_counts[text] += 1
 
     threshold = max(min_repeat_pages, math.ceil(page_count * repeat_ratio))
     repeated_headers = {t for t, c in header_counts.items() if c >= threshold}
@@ -575,10 +1337,91 @@ def is_title_candidate(
     if median_size < (title_threshold * 0.85) and (max_size - median_size) > 2.0:
         return False
     return True
-
-
+
+
+def decode_pdf_layout(
+    pdf_path: Optional[str],
+    workers: int = 1,
+    stream: Optional[PdfBuffer] = None,
+    profiler: Optional[Profiler] = None,
+    fingerprints: bool = True,
+) -> List[Dict[str, Any]]:
+    """Page layer of a PDF; workers need a path (an in-memory PDF decodes serially)."""
+    with _phase(profiler, "decode"):
+        if workers > 1 and pdf_path is not None:
+            with fitz.open(pdf_path) as doc:
+                page_count = len(doc)
+            return decode_layout_parallel(
+                pdf_path, page_count, workers, profiler, fingerprints=fingerprints
+            )
+        if stream is not None:
+            with fitz.open(stream=stream, filetype="pdf") as doc:
+                return decode_layout(doc, profiler=profiler, fingerprints=fingerprints)
+        with fitz.open(pdf_path) as doc:
+            return decode_layout(doc, profiler=profiler, fingerprints=fingerprints)
+
+
+def decode_layout_incremental(
+    pdf_path: Optional[str],
+    previous_layout: List[Dict[str, Any]],
+    stream: Optional[PdfBuffer] = None,
+    profiler: Optional[Profiler] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Decode a new edition of a document, reusing the previous edition's page
+    records for pages whose fingerprint is unchanged; only their images are
+    read again, since xref numbers belong to a file.
+    Returns (layout, number of pages reused).
+    """
+    known = {rec["fingerprint"]: rec for rec in previous_layout if rec.get("fingerprint")}
+    layout: List[Dict[str, Any]] = []
+    reused = 0
+    xref_hashes: Dict[Any, str] = {}
+    with _phase(profiler, "decode"):
+        if stream is not None:
+            doc = fitz.open(stream=stream, filetype="pdf")
+        else:
+            doc = fitz.open(pdf_path)
+        with doc:
+            for page in doc:
+                raw_images = page.get_images(full=True)
+                prev = known.get(page_fingerprint(page, xref_hashes, raw_images))
+                if prev is not None:
+                    layout.append({**prev, "images": _page_images(raw_images)})
+                    reused += 1
+                    continue
+                t0 = time.perf_counter()
+                layout.append(decode_page_layout(page, profiler, xref_hashes=xref_hashes))
+                if profiler is not None:
+                    profiler.page_time(page.number + 1, time.perf_counter() - t0)
+    return (layout, reused)
+
+
+def fill_page_fingerprints(
+    layout: List[Dict[str, Any]], source: PdfSource, profiler: Optional[Profiler] = None
+) -> bool:
+    """
+    Add the fingerprints missing from a page layer decoded without them,
+    from its PDF (path or in memory); no page is decoded again. Returns
+    whether any was added.
+    """
+    missing = [pno for pno, page in enumerate(layout) if not page.get("fingerprint")]
+    if not missing:
+        return False
+    xref_hashes: Dict[Any, str] = {}
+    with _phase(profiler, "decode.fingerprint"):
+        if isinstance(source, str):
+            doc = fitz.open(source)
+        else:
+            doc = fitz.open(stream=pdf_buffer(source), filetype="pdf")
+        with doc:
+            for pno in missing:
+                layout[pno]["fingerprint"] = page_fingerprint(doc[pno], xref_hashes)
+    return True
+
+
 def extract_structure_fast(
-    pdf_path: str,
+    pdf_path: PdfSource,
     header_band: float = 0.10,
     footer_band: float = 0.12,
     max_title_chars: int = 90,
@@ -589,51 +1432,343 @@ def extract_structure_fast(
     merge_wrap: bool = True,
     qcm_mode: str = "separate",
     image_dedup: str = "xref",
+    workers: int = 1,
+    profiler: Optional[Profiler] = None,
+    page_range: Optional[Tuple[int, Optional[int]]] = None,
+    deadline_ms: Optional[float] = None,
+    pdf_name: Optional[str] = None,
+    fingerprints: bool = False,
 ) -> Dict[str, Any]:
-    with fitz.open(pdf_path) as doc:
-        body_size, title_threshold = compute_text_stats(doc, sample_pages=sample_pages)
+    """
+    pdf_path is a path, or the PDF itself in memory (bytes, bytearray,
+    memoryview or a binary file object), opened without a temporary file;
+    pdf_name then names the document (default STREAM_PDF_NAME).
+    Page fingerprints (for diffs between editions, see extract_incremental)
+    are only computed, and page_fingerprints only present, with
+    fingerprints.
+    With a profiler (call its start() to trace memory), per-phase timings
+    are added to the result under "timings".
+    With page_range and/or deadline_ms, see extract_partial (serial decode).
+    """
+    stream = None
+    if not isinstance(pdf_path, str):
+        stream, pdf_path = pdf_buffer(pdf_path), None
+    params = dict(
+        header_band=header_band,
+        footer_band=footer_band,
+        max_title_chars=max_title_chars,
+        sample_pages=sample_pages,
+        repeat_ratio=repeat_ratio,
+        min_repeat_pages=min_repeat_pages,
+        merge_bullets=merge_bullets,
+        merge_wrap=merge_wrap,
+        qcm_mode=qcm_mode,
+        image_dedup=image_dedup,
+    )
+    if page_range is not None or deadline_ms is not None:
+        data, _ = extract_partial(
+            pdf_path,
+            page_range,
+            deadline_ms,
+            stream=stream,
+            profiler=profiler,
+            pdf_name=pdf_name,
+            fingerprints=fingerprints,
+            **params,
+        )
+    else:
+        layout = decode_pdf_layout(
+            pdf_path,
+            workers=workers,
+            stream=stream,
+            profiler=profiler,
+            fingerprints=fingerprints,
+        )
+        data = extract_structure_from_layout(
+            layout,
+            pdf_name=pdf_display_name(pdf_path, pdf_name),
+            profiler=profiler,
+            **params,
+        )
+    if profiler is not None:
+        data["timings"] = profiler.report()
+    return data
+
+
+def parse_page_range(spec: str) -> Tuple[int, Optional[int]]:
+    """"1-30", "31-" (to the end) or "5" -> (first, last), 1-based, inclusive."""
+    first, sep, last = spec.partition("-")
+    try:
+        start = int(first)
+        stop = (int(last) if last.strip() else None) if sep else start
+    except ValueError:
+        raise ValueError(f"invalid page range: {spec!r}")
+    if start < 1 or (stop is not None and stop < start):
+        raise ValueError(f"invalid page range: {spec!r}")
+    return (start, stop)
+
+
+def extract_partial(
+    pdf_path: Optional[str],
+    page_range: Optional[Tuple[int, Optional[int]]] = None,
+    deadline_ms: Optional[float] = None,
+    decoded: Optional[Dict[int, Dict[str, Any]]] = None,
+    stream: Optional[PdfBuffer] = None,
+    profiler: Optional[Profiler] = None,
+    pdf_name: Optional[str] = None,
+    fingerprints: bool = True,
+    **params: Any,
+) -> Tuple[Dict[str, Any], Dict[int, Dict[str, Any]]]:
+    """
+    Extraction bounded by a page range and/or a time budget, for previews.
+    Pages are decoded in order from the start of the range; decoding stops
+    at the range end, or before a page that would overrun deadline_ms at
+    the average page cost so far, with PARTIAL_OVERHEAD_RATIO of that cost
+    per page of the run set aside for assembly and writing the result (one
+    page is always decoded). The share set aside for pages decoded by
+    earlier calls is capped at half the budget, so a call that continues a
+    long run still makes progress (and may overrun by the excess).
+    The result covers the decoded run from the start of the range, with
+    absolute page numbers; header/footer repetition thresholds and logo
+    ratios scale to the pages seen. It also carries "pages" (document page
+    count), "pages_processed", "page_range" [first, last processed],
+    "next_page" (None once the document end is reached) and "complete"
+    (the whole document was covered: only a range starting at page 1 can
+    get there).
+    decoded maps page numbers to page records: pass the returned one back,
+    with the same page_range, to continue the run without decoding those
+    pages again; the run is re-assembled from its first page, so sections
+    and header/footer detection see every page decoded so far.
+    Returns (result, decoded).
+    """
+    t0 = time.perf_counter()
+    deadline = t0 + deadline_ms / 1000.0 if deadline_ms is not None else None
+    decoded = dict(decoded or {})
+    first, last = page_range or (1, None)
+    with _phase(profiler, "decode"):
+        if stream is not None:
+            doc = fitz.open(stream=stream, filetype="pdf")
+        else:
+            doc = fitz.open(pdf_path)
+        with doc:
+            page_count = len(doc)
+            if first > page_count:
+                raise ValueError(f"page range starts after the last page ({page_count})")
+            last = page_count if last is None else min(last, page_count)
+            xref_hashes: Dict[Any, str] = {}
+            spent, warmup, done, earlier = 0.0, 0.0, 0, 0
+            for pno in range(first, last + 1):
+                if pno in decoded:
+                    earlier += 1
+                    continue
+                if deadline is not None and done:
+                    # The first page decoded pays a warm-up: left out of the average.
+                    avg = spent / (done - 1) if done > 1 else warmup
+                    share = avg * PARTIAL_OVERHEAD_RATIO
+                    reserved = min(share * earlier, max(deadline_ms, 0.0) / 2000.0)
+                    after = reserved + share * (done + 1)
+                    if time.perf_counter() + avg + after > deadline:
+                        break
+                ts = time.perf_counter()
+                decoded[pno] = decode_page_layout(
+                    doc[pno - 1], profiler, xref_hashes=xref_hashes, fingerprint=fingerprints
+                )
+                if done:
+                    spent += time.perf_counter() - ts
+                else:
+                    warmup = time.perf_counter() - ts
+                done += 1
+                if profiler is not None:
+                    profiler.page_time(pno, time.perf_counter() - ts)
+
+    end = first - 1
+    while end < last and end + 1 in decoded:
+        end += 1
+    layout = [decoded[p] for p in range(first, end + 1)]
+    data = extract_structure_from_layout(
+        layout,
+        pdf_name=pdf_display_name(pdf_path, pdf_name),
+        profiler=profiler,
+        first_page=first,
+        **params,
+    )
+    data["pages"] = page_count
+    data["pages_processed"] = len(layout)
+    data["page_range"] = [first, end]
+    data["next_page"] = end + 1 if end < page_count else None
+    data["complete"] = first == 1 and end == page_count
+    return (data, decoded)
+
+
+def section_fingerprint(title: str, blocks: List[Any]) -> str:
+    """Fingerprint of a section: its title and normalized block texts."""
+    h = hashlib.sha256(norm_text(title).encode("utf-8"))
+    for blk in blocks:
+        text = blk.text if isinstance(blk, Block) else blk.get("text", "")
+        h.update(b"\n")
+        h.update(norm_text(text).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def diff_sections(
+    old: List[Dict[str, Any]], new: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Section-level diff between two editions. Sections are matched by
+    fingerprint first (unchanged); the rest are paired by title, in order
+    (changed); what is left is added or removed.
+    """
+    from collections import defaultdict, deque
+
+    def entry(i: int, sec: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "index": i,
+            "title": sec["title"],
+            "page_start": sec["page_start"],
+            "fingerprint": sec["fingerprint"],
+        }
+
+    old_by_fp: Dict[str, deque] = defaultdict(deque)
+    for i, sec in enumerate(old):
+        old_by_fp[sec["fingerprint"]].append(i)
+    matched: Set[int] = set()
+    unmatched_new = []
+    for i, sec in enumerate(new):
+        q = old_by_fp.get(sec["fingerprint"])
+        if q:
+            matched.add(q.popleft())
+        else:
+            unmatched_new.append(i)
+
+    old_by_title: Dict[str, deque] = defaultdict(deque)
+    for i, sec in enumerate(old):
+        if i not in matched:
+            old_by_title[normalize_label_key(sec["title"])].append(i)
+    added, changed = [], []
+    for i in unmatched_new:
+        sec = new[i]
+        q = old_by_title.get(normalize_label_key(sec["title"]))
+        if q:
+            j = q.popleft()
+            matched.add(j)
+            changed.append(
+                {
+                    **entry(i, sec),
+                    "previous_index": j,
+                    "previous_fingerprint": old[j]["fingerprint"],
+                }
+            )
+        else:
+            added.append(entry(i, sec))
+    removed = [entry(j, sec) for j, sec in enumerate(old) if j not in matched]
+    return {
+        "unchanged": len(new) - len(added) - len(changed),
+        "added": added,
+        "removed": removed,
+        "changed": changed,
+    }
+
+
+def iter_sections_from_layout(
+    layout: List[Dict[str, Any]],
+    summary: Dict[str, Any],
+    header_band: float = 0.10,
+    footer_band: float = 0.12,
+    max_title_chars: int = 90,
+    sample_pages: int = 8,
+    repeat_ratio: float = 0.6,
+    min_repeat_pages: int = 3,
+    merge_bullets: bool = True,
+    merge_wrap: bool = True,
+    qcm_mode: str = "separate",
+    image_dedup: str = "xref",
+    blocks_as_dicts: bool = True,
+    postprocess_engine: str = "fused",
+    profiler: Optional[Profiler] = None,
+    first_page: int = 1,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield each section, postprocessed and annotated, as soon as the next
+    title closes it. Once exhausted, summary holds pages, body_size,
+    title_threshold, stats, filters, images, and page_fingerprints when
+    the layout carries them.
+    With blocks_as_dicts=False, blocks stay Block objects (serialize them
+    with json_default). first_page is the page number of layout[0], for a
+    layout covering a page range.
+    """
+    with _phase(profiler, "text_stats"):
+        body_size, title_threshold = compute_text_stats(
+            layout, sample_pages=sample_pages
+        )
+    with _phase(profiler, "line_geometry"):
+        arrays = line_arrays(layout)
+        flags = line_flags(
+            arrays, header_band, footer_band, title_threshold, max_title_chars
+        ).tolist()
+    with _phase(profiler, "header_footer"):
         repeated_headers, repeated_footers, repeat_meta = (
             collect_repeated_header_footer_texts(
-                doc,
+                layout,
                 header_band=header_band,
                 footer_band=footer_band,
                 title_threshold=title_threshold,
                 repeat_ratio=repeat_ratio,
                 min_repeat_pages=min_repeat_pages,
+                arrays=arrays,
             )
         )
 
-        title_merge_gap = max(4.0, body_size * 0.8)
-
-        sections: List[Dict[str, Any]] = []
-        current = {"title": "Sans titre", "page_start": 1, "blocks": []}
-        pending_title: Dict[str, Any] = {}
-        images: List[Dict[str, Any]] = []
-        images_by_xref: Dict[int, Dict[str, Any]] = {}
-        seen_image_keys: Set[Tuple[int, int]] = set()
-        stats = {
-            "lines_total": 0,
-            "lines_kept": 0,
-            "lines_dropped_page_num": 0,
-            "lines_dropped_repeated": 0,
-            "lines_dropped_footer_short": 0,
-            "titles_found": 0,
-            "images_total": 0,
-            "images_unique": 0,
-            "o_normalized_count": 0,
-            "lonely_bullets_merged_count": 0,
-            "label_splits_count": 0,
-            "logos_flagged_count": 0,
-        }
+    title_merge_gap = max(4.0, body_size * 0.8)
+
+    # Sections are postprocessed one by one as they close; counters add up.
+    post_stats = postprocess_sections([], merge_bullets, merge_wrap, qcm_mode)
+
+    def finish(sec: Dict[str, Any]) -> Dict[str, Any]:
+        for k, v in postprocess_sections(
+            sections=[sec],
+            merge_bullets=merge_bullets,
+            merge_wrap=merge_wrap,
+            qcm_mode=qcm_mode,
+            engine=postprocess_engine,
+            profiler=profiler,
+        ).items():
+            post_stats[k] += v
+        sec["fingerprint"] = section_fingerprint(
+            sec["title"], sec["blocks"] + sec.get("qcm_blocks", [])
+        )
+        if blocks_as_dicts:
+            sec["blocks"] = [b.to_dict() for b in sec["blocks"]]
+            if "qcm_blocks" in sec:
+                sec["qcm_blocks"] = [b.to_dict() for b in sec["qcm_blocks"]]
+        return sec
+
+    current = {"title": "Sans titre", "page_start": first_page, "blocks": []}
+    pending_title: Dict[str, Any] = {}
+    images: List[Dict[str, Any]] = []
+    images_by_xref: Dict[int, Dict[str, Any]] = {}
+    seen_image_keys: Set[Tuple[int, int]] = set()
+    stats = {
+        "lines_total": 0,
+        "lines_kept": 0,
+        "lines_dropped_page_num": 0,
+        "lines_dropped_repeated": 0,
+        "lines_dropped_footer_short": 0,
+        "titles_found": 0,
+        "images_total": 0,
+        "images_unique": 0,
+        "o_normalized_count": 0,
+        "lonely_bullets_merged_count": 0,
+        "label_splits_count": 0,
+        "logos_flagged_count": 0,
+    }
 
-        for pno in range(len(doc)):
-            page = doc[pno]
-            for img in page.get_images(full=True):
-                xref = img[0]
-                width = img[2]
-                height = img[3]
-                bpc = img[4]
-                colorspace = img[5]
+    # Sections closed on a page are yielded after its assembly phase ends,
+    # so consumer time is not charged to assembly.
+    closed: List[Dict[str, Any]] = []
+    line_index = 0
+    for pno, page in enumerate(layout, first_page - 1):
+        with _phase(profiler, "assembly"):
+            for xref, width, height, bpc, colorspace in page["images"]:
                 stats["images_total"] += 1
                 if image_dedup == "xref":
                     if xref in images_by_xref:
@@ -644,7 +1779,7 @@ def extract_structure_fast(
                             "width": width,
                             "height": height,
                             "bpc": bpc,
-                            "colorspace": str(colorspace),
+                            "colorspace": colorspace,
                             "pages": {pno + 1},
                         }
                 else:
@@ -659,141 +1794,117 @@ def extract_structure_fast(
                             "width": width,
                             "height": height,
                             "bpc": bpc,
-                            "colorspace": str(colorspace),
+                            "colorspace": colorspace,
                         }
                     )
-            h = float(page.rect.height)
-            d = page.get_text("dict")
+            page_flags = flags[line_index : line_index + len(page["lines"])]
+            line_index += len(page["lines"])
 
-            for b in d.get("blocks", []):
-                if b.get("type") != 0:  # 0=text, 1=image, 2=drawing
-                    continue
-
-                # Collect line text + max font size + bbox y-range
-                for line in b.get("lines", []):
-                    spans = line.get("spans", [])
-                    if not spans:
-                        continue
+            for (text, y0, y1, _, _), f in zip(page["lines"], page_flags):
+                stats["lines_total"] += 1
 
-                    y0, y1 = line_y_range(line, spans)
+                in_header = f & LINE_IN_HEADER
+                in_footer = f & LINE_IN_FOOTER
 
-                    text = spans_text(spans)
-                    if not text:
-                        continue
+                # Drop page numbers in header/footer
+                if (in_header or in_footer) and PAGE_NUM_RE.match(text):
+                    stats["lines_dropped_page_num"] += 1
+                    continue
 
-                    stats["lines_total"] += 1
+                # Drop repeated headers/footers
+                if in_header and text in repeated_headers:
+                    stats["lines_dropped_repeated"] += 1
+                    continue
+                if in_footer and text in repeated_footers:
+                    stats["lines_dropped_repeated"] += 1
+                    continue
 
-                    in_header = y0 < header_band * h
-                    in_footer = y1 > (1.0 - footer_band) * h
+                # In footers, skip short leftover lines (often page metadata)
+                if in_footer and f & LINE_SHORT:
+                    stats["lines_dropped_footer_short"] += 1
+                    continue
 
-                    # Drop page numbers in header/footer
-                    if (in_header or in_footer) and PAGE_NUM_RE.match(text):
-                        stats["lines_dropped_page_num"] += 1
-                        continue
-
-                    # Drop repeated headers/footers
-                    if in_header and text in repeated_headers:
-                        stats["lines_dropped_repeated"] += 1
-                        continue
-                    if in_footer and text in repeated_footers:
-                        stats["lines_dropped_repeated"] += 1
-                        continue
-
-                    # In footers, skip short leftover lines (often page metadata)
-                    if in_footer and len(text) < 20:
-                        stats["lines_dropped_footer_short"] += 1
-                        continue
-
-                    max_size = max(float(sp.get("size", 0.0)) for sp in spans)
-                    med_size = median([float(sp.get("size", 0.0)) for sp in spans])
-
-                    # Title heuristic: bigger font + short line
-                    is_title = is_title_candidate(
-                        text=text,
-                        max_size=max_size,
-                        median_size=med_size,
-                        title_threshold=title_threshold,
-                        max_title_chars=max_title_chars,
-                    )
-
-                    if is_title:
-                        stats["titles_found"] += 1
-                        if pending_title and pending_title.get("page") == pno + 1:
-                            gap = y0 - float(pending_title.get("y1", 0.0))
-                            if gap <= title_merge_gap:
-                                pending_title["text"] = (
-                                    f"{pending_title['text']} {text}"
-                                )
-                                pending_title["y1"] = y1
-                                continue
-                        # finalize previous pending title
-                        if pending_title:
-                            if current["blocks"]:
-                                sections.append(current)
-                            current = {
-                                "title": pending_title["text"],
-                                "page_start": pending_title["page"],
-                                "blocks": [],
-                            }
-                        pending_title = {"text": text, "page": pno + 1, "y1": y1}
-                    else:
-                        if pending_title:
-                            if current["blocks"]:
-                                sections.append(current)
-                            current = {
-                                "title": pending_title["text"],
-                                "page_start": pending_title["page"],
-                                "blocks": [],
-                            }
-                            pending_title = {}
-                        current["blocks"].append({"page": pno + 1, "text": text})
-                        stats["lines_kept"] += 1
-
-        if pending_title:
-            if current["blocks"]:
-                sections.append(current)
-            current = {
-                "title": pending_title["text"],
-                "page_start": pending_title["page"],
-                "blocks": [],
-            }
-            pending_title = {}
+                # Title heuristic: bigger font + short line; the size and
+                # length tests of is_title_candidate are in the flags.
+                is_title = (
+                    f & LINE_TITLE_SIZE
+                    and not PAGE_NUM_RE.match(text)
+                    and has_alpha(text)
+                )
 
+                if is_title:
+                    stats["titles_found"] += 1
+                    if pending_title and pending_title.get("page") == pno + 1:
+                        gap = y0 - float(pending_title.get("y1", 0.0))
+                        if gap <= title_merge_gap:
+                            pending_title["text"] = f"{pending_title['text']} {text}"
+                            pending_title["y1"] = y1
+                            continue
+                    # finalize previous pending title
+                    if pending_title:
+                        if current["blocks"]:
+                            closed.append(current)
+                        current = {
+                            "title": pending_title["text"],
+                            "page_start": pending_title["page"],
+                            "blocks": [],
+                        }
+                    pending_title = {"text": text, "page": pno + 1, "y1": y1}
+                else:
+                    if pending_title:
+                        if current["blocks"]:
+                            closed.append(current)
+                        current = {
+                            "title": pending_title["text"],
+                            "page_start": pending_title["page"],
+                            "blocks": [],
+                        }
+                        pending_title = {}
+                    current["blocks"].append(Block(pno + 1, text))
+                    stats["lines_kept"] += 1
+        for sec in closed:
+            yield finish(sec)
+        closed.clear()
+
+    if pending_title:
         if current["blocks"]:
-            sections.append(current)
-
-        post_stats = postprocess_sections(
-            sections=sections,
-            merge_bullets=merge_bullets,
-            merge_wrap=merge_wrap,
-            qcm_mode=qcm_mode,
-        )
-        stats.update(post_stats)
-
-        if image_dedup == "xref":
-            images = []
-            total_pages = len(doc)
-            for meta in images_by_xref.values():
-                pages = sorted(meta.pop("pages"))
-                meta["page"] = pages[0] if pages else None
-                meta["pages"] = pages
-                area = int(meta.get("width", 0)) * int(meta.get("height", 0))
-                is_logo = False
-                if total_pages > 0:
-                    ratio = len(pages) / float(total_pages)
-                    is_logo = (ratio >= LOGO_REPEAT_RATIO) and (
-                        area < SMALL_AREA_THRESHOLD
-                    )
-                meta["is_repeated_logo"] = is_logo
-                if is_logo:
-                    stats["logos_flagged_count"] += 1
-                images.append(meta)
+            yield finish(current)
+        current = {
+            "title": pending_title["text"],
+            "page_start": pending_title["page"],
+            "blocks": [],
+        }
+        pending_title = {}
+
+    if current["blocks"]:
+        yield finish(current)
+
+    stats.update(post_stats)
+
+    if image_dedup == "xref":
+        images = []
+        total_pages = len(layout)
+        for meta in images_by_xref.values():
+            pages = sorted(meta.pop("pages"))
+            meta["page"] = pages[0] if pages else None
+            meta["pages"] = pages
+            area = int(meta.get("width", 0)) * int(meta.get("height", 0))
+            is_logo = False
+            if total_pages > 0:
+                ratio = len(pages) / float(total_pages)
+                is_logo = (ratio >= LOGO_REPEAT_RATIO) and (
+                    area < SMALL_AREA_THRESHOLD
+                )
+            meta["is_repeated_logo"] = is_logo
+            if is_logo:
+                stats["logos_flagged_count"] += 1
+            images.append(meta)
 
-        stats["images_unique"] = len(images)
+    stats["images_unique"] = len(images)
 
-        return {
-            "pdf": os.path.basename(pdf_path),
-            "pages": len(doc),
+    summary.update(
+        {
+            "pages": len(layout),
             "body_size": body_size,
             "title_threshold": title_threshold,
             "stats": stats,
@@ -809,11 +1920,69 @@ def extract_structure_fast(
                 "image_dedup": image_dedup,
                 **repeat_meta,
             },
-            "sections": sections,
             "images": images,  # metadata only; export lazy
         }
-
-
+    )
+    fingerprints = [page.get("fingerprint") for page in layout]
+    if any(fingerprints):
+        summary["page_fingerprints"] = fingerprints
+
+
+def extract_structure_from_layout(
+    layout: List[Dict[str, Any]], pdf_name: str, **params: Any
+) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {}
+    sections = list(iter_sections_from_layout(layout, summary, **params))
+    data = {
+        "pdf": pdf_name,
+        "pages": summary["pages"],
+        "body_size": summary["body_size"],
+        "title_threshold": summary["title_threshold"],
+        "stats": summary["stats"],
+        "filters": summary["filters"],
+        "sections": sections,
+        "images": summary["images"],
+    }
+    if "page_fingerprints" in summary:
+        data["page_fingerprints"] = summary["page_fingerprints"]
+    return data
+
+
+def decode_and_iter_sections(
+    pdf_path: PdfSource,
+    summary: Optional[Dict[str, Any]] = None,
+    workers: int = 1,
+    profiler: Optional[Profiler] = None,
+    **params: Any,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Decode the whole page layer of a PDF (path or in-memory, as for
+    extract_structure_fast), then yield its sections one at a time; pass
+    a summary dict to receive the trailing stats, filters and images once
+    iteration completes. Not a streaming decode: repeated headers and
+    footers are only known once every page is read, so the first section
+    comes after the full decode and the page layer stays in memory. What
+    is bounded is the section and block dicts held at once.
+    """
+    stream = None
+    if not isinstance(pdf_path, str):
+        stream, pdf_path = pdf_buffer(pdf_path), None
+    layout = decode_pdf_layout(
+        pdf_path, workers=workers, stream=stream, profiler=profiler, fingerprints=False
+    )
+    return iter_sections_from_layout(
+        layout, summary if summary is not None else {}, profiler=profiler, **params
+    )
+
+
+def image_png_bytes(doc: fitz.Document, xref: int) -> bytes:
+    pix = fitz.Pixmap(doc, xref)
+    # Convert CMYK/other to RGB
+    if pix.n - pix.alpha >= 4:
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    return pix.tobytes("png")
+
+
 def export_image_by_xref(pdf_path: str, xref: int, out_path: str) -> None:
     with fitz.open(pdf_path) as doc:
         pix = fitz.Pixmap(doc, xref)
@@ -822,13 +1991,1253 @@ def export_image_by_xref(pdf_path: str, xref: int, out_path: str) -> None:
             pix = fitz.Pixmap(fitz.csRGB, pix)
         os.makedirs(os.path.dirname(out_path), exist_ok=True)
         pix.save(out_path)
-
-
-def main():
-    import argparse
 
-    ap = argparse.ArgumentParser()
-    ap.add_argument("pdf", help="Path to PDF")
+
+IMAGE_EXPORT_FORMATS = {"png": "png", "jpeg": "jpg", "webp": "webp"}
+
+
+def _fit_dims(width: int, height: int, max_dim: Optional[int]) -> Tuple[int, int]:
+    if not max_dim or max(width, height) <= max_dim:
+        return (width, height)
+    scale = max_dim / float(max(width, height))
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
+def _pillow_image():
+    # MuPDF has no WebP writer; Pillow is only needed for this format.
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("WebP export requires Pillow (pip install pillow)")
+    return Image
+
+
+def encode_pixmap(
+    pix: fitz.Pixmap, fmt: str = "png", quality: int = 85, max_dim: Optional[int] = None
+) -> bytes:
+    """Encode a pixmap as PNG, JPEG or WebP, downscaled to fit max_dim."""
+    w, h = _fit_dims(pix.width, pix.height, max_dim)
+    if (w, h) != (pix.width, pix.height):
+        pix = fitz.Pixmap(pix, w, h, None)
+    if fmt == "png":
+        return pix.tobytes("png")
+    if fmt == "jpeg":
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)  # JPEG has no alpha channel
+        return pix.tobytes("jpeg", jpg_quality=quality)
+    if fmt == "webp":
+        import io
+
+        Image = _pillow_image()
+        mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[pix.n]
+        img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        buf = io.BytesIO()
+        img.save(buf, "WEBP", quality=quality)
+        return buf.getvalue()
+    raise ValueError(f"unknown image format: {fmt}")
+
+
+def _export_image_range(
+    pdf_path: str,
+    xrefs: List[int],
+    out_dir: str,
+    fmt: str,
+    quality: int,
+    max_dim: Optional[int],
+    thumb_dim: Optional[int],
+) -> List[Dict[str, Any]]:
+    # Runs in a worker process: each worker opens its own document.
+    ext = IMAGE_EXPORT_FORMATS[fmt]
+    settings = f"{fmt}|{quality}|{max_dim}|{thumb_dim}".encode("ascii")
+    records = []
+    with fitz.open(pdf_path) as doc:
+        for xref in xrefs:
+            try:
+                pix = fitz.Pixmap(doc, xref)
+                # Convert CMYK/other to RGB
+                if pix.n - pix.alpha >= 4:
+                    pix = fitz.Pixmap(fitz.csRGB, pix)
+                h = hashlib.sha256()
+                h.update(f"{pix.width}x{pix.height}x{pix.n}x{pix.alpha}|".encode("ascii"))
+                h.update(pix.samples_mv)
+                h.update(settings)
+                digest = h.hexdigest()[:32]
+                rec = {"xref": xref, "hash": digest}
+                targets = [("file", f"{digest}.{ext}", max_dim)]
+                if thumb_dim:
+                    targets.append(("thumb", f"{digest}.thumb.{ext}", thumb_dim))
+                for key, name, dim in targets:
+                    path = os.path.join(out_dir, name)
+                    # Same pixels + same settings = same file: only write it once.
+                    if not os.path.exists(path):
+                        tmp = f"{path}.tmp{os.getpid()}"
+                        with open(tmp, "wb") as f:
+                            f.write(encode_pixmap(pix, fmt, quality, dim))
+                        os.replace(tmp, path)
+                    rec[key] = name
+                    rec[f"{key}_bytes"] = os.path.getsize(path)
+                rec["width"], rec["height"] = _fit_dims(pix.width, pix.height, max_dim)
+            except Exception as e:
+                rec = {"xref": xref, "error": f"{type(e).__name__}: {e}"}
+            records.append(rec)
+    return records
+
+
+def export_images(
+    pdf_path: str,
+    images: List[Dict[str, Any]],
+    out_dir: str,
+    fmt: str = "png",
+    quality: int = 85,
+    max_dim: Optional[int] = None,
+    thumb_dim: Optional[int] = None,
+    workers: int = 1,
+    skip_logos: bool = True,
+) -> Dict[str, Any]:
+    """
+    Bulk counterpart of export_image_by_xref for the "images" list of an
+    extraction result. Images flagged is_repeated_logo are skipped, the
+    rest are exported across a process pool. Files are named by a hash
+    of their decoded pixels and the export settings, so xrefs with
+    identical content share one asset. Writes and returns the manifest
+    (out_dir/manifest.json): assets with the xrefs and pages using them,
+    plus an xref -> asset map.
+    """
+    if fmt not in IMAGE_EXPORT_FORMATS:
+        raise ValueError(f"unknown image format: {fmt}")
+    if fmt == "webp":
+        _pillow_image()
+    os.makedirs(out_dir, exist_ok=True)
+    stats: Counter = Counter()
+    pages_by_xref: Dict[int, Set[int]] = {}
+    for img in images:
+        if skip_logos and img.get("is_repeated_logo"):
+            stats["skipped_logos"] += 1
+            continue
+        pages = img.get("pages") or [img.get("page")]
+        pages_by_xref.setdefault(int(img["xref"]), set()).update(
+            p for p in pages if p is not None
+        )
+    xrefs = sorted(pages_by_xref)
+
+    if workers > 1 and len(xrefs) > 1:
+        chunk = max(1, math.ceil(len(xrefs) / (workers * 4)))
+        parts = [xrefs[i : i + chunk] for i in range(0, len(xrefs), chunk)]
+        n = len(parts)
+        records = []
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for part in ex.map(
+                _export_image_range,
+                [pdf_path] * n,
+                parts,
+                [out_dir] * n,
+                [fmt] * n,
+                [quality] * n,
+                [max_dim] * n,
+                [thumb_dim] * n,
+            ):
+                records.extend(part)
+    else:
+        records = _export_image_range(
+            pdf_path, xrefs, out_dir, fmt, quality, max_dim, thumb_dim
+        )
+
+    assets: Dict[str, Dict[str, Any]] = {}
+    xref_map: Dict[str, Optional[str]] = {}
+    errors = []
+    for rec in records:
+        xref = rec["xref"]
+        if "error" in rec:
+            errors.append(rec)
+            xref_map[str(xref)] = None
+            continue
+        asset = assets.get(rec["hash"])
+        if asset is None:
+            asset = assets[rec["hash"]] = {
+                k: v for k, v in rec.items() if k not in ("xref", "hash")
+            }
+            asset["xrefs"] = []
+            asset["pages"] = set()
+        else:
+            stats["duplicates"] += 1
+        asset["xrefs"].append(xref)
+        asset["pages"].update(pages_by_xref[xref])
+        xref_map[str(xref)] = asset["file"]
+    for asset in assets.values():
+        asset["pages"] = sorted(asset["pages"])
+        stats["bytes"] += asset["file_bytes"] + asset.get("thumb_bytes", 0)
+
+    stats["xrefs"] = len(xrefs)
+    stats["assets"] = len(assets)
+    stats["errors"] = len(errors)
+    manifest = {
+        "pdf": os.path.basename(pdf_path),
+        "settings": {
+            "format": fmt,
+            "quality": quality,
+            "max_dim": max_dim,
+            "thumb_dim": thumb_dim,
+        },
+        "stats": dict(stats),
+        "assets": list(assets.values()),
+        "xrefs": xref_map,
+        "errors": errors,
+    }
+    path = os.path.join(out_dir, "manifest.json")
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return manifest
+
+
+def _render_page_range(
+    pdf_path: str,
+    pages: List[int],
+    out_dir: str,
+    dpi: int,
+    fmt: str,
+    quality: int,
+) -> List[Dict[str, Any]]:
+    # Runs in a worker process: each worker opens its own document.
+    ext = IMAGE_EXPORT_FORMATS[fmt]
+    records = []
+    with fitz.open(pdf_path) as doc:
+        for pno in pages:
+            name = f"p{pno:04d}.{ext}"
+            try:
+                pix = doc[pno - 1].get_pixmap(dpi=dpi, alpha=False)
+                path = os.path.join(out_dir, name)
+                tmp = f"{path}.tmp{os.getpid()}"
+                with open(tmp, "wb") as f:
+                    f.write(encode_pixmap(pix, fmt, quality))
+                os.replace(tmp, path)
+                records.append(
+                    {
+                        "page": pno,
+                        "file": name,
+                        "width": pix.width,
+                        "height": pix.height,
+                        "bytes": os.path.getsize(path),
+                    }
+                )
+            except Exception as e:
+                records.append({"page": pno, "error": f"{type(e).__name__}: {e}"})
+    return records
+
+
+def page_thumb_dir(out_dir: str, file_hash: str, dpi: int, fmt: str, quality: int) -> str:
+    return os.path.join(out_dir, PAGE_THUMB_DIR, file_hash, f"{dpi}dpi-{fmt}-q{quality}")
+
+
+def render_page_thumbnails(
+    pdf_path: str,
+    file_hash: str,
+    out_dir: str,
+    dpi: int = 48,
+    fmt: str = "jpeg",
+    quality: int = 70,
+    workers: int = 1,
+) -> Dict[str, Any]:
+    """
+    Pre-render every page as a low-resolution preview under
+    out/thumbs/<sha256>/<settings>/p<NNNN>.<ext>, across a process pool
+    (contiguous page ranges per task). Pages already listed in the
+    manifest with their file on disk are skipped, so a rerun only
+    renders what is missing. Writes and returns the manifest, whose
+    stats include the rendering throughput (pages_per_s).
+    """
+    if fmt not in IMAGE_EXPORT_FORMATS:
+        raise ValueError(f"unknown image format: {fmt}")
+    if fmt == "webp":
+        _pillow_image()
+    thumb_dir = page_thumb_dir(out_dir, file_hash, dpi, fmt, quality)
+    os.makedirs(thumb_dir, exist_ok=True)
+    manifest_path = os.path.join(thumb_dir, "manifest.json")
+    known: Dict[int, Dict[str, Any]] = {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            for rec in json.load(f).get("pages", []):
+                if os.path.exists(os.path.join(thumb_dir, rec["file"])):
+                    known[rec["page"]] = rec
+    except (OSError, ValueError, KeyError):
+        pass
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    todo = [p for p in range(1, page_count + 1) if p not in known]
+
+    t0 = time.perf_counter()
+    if workers > 1 and len(todo) > 1:
+        chunk = max(1, math.ceil(len(todo) / (workers * 4)))
+        parts = [todo[i : i + chunk] for i in range(0, len(todo), chunk)]
+        n = len(parts)
+        records = []
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for part in ex.map(
+                _render_page_range,
+                [pdf_path] * n,
+                parts,
+                [thumb_dir] * n,
+                [dpi] * n,
+                [fmt] * n,
+                [quality] * n,
+            ):
+                records.extend(part)
+    else:
+        records = _render_page_range(pdf_path, todo, thumb_dir, dpi, fmt, quality)
+    elapsed = time.perf_counter() - t0
+
+    errors = [r for r in records if "error" in r]
+    for rec in records:
+        if "error" not in rec:
+            known[rec["page"]] = rec
+    rendered = len(records) - len(errors)
+    pages = [known[p] for p in sorted(known)]
+    manifest = {
+        "pdf": os.path.basename(pdf_path),
+        "sha256": file_hash,
+        "settings": {"dpi": dpi, "format": fmt, "quality": quality},
+        "stats": {
+            "pages": page_count,
+            "rendered": rendered,
+            "skipped": page_count - len(todo),
+            "errors": len(errors),
+            "seconds": round(elapsed, 3),
+            "pages_per_s": round(rendered / elapsed, 1) if rendered and elapsed else None,
+            "bytes": sum(r["bytes"] for r in pages),
+        },
+        "pages": pages,
+        "errors": errors,
+    }
+    tmp = f"{manifest_path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, manifest_path)
+    return manifest
+
+
+def result_cache_key(file_hash: str, params: Dict[str, Any]) -> str:
+    """Key over the PDF hash, every extraction parameter and the extractor version."""
+    payload = json.dumps(
+        {"sha256": file_hash, "params": params, "version": EXTRACTOR_VERSION},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def result_cache_path(
+    out_dir: str, file_hash: str, params: Dict[str, Any], output_format: str = "json"
+) -> str:
+    key = result_cache_key(file_hash, params)
+    if output_format == "sqlite":
+        # A ref into the SQLite store (pdf_store.py), read by load_result.
+        return os.path.join(out_dir, f"{RESULT_STORE_FILE}#{file_hash}-{key}")
+    return os.path.join(out_dir, f"{file_hash}-{key}.{output_format}")
+
+
+def layout_cache_path(out_dir: str, file_hash: str) -> str:
+    return os.path.join(
+        out_dir, LAYOUT_CACHE_DIR, f"{file_hash}.v{LAYOUT_VERSION}.json.gz"
+    )
+
+
+def load_layout_cache(path: str) -> Optional[List[Dict[str, Any]]]:
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_layout_cache(path: str, layout: List[Dict[str, Any]]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=5) as f:
+        json.dump(layout, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def _hash_index_entry(out_dir: str, st: os.stat_result) -> Tuple[str, str]:
+    path = os.path.join(out_dir, HASH_INDEX_DIR, f"{st.st_dev}-{st.st_ino}")
+    return (path, f"{st.st_size} {st.st_mtime_ns}")
+
+
+def lookup_file_hash(out_dir: str, st: os.stat_result) -> Optional[str]:
+    """sha256 recorded for this (device, inode, size, mtime_ns), if any."""
+    path, stamp = _hash_index_entry(out_dir, st)
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            size, mtime_ns, file_hash = f.read().split()
+    except (OSError, ValueError):
+        return None
+    return file_hash if f"{size} {mtime_ns}" == stamp else None
+
+
+def remember_file_hash(out_dir: str, st: os.stat_result, file_hash: str) -> None:
+    path, stamp = _hash_index_entry(out_dir, st)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="ascii") as f:
+        f.write(f"{stamp} {file_hash}\n")
+    os.replace(tmp, path)
+
+
+def indexed_sha256(
+    pdf_path: str, out_dir: str, read_bytes: bool = False
+) -> Tuple[str, Optional[bytes]]:
+    """
+    sha256 of pdf_path, served from the stat-keyed sidecar index when the
+    file is unchanged. With read_bytes, a file that must be hashed is read
+    into memory once and the bytes are returned for extraction too.
+    """
+    # stat before reading: if the file changes while hashed, the entry is stale.
+    st = os.stat(pdf_path)
+    file_hash = lookup_file_hash(out_dir, st)
+    if file_hash is not None:
+        return (file_hash, None)
+    data = None
+    if read_bytes:
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+        file_hash = hashlib.sha256(data).hexdigest()
+    else:
+        file_hash = sha256_file(pdf_path)
+    remember_file_hash(out_dir, st, file_hash)
+    return (file_hash, data)
+
+
+def source_sha256(
+    source: PdfSource, out_dir: str, read_bytes: bool = False
+) -> Tuple[str, Optional[PdfBuffer], Optional[str]]:
+    """
+    (sha256, bytes to decode or None, path or None) of a PDF source: a path
+    goes through indexed_sha256; an in-memory PDF is hashed in place and
+    its buffer is decoded as is.
+    """
+    if isinstance(source, str):
+        file_hash, data = indexed_sha256(source, out_dir, read_bytes=read_bytes)
+        return (file_hash, data, source)
+    buf = pdf_buffer(source)
+    return (hashlib.sha256(buf).hexdigest(), buf, None)
+
+
+def write_json(
+    path: str, data: Dict[str, Any], profiler: Optional[Profiler] = None
+) -> None:
+    """
+    With a profiler, serialization is timed into a string first and the
+    resulting timings are appended to the document as its last key.
+    """
+    tmp = f"{path}.tmp{os.getpid()}"
+    if profiler is None:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=json_default)
+        os.replace(tmp, path)
+        return
+    with _phase(profiler, "serialize"):
+        text = json.dumps(data, ensure_ascii=False, indent=2, default=json_default)
+    data["timings"] = profiler.report()
+    timings = json.dumps(data["timings"], ensure_ascii=False, indent=2)
+    # Same text json.dumps(data) would give with "timings" as the last key.
+    text = f'{text[:-2]},\n  "timings": {timings.replace(chr(10), chr(10) + "  ")}\n}}'
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_ndjson(
+    path: str,
+    records: Iterator[Dict[str, Any]],
+    profiler: Optional[Profiler] = None,
+) -> None:
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for rec in records:
+            with _phase(profiler, "serialize"):
+                f.write(json.dumps(rec, ensure_ascii=False, default=json_default))
+                f.write("\n")
+    os.replace(tmp, path)
+
+
+def iter_ndjson_records(
+    layout: List[Dict[str, Any]],
+    document: Dict[str, Any],
+    summary: Dict[str, Any],
+    params: Dict[str, Any],
+    profiler: Optional[Profiler] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    NDJSON result: a "document" record, one "section" record per section
+    as soon as it is finished, then a trailing "summary" record with the
+    header/footer stats, final counters and images (and timings when
+    profiling; the summary's own serialization is not in them).
+    """
+    yield {"type": "document", **document}
+    count = 0
+    for sec in iter_sections_from_layout(
+        layout, summary, blocks_as_dicts=False, profiler=profiler, **params
+    ):
+        count += 1
+        yield {"type": "section", **sec}
+    summary["sections_count"] = count
+    if profiler is not None:
+        summary["timings"] = profiler.report()
+    yield {"type": "summary", **summary}
+
+
+def result_stem(path: str) -> str:
+    """
+    Path without extension of a result file, or <out>/<sha256>-<params key>
+    for a store ref: the base name of files derived from that result.
+    """
+    name = path.replace(f"{RESULT_STORE_FILE}#", "")
+    return os.path.splitext(name)[0] if name == path else name
+
+
+def result_exists(path: str) -> bool:
+    """A result file, or a store ref present in its store."""
+    if f"{RESULT_STORE_FILE}#" in path:
+        import pdf_store
+
+        return pdf_store.has_ref(path)
+    return os.path.isfile(path)
+
+
+def iter_results(out_dir: str) -> List[str]:
+    """
+    Cached results of out_dir: .json, .ndjson and .pack files, then one
+    ref per document of the result store. A result may be listed in
+    several formats; callers dedupe on result_stem().
+    """
+    import glob
+
+    paths = sorted(
+        path
+        for ext in (".json", ".ndjson", ".pack")
+        for path in glob.glob(os.path.join(out_dir, f"*{ext}"))
+    )
+    db_path = os.path.join(out_dir, RESULT_STORE_FILE)
+    if os.path.exists(db_path):
+        import pdf_store
+
+        with pdf_store.ResultStore(db_path) as store:
+            paths.extend(
+                pdf_store.store_ref(db_path, doc["sha256"], doc["result_key"])
+                for doc in store.documents()
+            )
+    return paths
+
+
+def load_result(path: str) -> Dict[str, Any]:
+    """Read a cached result, JSON, NDJSON, pack or a store ref, back into the JSON layout."""
+    if f"{RESULT_STORE_FILE}#" in path:
+        import pdf_store
+
+        return pdf_store.load_ref(path)
+    if path.endswith(".pack"):
+        import pdf_pack
+
+        return pdf_pack.load_pack(path)
+    if not path.endswith(".ndjson"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    data: Dict[str, Any] = {}
+    sections = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            rec = json.loads(line)
+            kind = rec.pop("type", None)
+            if kind == "section":
+                sections.append(rec)
+            else:
+                data.update(rec)
+    data["sections"] = sections
+    return data
+
+
+def _cache_entries(out_dir: str) -> List[Tuple[float, int, str]]:
+    """(mtime, size, path) of every evictable file or TF-IDF index in out_dir."""
+    entries: List[Tuple[float, int, str]] = []
+
+    def walk(root: str, top: bool) -> None:
+        try:
+            found = list(os.scandir(root))
+        except OSError:
+            return
+        for e in found:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    if e.name.endswith(".tfidf"):
+                        # An index is only usable whole: one entry, last used file.
+                        st = [f.stat() for f in os.scandir(e.path) if f.is_file()]
+                        if st:
+                            entries.append(
+                                (max(x.st_mtime for x in st), sum(x.st_size for x in st), e.path)
+                            )
+                    elif not top or e.name in EVICTABLE_DIRS:
+                        walk(e.path, False)
+                elif e.is_file(follow_symlinks=False) and ".tmp" not in e.name:
+                    if top and not e.name.endswith((".json", ".ndjson", ".pack")):
+                        continue
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+            except OSError:
+                continue  # removed meanwhile
+
+    walk(out_dir, True)
+    return entries
+
+
+def evict_cache(out_dir: str, max_bytes: int, keep: Set[str] = frozenset()) -> int:
+    """
+    Remove least recently used cache entries until they fit in max_bytes.
+    Cache hits touch their file, so mtime orders by last use. Counted:
+    results (.json, .ndjson, .pack) and their .tfidf indexes, layout/
+    with its .partial page chunks, partial/, diffs/, thumbs/ and the
+    image server's images/. Not counted, as they are not caches of one
+    result: results.sqlite (a database updated in place, see pdf_store),
+    hashes/ (a few bytes per PDF; dropping it costs a full re-hash) and
+    the near_dup/ and qcm/ indexes built over all results.
+    """
+    entries = _cache_entries(out_dir)
+    total = sum(size for _, size, _ in entries)
+    stop = {os.path.normpath(out_dir)} | {
+        os.path.normpath(os.path.join(out_dir, d)) for d in EVICTABLE_DIRS
+    }
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+        parent = os.path.dirname(path)
+        while os.path.normpath(parent) not in stop:
+            try:
+                os.rmdir(parent)  # only once empty
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+    return removed
+
+
+def extract_cached(
+    pdf_path: PdfSource,
+    out_dir: str,
+    params: Dict[str, Any],
+    force: bool = False,
+    workers: int = 1,
+    cache_max_bytes: Optional[int] = None,
+    hash_on_read: bool = False,
+    output_format: str = "json",
+    profiler: Optional[Profiler] = None,
+    previous_layout: Optional[List[Dict[str, Any]]] = None,
+    pdf_name: Optional[str] = None,
+) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """
+    Two-tier cache around extract_structure_fast:
+    - result tier: out/<sha256>-<params key>.json, reused as is;
+    - layout tier: out/layout/<sha256>.v<N>.json.gz, the decoded page layer,
+      so new parameters on a known PDF skip PyMuPDF entirely.
+    The PDF hash comes from the sidecar index when the file is unchanged;
+    with hash_on_read, a file that must be hashed is read once and decoded
+    from the same bytes. An in-memory PDF (see extract_structure_fast) is
+    hashed and decoded from its buffer, with no temporary file; its result
+    has no source_path.
+    output_format "ndjson" streams sections to disk as they are finished;
+    "sqlite" writes the result into out/results.sqlite (pdf_store.py) and
+    json_path is then a store ref; "pack" writes a compressed container
+    indexed by section and page (pdf_pack.py).
+    Page fingerprints are only computed with previous_layout (an earlier
+    edition's page layer): a layout that must be decoded then reuses the
+    records of unchanged pages (serially), and a cached one lacking them
+    gets them added.
+    Returns (json_path, status, data) with status in {"cache", "layout",
+    "incremental", "ok"}; data is None on a result-tier hit and the
+    summary record for ndjson.
+    With a profiler, the written result carries "timings".
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    with _phase(profiler, "hash"):
+        file_hash, pdf_bytes, pdf_path = source_sha256(
+            pdf_path, out_dir, read_bytes=hash_on_read
+        )
+    json_path = result_cache_path(out_dir, file_hash, params, output_format)
+
+    if output_format == "sqlite":
+        import pdf_store
+
+        if not force and pdf_store.has_ref(json_path):
+            return (json_path, "cache", None)
+    elif os.path.exists(json_path) and not force:
+        os.utime(json_path)
+        return (json_path, "cache", None)
+
+    layout_path = layout_cache_path(out_dir, file_hash)
+    layout = None
+    if not force:
+        with _phase(profiler, "layout_cache_load"):
+            layout = load_layout_cache(layout_path)
+    status = "layout"
+    if layout is None:
+        status = "ok"
+        if previous_layout is not None:
+            layout, reused = decode_layout_incremental(
+                pdf_path, previous_layout, stream=pdf_bytes, profiler=profiler
+            )
+            if reused:
+                status = "incremental"
+        else:
+            layout = decode_pdf_layout(
+                pdf_path, workers=workers, stream=pdf_bytes, profiler=profiler, fingerprints=False
+            )
+        with _phase(profiler, "layout_cache_save"):
+            save_layout_cache(layout_path, layout)
+    elif previous_layout is not None and fill_page_fingerprints(
+        layout, pdf_bytes if pdf_bytes is not None else pdf_path, profiler
+    ):
+        with _phase(profiler, "layout_cache_save"):
+            save_layout_cache(layout_path, layout)
+    else:
+        os.utime(layout_path)
+
+    document = {
+        "pdf": pdf_display_name(pdf_path, pdf_name),
+        "sha256": file_hash,
+        "extractor_version": EXTRACTOR_VERSION,
+        "source_path": os.path.abspath(pdf_path) if pdf_path else None,
+        "image_export_hint": (
+            "Use /image/{sha256}/{xref} (pdf_image_server.py) "
+            "or export_image_by_xref for lazy export."
+        ),
+    }
+    if output_format == "ndjson":
+        data = {}
+        write_ndjson(
+            json_path,
+            iter_ndjson_records(layout, document, data, params, profiler),
+            profiler,
+        )
+    else:
+        data = extract_structure_from_layout(
+            layout,
+            pdf_name=document["pdf"],
+            blocks_as_dicts=False,
+            profiler=profiler,
+            **params,
+        )
+        data["sha256"] = file_hash
+        data["extractor_version"] = EXTRACTOR_VERSION
+        data["source_path"] = document["source_path"]
+        data["image_export_hint"] = document["image_export_hint"]
+        if output_format == "sqlite":
+            # Timings are stored with the rows, so the insert is not in them.
+            if profiler is not None:
+                data["timings"] = profiler.report()
+            pdf_store.put_ref(json_path, data)
+        elif output_format == "pack":
+            import pdf_pack
+
+            pdf_pack.write_pack(json_path, data, profiler)
+        else:
+            write_json(json_path, data, profiler)
+
+    if cache_max_bytes is not None:
+        evict_cache(out_dir, cache_max_bytes, keep={json_path, layout_path})
+    return (json_path, status, data)
+
+
+def partial_layout_dir(out_dir: str, file_hash: str) -> str:
+    return os.path.join(out_dir, LAYOUT_CACHE_DIR, f"{file_hash}.v{LAYOUT_VERSION}.partial")
+
+
+def load_partial_layout(path: str) -> Dict[int, Dict[str, Any]]:
+    """Page records of every chunk in a partial layout directory."""
+    decoded: Dict[int, Dict[str, Any]] = {}
+    try:
+        names = sorted(os.listdir(path))
+    except OSError:
+        return decoded
+    for name in names:
+        if name.endswith(".json.gz"):
+            pages = load_layout_cache(os.path.join(path, name))
+            if pages is not None:
+                decoded.update((int(p), rec) for p, rec in pages)
+    return decoded
+
+
+def save_partial_layout(path: str, pages: Dict[int, Dict[str, Any]]) -> None:
+    """One chunk of [page, record] pairs: a call writes only what it decoded."""
+    if pages:
+        lo, hi = min(pages), max(pages)
+        save_layout_cache(os.path.join(path, f"p{lo}-{hi}.json.gz"), sorted(pages.items()))
+
+
+def extract_cached_partial(
+    pdf_path: PdfSource,
+    out_dir: str,
+    params: Dict[str, Any],
+    page_range: Optional[Tuple[int, Optional[int]]] = None,
+    deadline_ms: Optional[float] = None,
+    force: bool = False,
+    hash_on_read: bool = False,
+    profiler: Optional[Profiler] = None,
+    pdf_name: Optional[str] = None,
+) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    extract_partial with the layout cache tiers: pages decoded by earlier
+    partial calls are kept as chunks in out/layout/<sha256>.v<N>.partial/.
+    Rerunning with the same bounds continues the same run from page
+    page_range[0], so a deadline-bound preview of the whole document grows
+    call by call until it is complete; any later call, bounded or not,
+    reuses the decoded pages. deadline_ms covers the whole call, hashing and cache reads
+    included. Once every page is decoded the chunks are merged into the
+    regular layout cache. An incomplete result is written to
+    out/partial/<sha256>-<params key>.p<first>-<last>.json, never to the
+    result tier; a complete one goes through extract_cached.
+    Returns (json_path, status, data) with status "partial" or the status
+    of extract_cached.
+    """
+    t0 = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    with _phase(profiler, "hash"):
+        file_hash, pdf_bytes, pdf_path = source_sha256(
+            pdf_path, out_dir, read_bytes=hash_on_read
+        )
+    layout_path = layout_cache_path(out_dir, file_hash)
+    partial_dir = partial_layout_dir(out_dir, file_hash)
+    decoded: Dict[int, Dict[str, Any]] = {}
+    if not force:
+        with _phase(profiler, "layout_cache_load"):
+            layout = load_layout_cache(layout_path)
+            if layout is not None:
+                decoded = {i: rec for i, rec in enumerate(layout, 1)}
+            else:
+                decoded = load_partial_layout(partial_dir)
+    known = set(decoded)
+    if deadline_ms is not None:
+        deadline_ms -= (time.perf_counter() - t0) * 1000.0
+    data, decoded = extract_partial(
+        pdf_path,
+        page_range,
+        deadline_ms,
+        decoded,
+        pdf_bytes,
+        profiler,
+        pdf_name=pdf_name,
+        fingerprints=False,
+        **params,
+    )
+    if len(decoded) > len(known):
+        with _phase(profiler, "layout_cache_save"):
+            if len(decoded) == data["pages"]:
+                save_layout_cache(layout_path, [decoded[p] for p in sorted(decoded)])
+                shutil.rmtree(partial_dir, ignore_errors=True)
+            else:
+                save_partial_layout(
+                    partial_dir, {p: rec for p, rec in decoded.items() if p not in known}
+                )
+
+    if data["complete"]:
+        # Same result (and cache entry) as an unbounded extraction.
+        json_path, status, full = extract_cached(
+            pdf_path if pdf_path is not None else pdf_bytes,
+            out_dir,
+            params,
+            profiler=profiler,
+            pdf_name=pdf_name,
+        )
+        return (json_path, status, full if full is not None else load_result(json_path))
+
+    data["sha256"] = file_hash
+    data["extractor_version"] = EXTRACTOR_VERSION
+    data["source_path"] = os.path.abspath(pdf_path) if pdf_path else None
+    first, end = data["page_range"]
+    key = result_cache_key(file_hash, params)
+    json_path = os.path.join(out_dir, PARTIAL_DIR, f"{file_hash}-{key}.p{first}-{end}.json")
+    os.makedirs(os.path.dirname(json_path), exist_ok=True)
+    write_json(json_path, data, profiler)
+    return (json_path, "partial", data)
+
+
+def load_previous_layout(
+    previous: str, out_dir: str, workers: int = 1
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Resolve a previous edition, given as a PDF or as one of its cached
+    results, to (sha256, page layer with fingerprints). The page layer
+    comes from the layout cache, or is decoded (and cached) from the PDF;
+    fingerprints missing from a cached one are computed from the PDF.
+    """
+    pdf_path: Optional[str] = previous
+    if previous.endswith((".json", ".ndjson", ".pack")) or f"{RESULT_STORE_FILE}#" in previous:
+        prev = load_result(previous)
+        file_hash = prev["sha256"]
+        pdf_path = prev.get("source_path")
+    else:
+        file_hash, _ = indexed_sha256(previous, out_dir)
+    layout_path = layout_cache_path(out_dir, file_hash)
+    layout = load_layout_cache(layout_path)
+    if layout is None or not all(page.get("fingerprint") for page in layout):
+        if not pdf_path or not os.path.isfile(pdf_path):
+            raise FileNotFoundError(f"no fingerprinted page layer or PDF for: {previous}")
+        if layout is None:
+            layout = decode_pdf_layout(pdf_path, workers=workers)
+        else:
+            fill_page_fingerprints(layout, pdf_path)
+        save_layout_cache(layout_path, layout)
+    return (file_hash, layout)
+
+
+def extract_incremental(
+    pdf_path: PdfSource,
+    previous: str,
+    out_dir: str,
+    params: Dict[str, Any],
+    force: bool = False,
+    workers: int = 1,
+    cache_max_bytes: Optional[int] = None,
+    hash_on_read: bool = False,
+    output_format: str = "json",
+    profiler: Optional[Profiler] = None,
+    pdf_name: Optional[str] = None,
+) -> Tuple[str, str, Dict[str, Any], str, Dict[str, Any]]:
+    """
+    extract_cached for a new edition of a known document: pages whose
+    fingerprint is unchanged since the previous edition reuse its page
+    layer, and a diff against it (changed pages; added, removed and
+    changed sections, both editions extracted with the same params) is
+    written to out/diffs/.
+    Returns (json_path, status, data, diff_path, diff); data is the full
+    result, read back from disk on a cache hit or for ndjson.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if not isinstance(pdf_path, str):
+        pdf_path = pdf_buffer(pdf_path)  # read again below on a result-tier hit
+    prev_hash, prev_layout = load_previous_layout(previous, out_dir, workers)
+    json_path, status, data = extract_cached(
+        pdf_path,
+        out_dir,
+        params,
+        force=force,
+        workers=workers,
+        cache_max_bytes=cache_max_bytes,
+        hash_on_read=hash_on_read,
+        output_format=output_format,
+        profiler=profiler,
+        previous_layout=prev_layout,
+        pdf_name=pdf_name,
+    )
+    if data is None or output_format == "ndjson":
+        data = load_result(json_path)
+
+    with _phase(profiler, "diff"):
+        old_sections = list(iter_sections_from_layout(prev_layout, {}, **params))
+        old_pages = {page.get("fingerprint") for page in prev_layout}
+        fingerprints = data.get("page_fingerprints")
+        if fingerprints is None:
+            # A cached result extracted without fingerprints.
+            pages: List[Dict[str, Any]] = [{} for _ in range(data["pages"])]
+            fill_page_fingerprints(pages, pdf_path)
+            fingerprints = [page["fingerprint"] for page in pages]
+        diff = {
+            "previous_sha256": prev_hash,
+            "sha256": data["sha256"],
+            "pages": {
+                "total": len(fingerprints),
+                "changed": [
+                    pno + 1 for pno, fp in enumerate(fingerprints) if fp not in old_pages
+                ],
+            },
+            "sections": diff_sections(old_sections, data["sections"]),
+        }
+    stem = os.path.splitext(os.path.basename(json_path))[0]
+    diff_path = os.path.join(out_dir, DIFF_DIR, f"{stem}.from-{prev_hash[:16]}.json")
+    os.makedirs(os.path.dirname(diff_path), exist_ok=True)
+    write_json(diff_path, diff)
+    return (json_path, status, data, diff_path, diff)
+
+
+def iter_batch_inputs(source: str) -> List[str]:
+    """PDF paths from a directory (recursive), a list file or a glob pattern."""
+    import glob
+
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            for name in files:
+                if name.lower().endswith(".pdf"):
+                    paths.append(os.path.join(root, name))
+        return sorted(paths)
+    if os.path.isfile(source) and not source.lower().endswith(".pdf"):
+        with open(source, "r", encoding="utf-8") as f:
+            return [ln.strip() for ln in f if ln.strip() and not ln.startswith("#")]
+    return sorted(glob.glob(source, recursive=True))
+
+
+def load_batch_journal(journal_path: str) -> Dict[str, Dict[str, Any]]:
+    """Last journal record per path; unreadable (truncated) lines are ignored."""
+    done: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(journal_path):
+        return done
+    with open(journal_path, "r", encoding="utf-8") as f:
+        for ln in f:
+            try:
+                rec = json.loads(ln)
+            except ValueError:
+                continue
+            done[rec.get("path", "")] = rec
+    return done
+
+
+def _sections_count(data: Dict[str, Any]) -> int:
+    # Full JSON results carry the sections; NDJSON summaries only their count.
+    if "sections" in data:
+        return len(data["sections"])
+    return data.get("sections_count", 0)
+
+
+class BatchTimeout(Exception):
+    """
+    Per-file batch timeout. Not a TimeoutError: that is an OSError, which
+    the cache readers swallow as a miss and carry on without a deadline.
+    """
+
+
+def _batch_timeout(signum, frame):
+    raise BatchTimeout("per-file timeout exceeded")
+
+
+def _journal_current(
+    rec: Optional[Dict[str, Any]],
+    st: os.stat_result,
+    out_dir: str,
+    params: Dict[str, Any],
+    output_format: str,
+) -> bool:
+    """
+    Whether a journal record still stands for this file: same size and
+    mtime, and its result is the one these params and format would write,
+    still in the cache.
+    """
+    if (
+        not rec
+        or rec.get("status") not in ("ok", "cache", "layout")
+        or rec.get("size") != st.st_size
+        or rec.get("mtime_ns") != st.st_mtime_ns
+        or not rec.get("json")
+    ):
+        return False
+    file_hash = os.path.basename(result_stem(rec["json"])).split("-", 1)[0]
+    expected = result_cache_path(out_dir, file_hash, params, output_format)
+    return rec["json"] == expected and result_exists(expected)
+
+
+def _kill_pool(ex: ProcessPoolExecutor) -> None:
+    # SIGALRM cannot interrupt a MuPDF call stuck in C: kill the workers.
+    for proc in list((getattr(ex, "_processes", None) or {}).values()):
+        proc.kill()
+    ex.shutdown(wait=False, cancel_futures=True)
+
+
+def _batch_worker(
+    pdf_path: str,
+    out_dir: str,
+    params: Dict[str, Any],
+    force: bool,
+    hash_on_read: bool,
+    timeout: Optional[float],
+    output_format: str,
+) -> Dict[str, Any]:
+    import signal
+
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _batch_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    t0 = time.perf_counter()
+    rec: Dict[str, Any] = {"path": pdf_path}
+    try:
+        json_path, status, data = extract_cached(
+            pdf_path,
+            out_dir,
+            params,
+            force=force,
+            hash_on_read=hash_on_read,
+            output_format=output_format,
+        )
+        rec.update({"status": status, "json": json_path})
+        if data is not None:
+            rec["sections"] = _sections_count(data)
+    except BatchTimeout as e:
+        rec.update({"status": "timeout", "error": str(e)})
+    except Exception as e:
+        rec.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    rec["seconds"] = round(time.perf_counter() - t0, 3)
+    return rec
+
+
+def run_batch(
+    paths: List[str],
+    out_dir: str,
+    params: Dict[str, Any],
+    journal_path: str,
+    jobs: int = 4,
+    max_inflight_bytes: Optional[int] = None,
+    timeout: Optional[float] = None,
+    force: bool = False,
+    hash_on_read: bool = False,
+    cache_max_bytes: Optional[int] = None,
+    output_format: str = "json",
+) -> Counter:
+    """
+    Run extract_cached over many PDFs in one long-lived process pool.
+    Every finished file is appended to a JSONL journal; files journaled as
+    done (same size and mtime, same result path for these params and
+    format, result still cached) are skipped unless force, so an
+    interrupted batch resumes. With a timeout, a file still running
+    BATCH_KILL_GRACE_S past it (stuck in a MuPDF call SIGALRM cannot
+    interrupt) is journaled as a timeout and its pool killed.
+    max_inflight_bytes bounds the combined size of PDFs being processed at
+    once (one file is always admitted). When a worker dies, the files in
+    flight are rerun one at a time in a fresh pool.
+    """
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    os.makedirs(out_dir, exist_ok=True)
+    done = load_batch_journal(journal_path)
+    counts: Counter = Counter()
+    queue = deque()
+    for p in paths:
+        p = os.path.abspath(p)
+        try:
+            st = os.stat(p)
+        except OSError:
+            counts["missing"] += 1
+            continue
+        if not force and _journal_current(done.get(p), st, out_dir, params, output_format):
+            counts["skipped"] += 1
+            continue
+        queue.append((p, st.st_size, st.st_mtime_ns))
+
+    inflight: Dict[Any, Tuple[str, int, int]] = {}
+    started: Dict[Any, float] = {}
+    inflight_bytes = 0
+    # Files in flight when a worker died: rerun one at a time, so only the
+    # file that crashes again on its own is journaled as an error.
+    suspects = deque()
+    # The worker's SIGALRM comes first; past this, its worker is killed.
+    kill_after = timeout + BATCH_KILL_GRACE_S if timeout else None
+    ex = ProcessPoolExecutor(max_workers=jobs)
+
+    def submit(item: Tuple[str, int, int]) -> None:
+        fut = ex.submit(
+            _batch_worker,
+            item[0],
+            out_dir,
+            params,
+            force,
+            hash_on_read,
+            timeout,
+            output_format,
+        )
+        inflight[fut] = item
+        started[fut] = time.monotonic()
+
+    try:
+        with open(journal_path, "a", encoding="utf-8") as jf:
+
+            def journal(item: Tuple[str, int, int], rec: Dict[str, Any]) -> None:
+                rec["size"], rec["mtime_ns"] = item[1], item[2]
+                counts[rec["status"]] += 1
+                jf.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                jf.flush()
+                print(f"[{rec['status']}] {item[0]}")
+
+            while queue or suspects or inflight:
+                # After a crash, inflight is empty: suspects go one by one.
+                alone = bool(suspects)
+                if alone:
+                    submit(suspects.popleft())
+                while not alone and queue and len(inflight) < jobs:
+                    size = queue[0][1]
+                    if (
+                        inflight
+                        and max_inflight_bytes is not None
+                        and inflight_bytes + size > max_inflight_bytes
+                    ):
+                        break
+                    submit(queue.popleft())
+                    inflight_bytes += size
+                wait_s = None
+                if kill_after is not None:
+                    wait_s = max(0.0, min(started.values()) + kill_after - time.monotonic())
+                finished, _ = wait(inflight, timeout=wait_s, return_when=FIRST_COMPLETED)
+                if not finished:
+                    now = time.monotonic()
+                    hung = {f for f in inflight if now - started[f] >= kill_after}
+                    if not hung:
+                        continue
+                    # The pool goes; the other files in flight go back to
+                    # the front of the queue.
+                    _kill_pool(ex)
+                    ex = ProcessPoolExecutor(max_workers=jobs)
+                    for fut, item in list(inflight.items()):
+                        if fut in hung:
+                            error = f"no answer after {now - started[fut]:.0f} s, worker killed"
+                            journal(item, {"path": item[0], "status": "timeout", "error": error})
+                        else:
+                            queue.appendleft(item)
+                    inflight.clear()
+                    started.clear()
+                    inflight_bytes = 0
+                    continue
+                broken = False
+                for fut in finished:
+                    item = inflight.pop(fut)
+                    del started[fut]
+                    inflight_bytes -= item[1]
+                    try:
+                        rec = fut.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        if not alone:
+                            suspects.append(item)
+                            continue
+                        rec = {"path": item[0], "status": "error", "error": f"worker died: {e}"}
+                    journal(item, rec)
+                if broken:
+                    # A crashed worker (e.g. MuPDF abort) poisons the whole pool.
+                    ex.shutdown(wait=False, cancel_futures=True)
+                    ex = ProcessPoolExecutor(max_workers=jobs)
+                    suspects.extend(inflight.values())
+                    inflight.clear()
+                    started.clear()
+                    inflight_bytes = 0
+                    if suspects and not alone:
+                        print(f"[err] Worker died; rerunning {len(suspects)} files one at a time")
+    finally:
+        ex.shutdown(wait=True, cancel_futures=True)
+
+    if cache_max_bytes is not None:
+        evict_cache(out_dir, cache_max_bytes)
+    return counts
+
+
+def _add_extraction_args(ap) -> None:
     ap.add_argument("--out", default="out", help="Output directory")
     ap.add_argument("--force", action="store_true", help="Reprocess even if cached")
     ap.add_argument("--header-band", type=float, default=0.10)
@@ -859,51 +3268,422 @@ def main():
         default="xref",
         help="Image dedup strategy: by xref (unique) or by (xref,page)",
     )
+    ap.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=None,
+        help="Evict least recently used cache files (see evict_cache) beyond this size",
+    )
+    ap.add_argument(
+        "--hash-on-read",
+        action="store_true",
+        help="Hash the PDF from the bytes read for extraction (one read on a miss)",
+    )
+    ap.add_argument(
+        "--format",
+        choices=["json", "ndjson", "sqlite", "pack"],
+        default="json",
+        help="json: one document; ndjson: sections written as they are finished;"
+        f" sqlite: rows in <out>/{RESULT_STORE_FILE}; pack: compressed, indexed"
+        " by section and page (pdf_pack.py)",
+    )
+
+
+def _extraction_params(args) -> Dict[str, Any]:
+    return {
+        "header_band": args.header_band,
+        "footer_band": args.footer_band,
+        "max_title_chars": args.max_title_chars,
+        "sample_pages": args.sample_pages,
+        "repeat_ratio": args.repeat_ratio,
+        "min_repeat_pages": args.min_repeat_pages,
+        "merge_bullets": not args.no_merge_bullets,
+        "merge_wrap": not args.no_merge_wrap,
+        "qcm_mode": args.qcm_mode,
+        "image_dedup": args.image_dedup,
+    }
+
+
+def _mb_to_bytes(mb: Optional[float]) -> Optional[int]:
+    return int(mb * 1024 * 1024) if mb is not None else None
+
+
+def batch_main(argv: List[str]) -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="pdf_fast_extract.py batch")
+    ap.add_argument("source", help="Directory, glob pattern or file listing PDF paths")
+    _add_extraction_args(ap)
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    ap.add_argument(
+        "--max-inflight-mb",
+        type=float,
+        default=None,
+        help="Bound on the combined size of PDFs processed at once",
+    )
+    ap.add_argument("--timeout", type=float, default=None, help="Per-file timeout (s)")
+    ap.add_argument(
+        "--journal",
+        default=None,
+        help="JSONL progress journal (default: <out>/batch_journal.jsonl)",
+    )
+    args = ap.parse_args(argv)
+
+    paths = iter_batch_inputs(args.source)
+    if not paths:
+        print(f"[err] No PDF found for: {args.source}")
+        return
+    journal_path = args.journal or os.path.join(args.out, "batch_journal.jsonl")
+    counts = run_batch(
+        paths,
+        args.out,
+        _extraction_params(args),
+        journal_path,
+        jobs=max(1, args.jobs),
+        max_inflight_bytes=_mb_to_bytes(args.max_inflight_mb),
+        timeout=args.timeout,
+        force=args.force,
+        hash_on_read=args.hash_on_read,
+        cache_max_bytes=_mb_to_bytes(args.cache_max_mb),
+        output_format=args.format,
+    )
+    summary = " | ".join(f"{k}: {v}" for k, v in sorted(counts.items()))
+    print(f"[ok] Batch done ({len(paths)} inputs) | {summary}")
+    print(f"[ok] Journal: {journal_path}")
+
+
+def main():
+    import argparse
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        import pdf_image_server
+
+        pdf_image_server.main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "chunk":
+        import pdf_chunker
+
+        pdf_chunker.main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "evidence":
+        import pdf_evidence
+
+        pdf_evidence.main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "qcm":
+        import pdf_qcm_bank
+
+        pdf_qcm_bank.main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "neardup":
+        import pdf_near_dup
+
+        pdf_near_dup.main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "store":
+        import pdf_store
+
+        pdf_store.main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "search":
+        import pdf_tfidf
+
+        pdf_tfidf.main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "pack":
+        import pdf_pack
+
+        pdf_pack.main(sys.argv[2:])
+        return
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdf", help="Path to PDF, or - to read it from stdin")
+    _add_extraction_args(ap)
+    ap.add_argument(
+        "--name",
+        default=None,
+        help=f"Document name of a PDF read from stdin (default: {STREAM_PDF_NAME})",
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Decode pages across N worker processes (1 = serial)",
+    )
+    ap.add_argument(
+        "--profile",
+        action="store_true",
+        help="Record per-phase wall/CPU time and memory peak under 'timings'",
+    )
+    ap.add_argument(
+        "--profile-prom",
+        default=None,
+        help="Also write the timings to this Prometheus textfile (implies --profile)",
+    )
+    ap.add_argument(
+        "--previous",
+        default=None,
+        metavar="PATH",
+        help="Previous edition (PDF or cached result): reuse its unchanged pages"
+        " and write a section diff",
+    )
+    ap.add_argument(
+        "--pages",
+        default=None,
+        metavar="RANGE",
+        help="Only extract this page range (e.g. 1-30, 31-); pages decoded once"
+        " are reused by later runs",
+    )
+    ap.add_argument(
+        "--deadline-ms",
+        type=float,
+        default=None,
+        help="Stop decoding when this time budget is spent (partial result);"
+        " rerun the same command to continue the run",
+    )
+    ap.add_argument(
+        "--export-images",
+        default=None,
+        metavar="DIR",
+        help="Export the non-logo images to DIR (deduplicated, with manifest.json)",
+    )
+    ap.add_argument("--image-format", choices=sorted(IMAGE_EXPORT_FORMATS), default="png")
+    ap.add_argument("--image-quality", type=int, default=85, help="JPEG/WebP quality")
+    ap.add_argument("--image-max-dim", type=int, default=None, help="Downscale to fit (px)")
+    ap.add_argument("--thumb-dim", type=int, default=None, help="Also write thumbnails (px)")
+    ap.add_argument(
+        "--page-thumbs",
+        action="store_true",
+        help=f"Pre-render page previews to <out>/{PAGE_THUMB_DIR}/<sha256>/ (uses --workers)",
+    )
+    ap.add_argument("--page-thumb-dpi", type=int, default=48)
+    ap.add_argument(
+        "--page-thumb-format", choices=sorted(IMAGE_EXPORT_FORMATS), default="jpeg"
+    )
+    ap.add_argument("--page-thumb-quality", type=int, default=70, help="JPEG/WebP quality")
+    ap.add_argument(
+        "--near-dup",
+        action="store_true",
+        help="Report sections near-duplicated in previously processed documents"
+        " and add this one to the index",
+    )
     args = ap.parse_args()
 
     pdf_path = args.pdf
     out_dir = args.out
-    os.makedirs(out_dir, exist_ok=True)
 
-    if not os.path.isfile(pdf_path):
+    if args.pages or args.deadline_ms is not None:
+        # Partial runs decode serially and write a JSON preview only.
+        for flag, used in (
+            ("--workers", args.workers != 1),
+            ("--format", args.format != "json"),
+            ("--previous", args.previous),
+        ):
+            if used:
+                print(f"[err] {flag} cannot be combined with --pages/--deadline-ms")
+                return
+
+    source: PdfSource = pdf_path
+    if pdf_path == "-":
+        for flag, needs_path in (
+            ("--export-images", args.export_images),
+            ("--page-thumbs", args.page_thumbs),
+        ):
+            if needs_path:
+                print(f"[err] {flag} needs a PDF path, not stdin")
+                return
+        # One read into memory; hashed and decoded from the same buffer.
+        source = sys.stdin.buffer.read()
+        if not source:
+            print("[err] No PDF on stdin")
+            return
+        pdf_path = args.name or STREAM_PDF_NAME
+    elif not os.path.isfile(pdf_path):
         print(f"[err] PDF not found: {pdf_path}")
         return
 
-    file_hash = sha256_file(pdf_path)
-    json_path = os.path.join(out_dir, f"{file_hash}.json")
+    profiler = None
+    if args.profile or args.profile_prom:
+        profiler = Profiler().start()
+    options = dict(
+        force=args.force,
+        workers=args.workers,
+        cache_max_bytes=_mb_to_bytes(args.cache_max_mb),
+        hash_on_read=args.hash_on_read,
+        output_format=args.format,
+        profiler=profiler,
+        pdf_name=args.name,
+    )
+    page_range = None
+    if args.pages:
+        try:
+            page_range = parse_page_range(args.pages)
+        except ValueError as e:
+            print(f"[err] {e}")
+            return
+    diff_path = diff = None
+    try:
+        if page_range is not None or args.deadline_ms is not None:
+            try:
+                json_path, status, data = extract_cached_partial(
+                    source,
+                    out_dir,
+                    _extraction_params(args),
+                    page_range=page_range,
+                    deadline_ms=args.deadline_ms,
+                    force=args.force,
+                    hash_on_read=args.hash_on_read,
+                    profiler=profiler,
+                    pdf_name=args.name,
+                )
+            except ValueError as e:
+                print(f"[err] {e}")
+                return
+        elif args.previous:
+            try:
+                json_path, status, data, diff_path, diff = extract_incremental(
+                    source, args.previous, out_dir, _extraction_params(args), **options
+                )
+            except FileNotFoundError as e:
+                print(f"[err] {e}")
+                return
+        else:
+            json_path, status, data = extract_cached(
+                source, out_dir, _extraction_params(args), **options
+            )
+    finally:
+        if profiler is not None:
+            profiler.stop()
+
+    if args.export_images:
+        images = (data if data is not None else load_result(json_path))["images"]
+        try:
+            manifest = export_images(
+                pdf_path,
+                images,
+                args.export_images,
+                fmt=args.image_format,
+                quality=args.image_quality,
+                max_dim=args.image_max_dim,
+                thumb_dim=args.thumb_dim,
+                workers=args.workers,
+            )
+        except RuntimeError as e:
+            print(f"[err] {e}")
+            return
+        st = manifest["stats"]
+        print(
+            f"[ok] Images: {st['assets']} assets for {st['xrefs']} xrefs"
+            f" | logos skipped: {st.get('skipped_logos', 0)}"
+            f" | errors: {st['errors']} | {st.get('bytes', 0) / 1e6:.2f} MB"
+            f" -> {args.export_images}"
+        )
+
+    if diff is not None:
+        secs = diff["sections"]
+        print(
+            f"[ok] Diff: {len(diff['pages']['changed'])}/{diff['pages']['total']} pages changed"
+            f" | sections +{len(secs['added'])} -{len(secs['removed'])}"
+            f" ~{len(secs['changed'])} ={secs['unchanged']} -> {diff_path}"
+        )
+
+    if args.page_thumbs:
+        file_hash = (data if data is not None else load_result(json_path))["sha256"]
+        try:
+            with _phase(profiler, "page_thumbs"):
+                manifest = render_page_thumbnails(
+                    pdf_path,
+                    file_hash,
+                    out_dir,
+                    dpi=args.page_thumb_dpi,
+                    fmt=args.page_thumb_format,
+                    quality=args.page_thumb_quality,
+                    workers=args.workers,
+                )
+        except RuntimeError as e:
+            print(f"[err] {e}")
+            return
+        thumb_dir = page_thumb_dir(
+            out_dir,
+            file_hash,
+            args.page_thumb_dpi,
+            args.page_thumb_format,
+            args.page_thumb_quality,
+        )
+        st = manifest["stats"]
+        if profiler is not None:
+            profiler.throughput("page_thumbs", st["rendered"], st["seconds"], unit="pages")
+        rate = f" ({st['pages_per_s']} pages/s)" if st["pages_per_s"] else ""
+        print(
+            f"[ok] Page thumbnails: {st['rendered']} rendered{rate}"
+            f" | skipped: {st['skipped']} | errors: {st['errors']}"
+            f" | {st['bytes'] / 1e6:.2f} MB -> {thumb_dir}"
+        )
+
+    if profiler is not None:
+        timings = profiler.report()
+        for name, rec in timings["phases"].items():
+            print(
+                f"[profile] {name}: {rec['wall_ms']:.1f} ms wall | "
+                f"{rec['cpu_ms']:.1f} ms cpu | peak {rec['peak_mb']} MB | x{rec['calls']}"
+            )
+        pages = timings["pages"]
+        if pages["count"]:
+            slow = ", ".join(f"p{s['page']} {s['ms']:.1f} ms" for s in pages["slowest"])
+            print(
+                f"[profile] page decode p50 {pages['p50_ms']} ms | p90 {pages['p90_ms']} ms"
+                f" | p99 {pages['p99_ms']} ms | slowest: {slow}"
+            )
+        for name, rec in timings.get("throughput", {}).items():
+            rate = f" | {rec['per_s']} {rec['unit']}/s" if rec["per_s"] else ""
+            print(f"[profile] {name}: {rec['items']} {rec['unit']} in {rec['seconds']:.3f} s{rate}")
+        if args.profile_prom:
+            labels = {"pdf": os.path.basename(pdf_path), "status": status}
+            write_prometheus_textfile(args.profile_prom, timings, labels)
+            print(f"[profile] Prometheus textfile: {args.profile_prom}")
+
+    if args.near_dup:
+        import pdf_near_dup
+
+        result = load_result(json_path)
+        report = pdf_near_dup.report_near_duplicates(out_dir, result)
+        report_path = os.path.join(
+            out_dir, pdf_near_dup.NEAR_DUP_DIR, f"{result['sha256']}.matches.json"
+        )
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(
+            f"[ok] Near duplicates: {len(report)} sections match earlier documents"
+            f" -> {report_path}"
+        )
+
+    if status == "partial":
+        first, last = data["page_range"]
+        stop = min((page_range or (1, None))[1] or data["pages"], data["pages"])
+        if last < stop:
+            hint = f" | rerun to continue from page {last + 1}"
+        else:
+            hint = " | rerun without --pages for the whole document (decoded pages are reused)"
+        print(f"[ok] Partial: pages {first}-{last} of {data['pages']} (complete: false){hint}")
 
     # Cache: if already processed, skip
-    if os.path.exists(json_path) and not args.force:
+    if status == "cache":
         print(f"[cache] JSON already exists: {json_path}")
         return
+    if status == "layout":
+        print("[cache] Reused decoded page layout")
+    if status == "incremental":
+        print("[cache] Reused the previous edition's unchanged pages")
+
+    print(f"[ok] Wrote: {json_path}")
+    print(
+        f"[ok] Sections: {_sections_count(data)} | Images(meta): {len(data['images'])}"
+    )
 
-    data = extract_structure_fast(
-        pdf_path,
-        header_band=args.header_band,
-        footer_band=args.footer_band,
-        max_title_chars=args.max_title_chars,
-        sample_pages=args.sample_pages,
-        repeat_ratio=args.repeat_ratio,
-        min_repeat_pages=args.min_repeat_pages,
-        merge_bullets=not args.no_merge_bullets,
-        merge_wrap=not args.no_merge_wrap,
-        qcm_mode=args.qcm_mode,
-        image_dedup=args.image_dedup,
-    )
-
-    data["sha256"] = file_hash
-    data["image_export_hint"] = (
-        "Use /image/{xref} endpoint (or export_image_by_xref) for lazy export."
-    )
-
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-    print(f"[ok] Wrote: {json_path}")
-    print(
-        f"[ok] Sections: {len(data['sections'])} | Images(meta): {len(data['images'])}"
-    )
-
-
-if __name__ == "__main__":
-    main()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+"""
+Local HTTP server for lazy image export: GET /image/{sha256}/{xref}.
+With a SQLite result store (--format sqlite) it also serves the course
+listing, GET /courses, and sections, GET /courses/{sha256}[/{index}],
+each from indexed queries. Page previews pre-rendered with --page-thumbs
+are served from disk: GET /thumb/{sha256}/{page}.
+
+The cached extraction results in the output directory are the index
+(sha256 -> source PDF and its image xrefs). Open documents are kept in
+an LRU pool, and encoded PNGs in a size-bounded memory LRU backed by an
+on-disk cache, so a lecture's images cost one document open instead of
+one per image. Responses carry a strong ETag and honour If-None-Match.
+"""
+import os
+import re
+import json
+import glob
+import time
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import fitz  # PyMuPDF
+
+from pdf_fast_extract import (
+    IMAGE_CACHE_DIR,
+    PAGE_THUMB_DIR,
+    RESULT_STORE_FILE,
+    image_png_bytes,
+    indexed_sha256,
+)
+
+
+SHA256_RE = re.compile(r"[0-9a-f]{64}")
+INT_RE = re.compile(r"[0-9]{1,9}")
+THUMB_TYPES = {".jpg": "image/jpeg", ".webp": "image/webp", ".png": "image/png"}
+# Unknown sha256s rescan the output directory at most this often.
+REFRESH_MIN_INTERVAL_S = 5.0
+# PyMuPDF is not thread-safe: every MuPDF call goes through this lock.
+FITZ_LOCK = threading.Lock()
+
+
+class ResultIndex:
+    """
+    sha256 -> (pdf path, known image xrefs), read from cached results;
+    sources keeps each result's (source_path, pdf name) to find the PDF
+    again once the indexed file no longer hashes to its sha256.
+    """
+
+    def __init__(self, out_dir: str, pdf_dirs: Optional[List[str]] = None) -> None:
+        self.out_dir = out_dir
+        self.pdf_dirs = pdf_dirs or []
+        self.entries: Dict[str, Tuple[str, Set[int]]] = {}
+        self.sources: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._seen: Dict[str, float] = {}
+        self._store_id = 0
+        self._last_refresh = float("-inf")
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Index result files added or changed since the last refresh."""
+        with self._lock:
+            self._last_refresh = time.monotonic()
+        paths = [
+            path
+            for ext in ("json", "ndjson", "pack")
+            for path in glob.glob(os.path.join(self.out_dir, f"*.{ext}"))
+        ]
+        for path in paths:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if self._seen.get(path) == mtime:
+                continue
+            entry = self._read(path)
+            with self._lock:
+                self._seen[path] = mtime
+                if entry is not None:
+                    sha, pdf_path, xrefs, source = entry
+                    known = self.entries.get(sha)
+                    if known:
+                        xrefs |= known[1]
+                    self.entries[sha] = (pdf_path, xrefs)
+                    self.sources[sha] = source
+        self._refresh_store()
+
+    def _refresh_store(self) -> None:
+        store_path = os.path.join(self.out_dir, RESULT_STORE_FILE)
+        if not os.path.exists(store_path):
+            return
+        import pdf_store
+
+        with pdf_store.ResultStore(store_path) as store:
+            rows = store.image_sources(self._store_id)
+        for doc_id, sha, doc, xrefs in rows:
+            source = (doc.get("source_path"), doc.get("pdf"))
+            pdf_path = self._resolve(sha, *source)
+            with self._lock:
+                self._store_id = max(self._store_id, doc_id)
+                if pdf_path:
+                    known = self.entries.get(sha)
+                    merged = set(xrefs) | (known[1] if known else set())
+                    self.entries[sha] = (pdf_path, merged)
+                    self.sources[sha] = source
+
+    def _read(self, path: str) -> Optional[Tuple[str, str, Set[int], Tuple[Any, Any]]]:
+        try:
+            if path.endswith(".ndjson"):
+                with open(path, "r", encoding="utf-8") as f:
+                    lines = f.read().splitlines()
+                doc = json.loads(lines[0])
+                images = json.loads(lines[-1]).get("images", [])
+            elif path.endswith(".pack"):
+                import pdf_pack
+
+                # Header and images frame only: sections are not read.
+                with pdf_pack.PackReader(path) as reader:
+                    doc = reader.doc
+                    images = reader.images()
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    doc = json.load(f)
+                images = doc.get("images", [])
+        except (OSError, ValueError, IndexError):
+            return None
+        sha = doc.get("sha256")
+        source = (doc.get("source_path"), doc.get("pdf"))
+        pdf_path = self._resolve(sha, *source) if sha else None
+        if not pdf_path:
+            return None
+        return (sha, pdf_path, {int(img["xref"]) for img in images}, source)
+
+    def _matches(self, path: str, sha: str) -> bool:
+        # Stat-keyed sidecar index: a hash only when the file has changed.
+        try:
+            return os.path.isfile(path) and indexed_sha256(path, self.out_dir)[0] == sha
+        except OSError:
+            return False
+
+    def _resolve(
+        self, sha: str, source_path: Optional[str], name: Optional[str]
+    ) -> Optional[str]:
+        """source_path, else <pdf dir>/<name>, as long as its content hashes to sha."""
+        if source_path and self._matches(source_path, sha):
+            return source_path
+        # Results written before source_path was recorded, or a PDF
+        # replaced since (e.g. a new edition uploaded): look up by name.
+        for root in self.pdf_dirs:
+            candidate = os.path.join(root, name or "")
+            if name and self._matches(candidate, sha):
+                return candidate
+        return None
+
+    def lookup(self, sha: str) -> Optional[Tuple[str, Set[int]]]:
+        """Entry of sha; an unknown one rescans, at most every REFRESH_MIN_INTERVAL_S."""
+        with self._lock:
+            entry = self.entries.get(sha)
+            stale = time.monotonic() - self._last_refresh >= REFRESH_MIN_INTERVAL_S
+        if entry is None and stale:
+            self.refresh()
+            with self._lock:
+                entry = self.entries.get(sha)
+        return entry
+
+    def pdf_path(self, sha: str) -> Optional[str]:
+        """The indexed PDF of sha if it still hashes to sha, else found again, else None."""
+        with self._lock:
+            entry = self.entries.get(sha)
+            source = self.sources.get(sha, (None, None))
+        if entry is None:
+            return None
+        if self._matches(entry[0], sha):
+            return entry[0]
+        pdf_path = self._resolve(sha, *source)
+        if pdf_path:
+            with self._lock:
+                self.entries[sha] = (pdf_path, entry[1])
+        return pdf_path
+
+
+class DocumentPool:
+    """LRU pool of open fitz.Documents keyed by sha256."""
+
+    def __init__(self, max_docs: int = 8) -> None:
+        self.max_docs = max_docs
+        self.docs: "OrderedDict[str, fitz.Document]" = OrderedDict()
+
+    def get(self, sha: str, pdf_path: str) -> fitz.Document:
+        # Caller holds FITZ_LOCK.
+        doc = self.docs.get(sha)
+        if doc is not None and doc.name == pdf_path:
+            self.docs.move_to_end(sha)
+            return doc
+        self.drop(sha)
+        doc = fitz.open(pdf_path)
+        self.docs[sha] = doc
+        while len(self.docs) > self.max_docs:
+            _, old = self.docs.popitem(last=False)
+            old.close()
+        return doc
+
+    def drop(self, sha: str) -> None:
+        # Caller holds FITZ_LOCK.
+        doc = self.docs.pop(sha, None)
+        if doc is not None:
+            doc.close()
+
+
+class ImageCache:
+    """Size-bounded in-memory LRU of encoded images over an on-disk cache."""
+
+    def __init__(self, disk_dir: str, max_memory_bytes: int, max_disk_bytes: int) -> None:
+        self.disk_dir = disk_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self.memory_bytes = 0
+        self.disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _disk_path(self, key: str) -> str:
+        sha, name = key.split("/", 1)
+        return os.path.join(self.disk_dir, sha, name)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._remember(key, data)
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._trim_disk(len(data))
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self.memory:
+                return
+            self.memory[key] = data
+            self.memory_bytes += len(data)
+            while self.memory_bytes > self.max_memory_bytes:
+                _, old = self.memory.popitem(last=False)
+                self.memory_bytes -= len(old)
+
+    def _trim_disk(self, added: int) -> None:
+        with self._lock:
+            if self.disk_bytes is None:
+                self.disk_bytes = sum(
+                    os.path.getsize(p)
+                    for p in glob.glob(os.path.join(self.disk_dir, "*", "*"))
+                )
+            else:
+                self.disk_bytes += added
+            if self.disk_bytes <= self.max_disk_bytes:
+                return
+            files = []
+            for p in glob.glob(os.path.join(self.disk_dir, "*", "*")):
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+            for _, size, p in sorted(files):
+                if self.disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(p)
+                except OSError:
+                    continue
+                self.disk_bytes -= size
+
+
+class ImageService:
+    def __init__(
+        self,
+        out_dir: str,
+        pdf_dirs: Optional[List[str]] = None,
+        max_docs: int = 8,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+    ) -> None:
+        self.index = ResultIndex(out_dir, pdf_dirs)
+        self.index.refresh()
+        self.pool = DocumentPool(max_docs)
+        self.cache = ImageCache(
+            os.path.join(out_dir, IMAGE_CACHE_DIR), max_memory_bytes, max_disk_bytes
+        )
+        self.store_path = os.path.join(out_dir, RESULT_STORE_FILE)
+        self.thumb_root = os.path.join(out_dir, PAGE_THUMB_DIR)
+
+    def thumb(self, sha: str, page: int) -> Optional[Tuple[str, str]]:
+        """(path, settings) of a pre-rendered page preview, lowest dpi first."""
+        root = os.path.join(self.thumb_root, sha)
+        try:
+            variants = os.listdir(root)
+        except OSError:
+            return None
+        variants.sort(key=lambda v: (int(v.split("dpi", 1)[0]) if v[0].isdigit() else 0, v))
+        for variant in variants:
+            for ext in THUMB_TYPES:
+                path = os.path.join(root, variant, f"p{page:04d}{ext}")
+                if os.path.isfile(path):
+                    return (path, variant)
+        return None
+
+    def courses(self, parts: List[str]) -> Optional[Any]:
+        """/courses, /courses/{sha} (section titles), /courses/{sha}/{index}."""
+        if not os.path.exists(self.store_path):
+            return None
+        import pdf_store
+
+        # One connection per request: sqlite3 connections stay in their thread.
+        with pdf_store.ResultStore(self.store_path) as store:
+            if len(parts) == 1:
+                return store.documents()
+            sha = parts[1].lower()
+            if not SHA256_RE.fullmatch(sha):
+                return None
+            if len(parts) == 2:
+                return store.section_titles(sha) or None
+            if len(parts) == 3 and INT_RE.fullmatch(parts[2]):
+                return store.section(sha, int(parts[2]))
+        return None
+
+    @staticmethod
+    def etag(sha: str, xref: int) -> str:
+        # A sha256 pins the PDF bytes, so (sha, xref) pins the image.
+        return f'"{sha[:32]}-{xref}-png"'
+
+    def has_image(self, sha: str, xref: int) -> bool:
+        entry = self.index.lookup(sha)
+        return entry is not None and xref in entry[1]
+
+    def image(self, sha: str, xref: int) -> Optional[bytes]:
+        """PNG of a known image (see has_image), or None once its PDF is gone."""
+        key = f"{sha}/{xref}.png"
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        # Checked before every open: the file may have been replaced.
+        pdf_path = self.index.pdf_path(sha)
+        with FITZ_LOCK:
+            if pdf_path is None:
+                self.pool.drop(sha)
+                return None
+            doc = self.pool.get(sha, pdf_path)
+            data = image_png_bytes(doc, xref)
+        self.cache.put(key, data)
+        return data
+
+
+def parse_target(sha: str, num: str) -> Optional[Tuple[str, int]]:
+    """
+    (sha256, page or xref) of a URL, or None: both go into file paths, so
+    only a hex sha256 and a decimal number are accepted.
+    """
+    sha = sha.lower()
+    if not SHA256_RE.fullmatch(sha) or not INT_RE.fullmatch(num):
+        return None
+    return (sha, int(num))
+
+
+def make_handler(service: ImageService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            parts = self.path.split("?", 1)[0].strip("/").split("/")
+            if parts == ["health"]:
+                self._send(200, b"ok", "text/plain")
+                return
+            target = parse_target(parts[1], parts[2]) if len(parts) == 3 else None
+            if parts[0] == "thumb":
+                found = service.thumb(*target) if target is not None else None
+                if found is None:
+                    self._send(404, b"no preview", "text/plain")
+                    return
+                path, variant = found
+                etag = f'"{target[0][:32]}-{target[1]}-{variant}"'
+                if etag in self.headers.get("If-None-Match", ""):
+                    self._send(304, b"", None, etag)
+                    return
+                with open(path, "rb") as f:
+                    body = f.read()
+                self._send(200, body, THUMB_TYPES[os.path.splitext(path)[1]], etag)
+                return
+            if parts[0] == "courses":
+                data = service.courses(parts)
+                if data is None:
+                    self._send(404, b"not found", "text/plain")
+                    return
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self._send(200, body, "application/json; charset=utf-8")
+                return
+            if parts[0] != "image" or target is None:
+                self._send(404, b"not found", "text/plain")
+                return
+            sha, xref = target
+            if not service.has_image(sha, xref):
+                self._send(404, b"unknown document or image", "text/plain")
+                return
+            etag = service.etag(sha, xref)
+            if etag in self.headers.get("If-None-Match", ""):
+                self._send(304, b"", None, etag)
+                return
+            try:
+                data = service.image(sha, xref)
+            except Exception as e:
+                self._send(500, f"export failed: {e}".encode("utf-8"), "text/plain")
+                return
+            if data is None:
+                self._send(404, b"unknown document or image", "text/plain")
+                return
+            self._send(200, data, "image/png", etag)
+
+        def _send(
+            self, code: int, body: bytes, ctype: Optional[str], etag: Optional[str] = None
+        ) -> None:
+            self.send_response(code)
+            if ctype:
+                self.send_header("Content-Type", ctype)
+            if etag:
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if body:
+                self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    return Handler
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="pdf_image_server.py")
+    ap.add_argument("--out", default="out", help="Directory with cached results")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument(
+        "--pdf-dir",
+        action="append",
+        default=[],
+        help="Where to find PDFs for results without source_path (repeatable)",
+    )
+    ap.add_argument("--max-docs", type=int, default=8, help="Open documents kept")
+    ap.add_argument("--memory-mb", type=float, default=64.0)
+    ap.add_argument("--disk-mb", type=float, default=1024.0)
+    args = ap.parse_args(argv)
+
+    service = ImageService(
+        args.out,
+        pdf_dirs=args.pdf_dir,
+        max_docs=args.max_docs,
+        max_memory_bytes=int(args.memory_mb * 1024 * 1024),
+        max_disk_bytes=int(args.disk_mb * 1024 * 1024),
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(
+        f"[ok] Serving /image/{{sha256}}/{{xref}} on http://{args.host}:{args.port} "
+        f"({len(service.index.entries)} documents indexed)"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
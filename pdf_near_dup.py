@@ -0,0 +1,345 @@
+"""
+Cross-document near-duplicate sections: MinHash signatures with LSH.
+
+Each section (title + course blocks, normalized with evidence_key) is
+reduced to a MinHash signature over its word shingles. The index lives in
+<out>/near_dup/ and only ever grows by appending:
+- docs.jsonl: one line per indexed document (sha256, pdf, section titles);
+- sig.u32: one signature per indexed section (NUM_PERM uint32);
+- rowmap.u32: (document id, section index) per signature row;
+- seg-*.{keys,rows}.npy: LSH band keys of a batch of rows, sorted,
+  memory-mapped and searched with np.searchsorted; the smallest segments
+  are merged once there are too many.
+Adding a document touches only its own rows, so updates stay cheap on
+tens of thousands of documents. Candidates from the LSH buckets are
+scored by the share of equal signature slots (the Jaccard estimate).
+"""
+import os
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pdf_evidence import evidence_key
+from pdf_fast_extract import iter_results, load_result, result_stem
+
+
+NEAR_DUP_DIR = "near_dup"
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 4
+MIN_SHINGLES = 8  # shorter sections match too easily to be meaningful
+MAX_SEGMENTS = 8
+HASH_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, 2**32 - 1, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.randint(0, 2**32 - 1, size=NUM_PERM, dtype=np.uint64)
+BAND_SALT = _rng.randint(1, 2**63 - 1, size=BANDS, dtype=np.uint64)
+BAND_MULT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def section_shingles(sec: Dict[str, Any], k: int = SHINGLE_WORDS) -> np.ndarray:
+    text = " ".join([sec.get("title", "")] + [b["text"] for b in sec.get("blocks", [])])
+    words = evidence_key(text).split()
+    grams = {" ".join(words[i : i + k]) for i in range(len(words) - k + 1)}
+    return np.fromiter(
+        (zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams)
+    )
+
+
+def minhash_signatures(shingle_sets: List[np.ndarray]) -> np.ndarray:
+    """(len(shingle_sets), NUM_PERM) uint32 signatures, one pass per batch."""
+    if not shingle_sets:
+        return np.zeros((0, NUM_PERM), dtype=np.uint32)
+    x = np.concatenate(shingle_sets)
+    starts = np.cumsum([0] + [len(s) for s in shingle_sets[:-1]])
+    with np.errstate(over="ignore"):
+        hashed = (PERM_A[:, None] * x[None, :] + PERM_B[:, None]) % HASH_PRIME
+    return np.minimum.reduceat(hashed, starts, axis=1).T.astype(np.uint32)
+
+
+def band_keys(sigs: np.ndarray) -> np.ndarray:
+    """(rows, BANDS) uint64 bucket keys; bands are salted apart."""
+    keys = np.zeros((sigs.shape[0], BANDS), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for b in range(BANDS):
+            k = np.full(sigs.shape[0], BAND_SALT[b], dtype=np.uint64)
+            for j in range(b * ROWS, (b + 1) * ROWS):
+                k = (k * BAND_MULT) ^ sigs[:, j].astype(np.uint64)
+            keys[:, b] = k
+    return keys
+
+
+class NearDupIndex:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.state_path = os.path.join(root, "state.json")
+        self.state: Dict[str, Any] = {
+            "num_perm": NUM_PERM,
+            "bands": BANDS,
+            "shingle_words": SHINGLE_WORDS,
+            "rows": 0,
+            "segments": [],
+            "next_segment": 0,
+            "docs_bytes": 0,
+            "results": {},
+        }
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.docs: List[Dict[str, Any]] = []
+        docs_path = os.path.join(root, "docs.jsonl")
+        if os.path.exists(docs_path):
+            with open(docs_path, "rb") as f:
+                head = f.read(self.state.get("docs_bytes", 0))
+            self.docs = [json.loads(line) for line in head.decode("utf-8").splitlines()]
+        self.doc_ids = {d["sha256"]: i for i, d in enumerate(self.docs)}
+        self._segments: Optional[List[Tuple[np.ndarray, np.ndarray]]] = None
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+
+    @classmethod
+    def open(cls, out_dir: str) -> "NearDupIndex":
+        return cls(os.path.join(out_dir, NEAR_DUP_DIR))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _save_state(self) -> None:
+        tmp = f"{self.state_path}.tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    def signatures(self) -> np.ndarray:
+        n = self.state["rows"]
+        if n == 0:
+            return np.zeros((0, NUM_PERM), dtype=np.uint32)
+        return np.memmap(self._path("sig.u32"), dtype=np.uint32, mode="r", shape=(n, NUM_PERM))
+
+    def rowmap(self) -> np.ndarray:
+        n = self.state["rows"]
+        if n == 0:
+            return np.zeros((0, 2), dtype=np.uint32)
+        return np.memmap(self._path("rowmap.u32"), dtype=np.uint32, mode="r", shape=(n, 2))
+
+    def segments(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """(sorted keys, rows) per segment, memory-mapped: opening is free."""
+        if self._segments is None:
+            self._segments = [
+                (
+                    np.load(self._path(f"{name}.keys.npy"), mmap_mode="r"),
+                    np.load(self._path(f"{name}.rows.npy"), mmap_mode="r"),
+                )
+                for name in self.state["segments"]
+            ]
+        return self._segments
+
+    @staticmethod
+    def document_signatures(
+        data: Dict[str, Any],
+    ) -> Tuple[np.ndarray, List[int]]:
+        """Signatures of the sections long enough to index, and their indexes."""
+        sets, kept = [], []
+        for i, sec in enumerate(data.get("sections", [])):
+            sh = section_shingles(sec)
+            if len(sh) >= MIN_SHINGLES:
+                sets.append(sh)
+                kept.append(i)
+        return (minhash_signatures(sets), kept)
+
+    def query(
+        self,
+        sigs: np.ndarray,
+        threshold: float = 0.6,
+        exclude_sha: Optional[str] = None,
+        limit: int = 5,
+    ) -> List[List[Dict[str, Any]]]:
+        """For each signature: indexed sections with estimated Jaccard >= threshold."""
+        results: List[List[Dict[str, Any]]] = [[] for _ in range(len(sigs))]
+        if not len(sigs) or self.state["rows"] == 0:
+            return results
+        keys = band_keys(sigs)
+        all_sigs, rowmap = self.signatures(), self.rowmap()
+        exclude = self.doc_ids.get(exclude_sha) if exclude_sha else None
+        for q in range(len(sigs)):
+            cands = []
+            for seg_keys, seg_rows in self.segments():
+                lo = np.searchsorted(seg_keys, keys[q], side="left")
+                hi = np.searchsorted(seg_keys, keys[q], side="right")
+                for a, b in zip(lo, hi):
+                    if b > a:
+                        cands.append(seg_rows[a:b])
+            if not cands:
+                continue
+            rows = np.unique(np.concatenate(cands))
+            est = (all_sigs[rows] == sigs[q]).mean(axis=1)
+            order = np.argsort(-est, kind="stable")
+            for r in order:
+                if est[r] < threshold or len(results[q]) >= limit:
+                    break
+                doc_id, sec_idx = (int(v) for v in rowmap[rows[r]])
+                if doc_id == exclude:
+                    continue
+                doc = self.docs[doc_id]
+                results[q].append(
+                    {
+                        "sha256": doc["sha256"],
+                        "pdf": doc["pdf"],
+                        "section": sec_idx,
+                        "title": doc["titles"].get(str(sec_idx)),
+                        "jaccard": round(float(est[r]), 3),
+                    }
+                )
+        return results
+
+    def add(self, data: Dict[str, Any], sigs: np.ndarray, kept: List[int]) -> bool:
+        """Append a document's section signatures; False if already indexed."""
+        sha = data.get("sha256")
+        if not sha or sha in self.doc_ids:
+            return False
+        doc_id = len(self.docs)
+        sections = data.get("sections", [])
+        doc = {
+            "sha256": sha,
+            "pdf": data.get("pdf"),
+            "titles": {str(i): sections[i]["title"] for i in kept},
+        }
+        start = self.state["rows"]
+        rowmap = np.array([[doc_id, i] for i in kept], dtype=np.uint32).reshape(-1, 2)
+        line = (json.dumps(doc, ensure_ascii=False) + "\n").encode("utf-8")
+        self._append("sig.u32", start * NUM_PERM * 4, np.ascontiguousarray(sigs).tobytes())
+        self._append("rowmap.u32", start * 8, rowmap.tobytes())
+        self._append("docs.jsonl", self.state["docs_bytes"], line)
+        self.state["docs_bytes"] += len(line)
+        self.docs.append(doc)
+        self.doc_ids[sha] = doc_id
+        self.state["rows"] = start + len(kept)
+        if len(kept):
+            self._pending.append((band_keys(sigs), np.arange(start, start + len(kept))))
+        return True
+
+    def _append(self, name: str, offset: int, payload: bytes) -> None:
+        # The state file is the commit point: bytes past the recorded size
+        # were left by an interrupted update and are overwritten.
+        with open(self._path(name), "ab") as f:
+            f.truncate(offset)
+            f.write(payload)
+
+    def flush(self) -> None:
+        """Write the rows added since the last flush as one segment."""
+        if self._pending:
+            keys = np.concatenate([k.ravel() for k, _ in self._pending])
+            rows = np.concatenate([np.repeat(r, BANDS) for _, r in self._pending])
+            self.state["segments"].append(self._write_segment(keys, rows))
+            self._pending = []
+        if len(self.state["segments"]) > MAX_SEGMENTS:
+            self._compact()
+        self._save_state()
+
+    def _write_segment(self, keys: np.ndarray, rows: np.ndarray) -> str:
+        order = np.argsort(keys, kind="stable")
+        seq = self.state.get("next_segment", 0)
+        self.state["next_segment"] = seq + 1
+        name = f"seg-{seq:06d}"
+        for part, arr in (("keys", keys[order]), ("rows", rows[order].astype(np.uint32))):
+            tmp = self._path(f"tmp-{name}.{part}.npy")
+            np.save(tmp, arr)
+            os.replace(tmp, self._path(f"{name}.{part}.npy"))
+        self._segments = None
+        return name
+
+    def _compact(self) -> None:
+        """
+        Size-tiered merge: only the smallest segments are merged, so the
+        large base segment is rewritten rarely (about once per doubling).
+        """
+        segs = dict(zip(self.state["segments"], self.segments()))
+        by_size = sorted(segs, key=lambda n: len(segs[n][0]))
+        merge = by_size[: len(by_size) - MAX_SEGMENTS // 2]
+        keys = np.concatenate([segs[n][0] for n in merge])
+        rows = np.concatenate([segs[n][1] for n in merge])
+        name = self._write_segment(keys, rows)
+        self.state["segments"] = [n for n in self.state["segments"] if n not in merge] + [name]
+        self._save_state()
+        for old in merge:
+            for part in ("keys", "rows"):
+                try:
+                    os.remove(self._path(f"{old}.{part}.npy"))
+                except OSError:
+                    pass
+
+    def update(self, out_dir: str) -> int:
+        """Index every cached result in out_dir not indexed yet."""
+        added = 0
+        for path in iter_results(out_dir):
+            name = os.path.basename(result_stem(path))
+            if name in self.state["results"] or name.split("-", 1)[0] in self.doc_ids:
+                continue  # result names start with the PDF's sha256
+            try:
+                data = load_result(path)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(data, dict) or "sections" not in data:
+                continue  # not an extraction result
+            self.state["results"][name] = data.get("sha256", "")
+            if data.get("sha256") in self.doc_ids:
+                continue
+            sigs, kept = self.document_signatures(data)
+            added += self.add(data, sigs, kept)
+        self.flush()
+        return added
+
+
+def report_near_duplicates(
+    out_dir: str, data: Dict[str, Any], threshold: float = 0.6, add: bool = True
+) -> List[Dict[str, Any]]:
+    """
+    Near-duplicate sections of a new result among previously indexed
+    documents; with add, the result is indexed afterwards.
+    """
+    index = NearDupIndex.open(out_dir)
+    sigs, kept = index.document_signatures(data)
+    matches = index.query(sigs, threshold=threshold, exclude_sha=data.get("sha256"))
+    sections = data.get("sections", [])
+    report = [
+        {"section": i, "title": sections[i]["title"], "matches": m}
+        for i, m in zip(kept, matches)
+        if m
+    ]
+    if add and index.add(data, sigs, kept):
+        index.flush()
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(prog="pdf_near_dup.py")
+    ap.add_argument("--out", default="out", help="Directory with cached results")
+    ap.add_argument("--query", default=None, help="Report near duplicates of this result")
+    ap.add_argument("--threshold", type=float, default=0.6, help="Min estimated Jaccard")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    index = NearDupIndex.open(args.out)
+    added = index.update(args.out)
+    print(
+        f"[ok] Near-dup index: {len(index.docs)} documents, {index.state['rows']} sections"
+        f" | added: {added} ({time.perf_counter() - t0:.2f} s)"
+    )
+    if args.query:
+        data = load_result(args.query)
+        report = report_near_duplicates(args.out, data, args.threshold, add=False)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"[ok] Sections with near duplicates: {len(report)}")
+
+
+if __name__ == "__main__":
+    main()
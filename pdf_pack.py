@@ -0,0 +1,293 @@
+"""
+Compact binary results with random access by section and page (--format pack).
+
+A .pack file is a versioned container:
+- prefix: MAGIC, format version (uint16) and header length (uint32),
+  little-endian;
+- header: zlib-compressed JSON with the document keys in their order
+  ("sections" and "images" set to None), one [offset, length, title,
+  page_start] entry per section, the images frame, and one [offset,
+  length, first, last] entry per page: the byte span of sections
+  first..last, the ones holding blocks of that page (None for a page
+  with no block);
+- frames: each section, then the images list, as zlib-compressed compact
+  JSON. Offsets count from the end of the header.
+Once the header is read, a section costs one seek, one read and one
+small decompress; the same offsets serve HTTP Range requests. export()
+rebuilds the JSON result key for key, and load_result() reads packs.
+"""
+import os
+import json
+import zlib
+import struct
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Set
+
+from pdf_fast_extract import Profiler, iter_results, json_default, load_result, result_stem, write_json
+
+
+MAGIC = b"PDFXPACK"
+PACK_VERSION = 1
+PREFIX = struct.Struct("<8sHI")
+PACK_EXT = ".pack"
+COMPRESS_LEVEL = 6
+
+
+def _to_dict(obj: Any) -> Any:
+    # Duck-typed: run as a script, the extractor's Block is __main__.Block.
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+    return json_default(obj)
+
+
+def _frame(obj: Any) -> bytes:
+    text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_to_dict)
+    return zlib.compress(text.encode("utf-8"), COMPRESS_LEVEL)
+
+
+def _section_pages(sec: Dict[str, Any]) -> Set[int]:
+    pages = {sec["page_start"]}
+    for name in ("blocks", "qcm_blocks"):
+        for blk in sec.get(name) or ():
+            pages.add(blk["page"] if isinstance(blk, dict) else blk.page)
+    return pages
+
+
+def write_pack(path: str, data: Dict[str, Any], profiler: Optional[Profiler] = None) -> None:
+    """
+    With a profiler, the timings (serialization included) are stored as
+    the document's last key, as write_json does.
+    """
+    with profiler.phase("serialize") if profiler is not None else nullcontext():
+        frames: List[bytes] = []
+        sections = []
+        spans: Dict[int, List[int]] = {}
+        offset = 0
+        for si, sec in enumerate(data.get("sections", [])):
+            frame = _frame(sec)
+            sections.append([offset, len(frame), sec.get("title"), sec.get("page_start")])
+            for page in _section_pages(sec):
+                span = spans.setdefault(page, [si, si])
+                span[1] = si
+            frames.append(frame)
+            offset += len(frame)
+        images = None
+        if "images" in data:
+            frame = _frame(data["images"])
+            images = [offset, len(frame)]
+            frames.append(frame)
+        n_pages = max([data.get("pages") or 0] + list(spans))
+        pages: List[Optional[List[int]]] = []
+        for page in range(1, n_pages + 1):
+            span = spans.get(page)
+            if span is None:
+                pages.append(None)
+                continue
+            first, last = span
+            start = sections[first][0]
+            end = sections[last][0] + sections[last][1]
+            pages.append([start, end - start, first, last])
+    if profiler is not None:
+        data["timings"] = profiler.report()
+    doc = {k: (None if k in ("sections", "images") else v) for k, v in data.items()}
+    header = _frame({"doc": doc, "sections": sections, "images": images, "pages": pages})
+
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, PACK_VERSION, len(header)))
+        f.write(header)
+        for frame in frames:
+            f.write(frame)
+    os.replace(tmp, path)
+
+
+class PackReader:
+    """Open .pack file: the header is read once, frames on demand."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.f = open(path, "rb")
+        try:
+            magic, version, size = PREFIX.unpack(self.f.read(PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f"not a result pack: {path}")
+            if version != PACK_VERSION:
+                raise ValueError(f"unsupported pack version {version}: {path}")
+            header = json.loads(zlib.decompress(self.f.read(size)))
+        except (struct.error, zlib.error) as e:
+            self.f.close()
+            raise ValueError(f"corrupt result pack: {path}") from e
+        except ValueError:
+            self.f.close()
+            raise
+        self.base = PREFIX.size + size
+        self.doc: Dict[str, Any] = header["doc"]
+        self.sections: List[List[Any]] = header["sections"]
+        self.images_frame: Optional[List[int]] = header["images"]
+        self.pages: List[Optional[List[int]]] = header["pages"]
+
+    def close(self) -> None:
+        self.f.close()
+
+    def __enter__(self) -> "PackReader":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _read(self, offset: int, length: int) -> bytes:
+        self.f.seek(self.base + offset)
+        return self.f.read(length)
+
+    def section_titles(self) -> List[Dict[str, Any]]:
+        return [
+            {"section": i, "title": title, "page_start": page}
+            for i, (_, _, title, page) in enumerate(self.sections)
+        ]
+
+    def section(self, idx: int) -> Optional[Dict[str, Any]]:
+        """One section with its blocks, as in the JSON result."""
+        if not 0 <= idx < len(self.sections):
+            return None
+        offset, length = self.sections[idx][:2]
+        return json.loads(zlib.decompress(self._read(offset, length)))
+
+    def page(self, page: int) -> List[Dict[str, Any]]:
+        """
+        Blocks of one page, per section ({"section", "title", "blocks",
+        "qcm_blocks"}), from a single read of the sections holding them.
+        """
+        if not 1 <= page <= len(self.pages) or self.pages[page - 1] is None:
+            return []
+        offset, length, first, last = self.pages[page - 1]
+        raw = self._read(offset, length)
+        out = []
+        for si in range(first, last + 1):
+            start = self.sections[si][0] - offset
+            sec = json.loads(zlib.decompress(raw[start : start + self.sections[si][1]]))
+            rec = {"section": si, "title": sec["title"]}
+            for name in ("blocks", "qcm_blocks"):
+                rec[name] = [blk for blk in sec.get(name) or () if blk["page"] == page]
+            if rec["blocks"] or rec["qcm_blocks"]:
+                out.append(rec)
+        return out
+
+    def images(self) -> List[Dict[str, Any]]:
+        if self.images_frame is None:
+            return []
+        return json.loads(zlib.decompress(self._read(*self.images_frame)))
+
+    def export(self) -> Dict[str, Any]:
+        """The full result, key for key as the JSON cache would hold it."""
+        data = dict(self.doc)
+        if "sections" in data:
+            data["sections"] = [self.section(i) for i in range(len(self.sections))]
+        if "images" in data and self.images_frame is not None:
+            data["images"] = self.images()
+        return data
+
+
+def load_pack(path: str) -> Dict[str, Any]:
+    with PackReader(path) as reader:
+        return reader.export()
+
+
+def pack_path_for(result_path: str) -> str:
+    """<out>/<name>.pack for a result file, or a store ref, in <out>."""
+    return result_stem(result_path) + PACK_EXT
+
+
+def convert(result_path: str, pack_path: Optional[str] = None) -> str:
+    """Write a cached result (JSON, NDJSON or store ref) as a pack."""
+    pack_path = pack_path or pack_path_for(result_path)
+    write_pack(pack_path, load_result(result_path))
+    return pack_path
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(prog="pdf_pack.py")
+    sub = ap.add_subparsers(dest="action", required=True)
+    cv = sub.add_parser("convert", help="Write cached JSON/NDJSON/store results as packs")
+    cv.add_argument("results", nargs="*", help="Result files (default: all in --out)")
+    cv.add_argument("--out", default="out", help="Directory with cached results")
+    cv.add_argument("--force", action="store_true", help="Rewrite existing packs")
+    cv.add_argument("--check", action="store_true", help="Read each pack back and compare")
+    sh = sub.add_parser("show", help="Print a pack's header, a section or a page")
+    sh.add_argument("pack")
+    sh.add_argument("--section", type=int, default=None)
+    sh.add_argument("--page", type=int, default=None)
+    sh.add_argument("--export", default=None, metavar="JSON", help="Write the full JSON result")
+    args = ap.parse_args(argv)
+
+    if args.action == "convert":
+        paths = args.results or [
+            p for p in iter_results(args.out) if not p.endswith(PACK_EXT)
+        ]
+        t0 = time.perf_counter()
+        count = src_bytes = pack_bytes = 0
+        for path in paths:
+            pack_path = pack_path_for(path)
+            if os.path.exists(pack_path) and not args.force:
+                continue
+            try:
+                data = load_result(path)
+            except (OSError, ValueError):
+                print(f"[err] Unreadable result: {path}")
+                continue
+            if not isinstance(data, dict) or "sections" not in data:
+                continue  # not an extraction result
+            write_pack(pack_path, data)
+            if args.check and load_pack(pack_path) != json.loads(
+                json.dumps(data, default=json_default)
+            ):
+                print(f"[err] Pack differs from its result: {pack_path}")
+                continue
+            count += 1
+            if os.path.isfile(path):  # store refs have no file size of their own
+                src_bytes += os.path.getsize(path)
+                pack_bytes += os.path.getsize(pack_path)
+        sizes = (
+            f" | {src_bytes / 1e6:.2f} MB -> {pack_bytes / 1e6:.2f} MB"
+            f" ({pack_bytes / src_bytes:.1%} of the source size)"
+            if src_bytes
+            else ""
+        )
+        print(f"[ok] Converted {count} results in {time.perf_counter() - t0:.2f} s{sizes}")
+        return
+
+    if not os.path.isfile(args.pack):
+        print(f"[err] File not found: {args.pack}")
+        return
+    try:
+        reader = PackReader(args.pack)
+    except ValueError as e:
+        print(f"[err] {e}")
+        return
+    with reader:
+        t0 = time.perf_counter()
+        if args.export:
+            write_json(args.export, reader.export())
+            print(f"[ok] Wrote: {args.export}")
+            return
+        if args.section is not None:
+            out: Any = reader.section(args.section)
+            if out is None:
+                print(f"[err] No section {args.section} ({len(reader.sections)} sections)")
+                return
+        elif args.page is not None:
+            out = reader.page(args.page)
+        else:
+            out = {
+                "doc": {k: v for k, v in reader.doc.items() if v is not None},
+                "sections": reader.section_titles(),
+            }
+        ms = (time.perf_counter() - t0) * 1000
+        print(json.dumps(out, ensure_ascii=False, indent=2))
+        print(f"[ok] Read in {ms:.2f} ms from {args.pack}")
+
+
+if __name__ == "__main__":
+    main()
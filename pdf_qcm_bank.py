@@ -0,0 +1,269 @@
+"""
+Question bank built from the QCM tails of extracted courses.
+
+With qcm_mode="separate", the "Question N" / "Réponses" tail of a section
+is kept as flat qcm_blocks. parse_qcm_blocks() turns them into structured
+questions: number, stem, options A-E, QRM/QRU tag, correct answers when
+a "Réponse(s)" key follows, and source page. QuestionBank collects them
+across every cached result, keyed by a fingerprint of the normalized stem
+and options, so the same question met in several PDFs is stored once
+with all its sources. Complete questions export to the app's "multi"
+question schema with no model call.
+"""
+import os
+import re
+import json
+import hashlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from pdf_evidence import evidence_key
+from pdf_fast_extract import QCM_ANSWER_RE, iter_results, load_result, norm_text, result_stem
+
+
+QUESTION_NUM_RE = re.compile(r"^question\s+(\d+)\s*[:.)\-–]?\s*", re.IGNORECASE)
+QCM_TYPE_RE = re.compile(r"\(\s*(QRM|QRU|QCM|QCS)\s*\)", re.IGNORECASE)
+OPTION_MARK_RE = re.compile(r"(?:(?<=\s)|^)([A-Ea-e])\s*[.)]\s+")
+ANSWER_KEY_RE = re.compile(r"^[A-Ea-e](?:\s*[,;/ ]?\s*[A-Ea-e])*\s*\.?$")
+BANK_DIR = "qcm"
+
+
+def split_options(body: str) -> Dict[str, Any]:
+    """Stem and options from "stem a. ... b. ... e. ..." (markers in order)."""
+    marks = []
+    pos = 0
+    for letter in "abcde":
+        found = None
+        for m in OPTION_MARK_RE.finditer(body, pos):
+            if m.group(1).lower() == letter:
+                found = m
+                break
+        if found is None:
+            break
+        marks.append(found)
+        pos = found.end()
+    if len(marks) < 2:
+        return {"stem": body.strip(), "options": []}
+    ends = [m.start() for m in marks[1:]] + [len(body)]
+    return {
+        "stem": body[: marks[0].start()].strip(),
+        "options": [body[m.end() : end].strip() for m, end in zip(marks, ends)],
+    }
+
+
+def question_fingerprint(stem: str, options: List[str]) -> str:
+    h = hashlib.sha256(evidence_key(stem).encode("utf-8"))
+    for opt in options:
+        h.update(b"\x1f")
+        h.update(evidence_key(opt).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _finish_question(cur: Dict[str, Any], section: Optional[str]) -> Dict[str, Any]:
+    body = " ".join(cur["body"])
+    qcm_type = None
+    m = QCM_TYPE_RE.search(body)
+    if m:
+        qcm_type = m.group(1).upper()
+        body = (body[: m.start()] + body[m.end() :]).replace("  ", " ")
+    parts = split_options(body)
+    options = parts["options"]
+    answers = None
+    key = cur["key"]
+    if key:
+        letters = [c for c in key.upper() if c in "ABCDE"]
+        answers = sorted({"ABCDE".index(c) for c in letters})
+        if options and any(i >= len(options) for i in answers):
+            answers = None
+    return {
+        "number": cur["number"],
+        "page": cur["page"],
+        "section": section,
+        "qcm_type": qcm_type,
+        "stem": parts["stem"],
+        "options": options,
+        "answer_key": key,
+        "answers": answers,
+        "fingerprint": question_fingerprint(parts["stem"], options),
+    }
+
+
+def parse_qcm_blocks(
+    blocks: List[Dict[str, Any]], section: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Structured questions from a section's qcm_blocks. Text after an answer
+    key that does not open a new question (e.g. a closing notice) is ignored.
+    """
+    questions: List[Dict[str, Any]] = []
+    cur: Optional[Dict[str, Any]] = None
+    for blk in blocks:
+        text = norm_text(blk["text"])
+        if not text:
+            continue
+        m = QUESTION_NUM_RE.match(text)
+        if m:
+            if cur is not None:
+                questions.append(_finish_question(cur, section))
+            rest = text[m.end() :]
+            cur = {
+                "number": int(m.group(1)),
+                "page": blk["page"],
+                "body": [rest] if rest else [],
+                "key": None,
+                "state": "body",
+            }
+            continue
+        if cur is None or cur["state"] == "done":
+            continue
+        am = QCM_ANSWER_RE.match(text)
+        if cur["state"] == "body" and am:
+            rest = text[am.end() :].strip()
+            cur["state"] = "key"
+            if rest and ANSWER_KEY_RE.match(rest):
+                cur["key"] = rest
+                cur["state"] = "done"
+            continue
+        if cur["state"] == "key":
+            if ANSWER_KEY_RE.match(text):
+                cur["key"] = text
+            cur["state"] = "done"
+            continue
+        cur["body"].append(text)
+    if cur is not None:
+        questions.append(_finish_question(cur, section))
+    return questions
+
+
+def parse_result_questions(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    questions = []
+    for sec in data.get("sections", []):
+        if sec.get("qcm_blocks"):
+            questions.extend(parse_qcm_blocks(sec["qcm_blocks"], sec["title"]))
+    return questions
+
+
+def to_app_question(q: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The app's "multi" question, or None when options/answers are incomplete."""
+    if len(q["options"]) != 5 or not q["answers"]:
+        return None
+    return {
+        "type": "multi",
+        "difficulty": "moyen",
+        "question": q["stem"],
+        "options": [f"{letter} {opt}" for letter, opt in zip("ABCDE", q["options"])],
+        "answer_indices": q["answers"],
+        "explanation": "",
+        "evidence": [{"page": q["page"], "excerpt": q["stem"][:160]}],
+    }
+
+
+class QuestionBank:
+    """
+    questions: fingerprint -> question (first occurrence) + "sources";
+    results: results already read, by name without extension (the same
+    result as JSON, pack or store ref is read once) -> their sha256.
+    Result names are content addressed, so a result read once is never
+    read again.
+    """
+
+    def __init__(self) -> None:
+        self.questions: Dict[str, Dict[str, Any]] = {}
+        self.results: Dict[str, str] = {}
+
+    @classmethod
+    def load(cls, path: str) -> "QuestionBank":
+        bank = cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return bank
+        bank.questions = {q["fingerprint"]: q for q in data.get("questions", [])}
+        bank.results = data.get("results", {})
+        return bank
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"results": self.results, "questions": list(self.questions.values())},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        os.replace(tmp, path)
+
+    def add_result(self, data: Dict[str, Any]) -> Counter:
+        counts: Counter = Counter()
+        source_doc = {"pdf": data.get("pdf"), "sha256": data.get("sha256")}
+        for q in parse_result_questions(data):
+            source = {**source_doc, "page": q["page"], "number": q["number"]}
+            known = self.questions.get(q["fingerprint"])
+            if known is None:
+                self.questions[q["fingerprint"]] = {**q, "sources": [source], "conflict": False}
+                counts["added"] += 1
+                continue
+            if source in known["sources"]:
+                continue
+            known["sources"].append(source)
+            if q["answers"] is not None:
+                if known["answers"] is None:
+                    known["answers"], known["answer_key"] = q["answers"], q["answer_key"]
+                elif known["answers"] != q["answers"]:
+                    known["conflict"] = True
+            counts["duplicates"] += 1
+        return counts
+
+    def update(self, out_dir: str) -> Counter:
+        """Add the questions of every result in out_dir not read yet."""
+        counts: Counter = Counter()
+        for path in iter_results(out_dir):
+            name = os.path.basename(result_stem(path))
+            if name in self.results:
+                continue
+            try:
+                data = load_result(path)
+            except (OSError, ValueError):
+                counts["unreadable"] += 1
+                continue
+            if not isinstance(data, dict) or "sections" not in data:
+                continue  # not an extraction result
+            self.results[name] = data.get("sha256", "")
+            counts["results"] += 1
+            counts.update(self.add_result(data))
+        return counts
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+
+    ap = argparse.ArgumentParser(prog="pdf_qcm_bank.py")
+    ap.add_argument("--out", default="out", help="Directory with cached results")
+    ap.add_argument(
+        "--bank", default=None, help=f"Bank file (default: <out>/{BANK_DIR}/bank.json)"
+    )
+    ap.add_argument("--export", default=None, help="Write complete questions in app format")
+    args = ap.parse_args(argv)
+
+    bank_path = args.bank or os.path.join(args.out, BANK_DIR, "bank.json")
+    bank = QuestionBank.load(bank_path)
+    counts = bank.update(args.out)
+    bank.save(bank_path)
+    conflicts = sum(1 for q in bank.questions.values() if q["conflict"])
+    print(
+        f"[ok] Bank: {len(bank.questions)} questions | new results: {counts['results']}"
+        f" | added: {counts['added']} | duplicates: {counts['duplicates']}"
+        f" | answer conflicts: {conflicts} -> {bank_path}"
+    )
+
+    if args.export:
+        app = [a for a in map(to_app_question, bank.questions.values()) if a]
+        with open(args.export, "w", encoding="utf-8") as f:
+            json.dump(app, f, ensure_ascii=False, indent=2)
+        print(f"[ok] Exported {len(app)}/{len(bank.questions)} complete questions: {args.export}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+SQLite store for extraction results (--format sqlite).
+
+One database, <out>/results.sqlite, replaces the one-JSON-per-hash
+files: documents, sections, blocks and images are rows, written in one
+transaction per result (WAL mode, so readers never wait on a writer).
+Listing courses and fetching one section are primary-key lookups; no
+document is parsed whole. Each row keeps the remaining keys of its JSON
+object, in order, so export() rebuilds exactly the result the JSON cache
+holds and export_json() writes the same bytes.
+
+A stored result is addressed like a file by a ref,
+"<out>/results.sqlite#<sha256>-<params key>"; load_result() accepts refs.
+"""
+import os
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pdf_fast_extract import (
+    RESULT_STORE_FILE,
+    iter_results,
+    json_default,
+    load_result,
+    result_stem,
+    write_json,
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    result_key TEXT NOT NULL,
+    pdf TEXT,
+    pages INTEGER,
+    sections_count INTEGER,
+    doc TEXT NOT NULL,
+    UNIQUE (sha256, result_key)
+);
+CREATE TABLE IF NOT EXISTS sections (
+    doc_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    title TEXT,
+    page_start INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (doc_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blocks (
+    doc_id INTEGER NOT NULL,
+    section_idx INTEGER NOT NULL,
+    qcm INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    page INTEGER,
+    text TEXT,
+    kind TEXT,
+    bullet_level INTEGER,
+    normalized_text TEXT,
+    PRIMARY KEY (doc_id, section_idx, qcm, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS images (
+    doc_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    xref INTEGER,
+    page INTEGER,
+    data TEXT NOT NULL,
+    PRIMARY KEY (doc_id, idx)
+) WITHOUT ROWID;
+"""
+BLOCK_KEYS = ("page", "text", "kind", "bullet_level", "normalized_text")
+BLOCK_LISTS = ("blocks", "qcm_blocks")
+
+
+def store_ref(db_path: str, sha: str, result_key: str) -> str:
+    return f"{db_path}#{sha}-{result_key}"
+
+
+def parse_ref(ref: str) -> Optional[Tuple[str, str, str]]:
+    """(db path, sha256, params key) of a store ref, None for a file path."""
+    db_path, sep, name = ref.rpartition("#")
+    if not sep or not db_path.endswith(".sqlite") or "-" not in name:
+        return None
+    sha, result_key = name.split("-", 1)
+    return (db_path, sha, result_key)
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=json_default)
+
+
+def _block_row(blk: Any) -> Tuple[Any, ...]:
+    d = blk if isinstance(blk, dict) else blk.to_dict()
+    if tuple(d) not in (BLOCK_KEYS[:2], BLOCK_KEYS):
+        raise ValueError(f"unexpected block keys: {list(d)}")
+    return tuple(d.get(k) for k in BLOCK_KEYS)
+
+
+def _block_dict(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    # Blocks are serialized short ({page, text}) until annotated (kind set).
+    if row[2] is None:
+        return {"page": row[0], "text": row[1]}
+    return dict(zip(BLOCK_KEYS, row))
+
+
+class ResultStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "ResultStore":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+    def _doc_id(self, sha: str, result_key: Optional[str] = None) -> Optional[int]:
+        if result_key is None:
+            row = self.conn.execute(
+                "SELECT id FROM documents WHERE sha256 = ? ORDER BY id DESC LIMIT 1", (sha,)
+            ).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT id FROM documents WHERE sha256 = ? AND result_key = ?",
+                (sha, result_key),
+            ).fetchone()
+        return row[0] if row else None
+
+    def has(self, sha: str, result_key: str) -> bool:
+        return self._doc_id(sha, result_key) is not None
+
+    def put(self, data: Dict[str, Any], result_key: str) -> int:
+        """Insert (or replace) a result in a single transaction."""
+        sections = data.get("sections", [])
+        doc = {k: (None if k in ("sections", "images") else v) for k, v in data.items()}
+        section_rows, block_rows, image_rows = [], [], []
+        for si, sec in enumerate(sections):
+            shape = {k: (None if k in BLOCK_LISTS else v) for k, v in sec.items()}
+            section_rows.append((si, sec.get("title"), sec.get("page_start"), _dumps(shape)))
+            for qcm, name in enumerate(BLOCK_LISTS):
+                for bi, blk in enumerate(sec.get(name) or ()):
+                    block_rows.append((si, qcm, bi) + _block_row(blk))
+        for ii, img in enumerate(data.get("images", [])):
+            image_rows.append((ii, img.get("xref"), img.get("page"), _dumps(img)))
+
+        with self.conn:
+            old = self._doc_id(data["sha256"], result_key)
+            if old is not None:
+                for table in ("sections", "blocks", "images"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE doc_id = ?", (old,))
+                self.conn.execute("DELETE FROM documents WHERE id = ?", (old,))
+            cur = self.conn.execute(
+                "INSERT INTO documents (sha256, result_key, pdf, pages, sections_count, doc)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    data["sha256"],
+                    result_key,
+                    data.get("pdf"),
+                    data.get("pages"),
+                    data.get("sections_count", len(sections)),
+                    _dumps(doc),
+                ),
+            )
+            doc_id = cur.lastrowid
+            self.conn.executemany(
+                "INSERT INTO sections VALUES (?, ?, ?, ?, ?)",
+                ((doc_id,) + r for r in section_rows),
+            )
+            self.conn.executemany(
+                "INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((doc_id,) + r for r in block_rows),
+            )
+            self.conn.executemany(
+                "INSERT INTO images VALUES (?, ?, ?, ?, ?)",
+                ((doc_id,) + r for r in image_rows),
+            )
+        return doc_id
+
+    def documents(self) -> List[Dict[str, Any]]:
+        """Course listing from the documents table alone."""
+        rows = self.conn.execute(
+            "SELECT sha256, result_key, pdf, pages, sections_count FROM documents ORDER BY id"
+        )
+        keys = ("sha256", "result_key", "pdf", "pages", "sections_count")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def image_sources(self, after_id: int = 0) -> List[Tuple[int, str, Dict[str, Any], List[int]]]:
+        """(id, sha256, document keys, image xrefs) of documents added after after_id."""
+        out = []
+        rows = self.conn.execute(
+            "SELECT id, sha256, doc FROM documents WHERE id > ? ORDER BY id", (after_id,)
+        ).fetchall()
+        for doc_id, sha, doc in rows:
+            xrefs = [
+                x
+                for (x,) in self.conn.execute(
+                    "SELECT xref FROM images WHERE doc_id = ?", (doc_id,)
+                )
+            ]
+            out.append((doc_id, sha, json.loads(doc), xrefs))
+        return out
+
+    def section_titles(self, sha: str, result_key: Optional[str] = None) -> List[Dict[str, Any]]:
+        doc_id = self._doc_id(sha, result_key)
+        if doc_id is None:
+            return []
+        rows = self.conn.execute(
+            "SELECT idx, title, page_start FROM sections WHERE doc_id = ? ORDER BY idx",
+            (doc_id,),
+        )
+        return [{"section": i, "title": t, "page_start": p} for i, t, p in rows]
+
+    def _blocks(self, doc_id: int, section_idx: Optional[int] = None) -> Dict[Tuple[int, int], List]:
+        sql = (
+            "SELECT section_idx, qcm, page, text, kind, bullet_level, normalized_text"
+            " FROM blocks WHERE doc_id = ?"
+        )
+        params: Tuple[Any, ...] = (doc_id,)
+        if section_idx is not None:
+            sql += " AND section_idx = ?"
+            params += (section_idx,)
+        out: Dict[Tuple[int, int], List] = {}
+        for row in self.conn.execute(sql + " ORDER BY section_idx, qcm, idx", params):
+            out.setdefault((row[0], row[1]), []).append(_block_dict(row[2:]))
+        return out
+
+    @staticmethod
+    def _section(data: str, si: int, blocks: Dict[Tuple[int, int], List]) -> Dict[str, Any]:
+        sec = json.loads(data)
+        for qcm, name in enumerate(BLOCK_LISTS):
+            if name in sec:
+                sec[name] = blocks.get((si, qcm), [])
+        return sec
+
+    def section(
+        self, sha: str, idx: int, result_key: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """One section with its blocks, as in the JSON result."""
+        doc_id = self._doc_id(sha, result_key)
+        if doc_id is None:
+            return None
+        row = self.conn.execute(
+            "SELECT data FROM sections WHERE doc_id = ? AND idx = ?", (doc_id, idx)
+        ).fetchone()
+        if row is None:
+            return None
+        return self._section(row[0], idx, self._blocks(doc_id, idx))
+
+    def export(self, sha: str, result_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """The full result, key for key as the JSON cache would hold it."""
+        doc_id = self._doc_id(sha, result_key)
+        if doc_id is None:
+            return None
+        (doc,) = self.conn.execute("SELECT doc FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        data = json.loads(doc)
+        blocks = self._blocks(doc_id)
+        if "sections" in data:
+            rows = self.conn.execute(
+                "SELECT idx, data FROM sections WHERE doc_id = ? ORDER BY idx", (doc_id,)
+            )
+            data["sections"] = [self._section(d, si, blocks) for si, d in rows]
+        if "images" in data:
+            rows = self.conn.execute(
+                "SELECT data FROM images WHERE doc_id = ? ORDER BY idx", (doc_id,)
+            )
+            data["images"] = [json.loads(d) for (d,) in rows]
+        return data
+
+    def export_json(self, sha: str, path: str, result_key: Optional[str] = None) -> bool:
+        data = self.export(sha, result_key)
+        if data is None:
+            return False
+        write_json(path, data)
+        return True
+
+    def import_results(self, paths: Iterable[str]) -> int:
+        """Load cached results (files or refs); names give the params key."""
+        count = 0
+        for path in paths:
+            name = os.path.basename(result_stem(path))
+            if "-" not in name:
+                continue
+            sha, result_key = name.split("-", 1)
+            if self.has(sha, result_key):
+                continue
+            try:
+                data = load_result(path)
+            except (OSError, ValueError):
+                continue
+            if not isinstance(data, dict) or data.get("sha256") != sha:
+                continue  # not an extraction result
+            self.put(data, result_key)
+            count += 1
+        return count
+
+
+def has_ref(ref: str) -> bool:
+    db_path, sha, result_key = parse_ref(ref)
+    if not os.path.exists(db_path):
+        return False
+    with ResultStore(db_path) as store:
+        return store.has(sha, result_key)
+
+
+def put_ref(ref: str, data: Dict[str, Any]) -> None:
+    db_path, _, result_key = parse_ref(ref)
+    with ResultStore(db_path) as store:
+        store.put(data, result_key)
+
+
+def load_ref(ref: str) -> Dict[str, Any]:
+    db_path, sha, result_key = parse_ref(ref)
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(db_path)
+    with ResultStore(db_path) as store:
+        data = store.export(sha, result_key)
+    if data is None:
+        raise FileNotFoundError(ref)
+    return data
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(prog="pdf_store.py")
+    ap.add_argument("action", choices=["import", "export", "list"])
+    ap.add_argument("--out", default="out", help="Directory with cached results")
+    ap.add_argument(
+        "--db", default=None, help=f"Database (default: <out>/{RESULT_STORE_FILE})"
+    )
+    ap.add_argument("--sha", default=None, help="export: document sha256")
+    ap.add_argument("--key", default=None, help="export: params key (default: latest)")
+    ap.add_argument("--to", default=None, help="export: JSON path")
+    args = ap.parse_args(argv)
+
+    db_path = args.db or os.path.join(args.out, RESULT_STORE_FILE)
+    with ResultStore(db_path) as store:
+        if args.action == "import":
+            t0 = time.perf_counter()
+            count = store.import_results(iter_results(args.out))
+            print(
+                f"[ok] Imported {count} results ({time.perf_counter() - t0:.2f} s)"
+                f" -> {db_path}"
+            )
+        elif args.action == "list":
+            for d in store.documents():
+                print(
+                    f"{d['sha256']}-{d['result_key']}  {d['pdf']}"
+                    f"  pages: {d['pages']}  sections: {d['sections_count']}"
+                )
+        else:
+            if not args.sha or not args.to:
+                print("[err] export needs --sha and --to")
+                return
+            if not store.export_json(args.sha, args.to, args.key):
+                print(f"[err] Not in store: {args.sha}")
+                return
+            print(f"[ok] Wrote: {args.to}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+TF-IDF retrieval of course sections for the "Révision ciblée" mode.
+
+A missed question is mapped back to the (section, page) passages that
+cover it. The index is built once per extraction result from its
+annotated course blocks (qcm_blocks are left out: they would match the
+questions themselves) and saved next to the cached result as
+<result>.tfidf/ (<out>/<sha256>-<key>.tfidf/ for a store ref), a handful
+of .npy arrays memory-mapped on load:
+- terms.npy: sorted 64-bit term hashes, looked up with np.searchsorted;
+- idf.npy: smoothed idf per term;
+- ptr.npy / post_entry.npy / post_weight.npy: CSR postings per term,
+  weights (1 + log tf) * idf, l2-normalized per passage.
+Tokens are evidence_key() words (accents folded like normalize_label_key)
+minus French stopwords, so a query costs a few array slices. meta.json
+records the source (see source_stamp): an index whose result changed
+since it was built is rebuilt.
+"""
+import os
+import json
+import shutil
+import hashlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from pdf_evidence import evidence_key
+from pdf_fast_extract import RESULT_STORE_FILE, load_result, result_exists, result_stem
+
+
+TFIDF_VERSION = 2
+FRENCH_STOPWORDS = frozenset(
+    """
+    au aux avec ce ces cet cette dans de des du elle elles en et eux il ils je
+    la le les leur leurs lui ma mais me meme mes moi mon ne nos notre nous on ou
+    par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos
+    votre vous est sont etre ete etait etaient avoir ont avait sans sous entre
+    plus moins tres tout tous toute toutes aussi ainsi donc car si comme dont
+    lors quand alors peu peut peuvent fait faire cela ceci celui celle ceux
+    celles chez vers selon autre autres meme deja encore ici la ya
+    """.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        w for w in evidence_key(text).split() if len(w) > 1 and w not in FRENCH_STOPWORDS
+    ]
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def index_dir(result_path: str) -> str:
+    return f"{result_stem(result_path)}.tfidf"
+
+
+def source_stamp(result_path: str) -> Dict[str, Any]:
+    """
+    What an index was built from. A store ref names its content (sha256
+    and params key); a file may be rewritten in place (--force, legacy
+    names), so it is identified by size and mtime.
+    """
+    if f"{RESULT_STORE_FILE}#" in result_path:
+        return {"ref": os.path.basename(result_stem(result_path))}
+    st = os.stat(result_path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _passages(data: Dict[str, Any]) -> List[Tuple[int, int, List[str]]]:
+    """(section index, page, tokens) per page of each section, title included."""
+    out = []
+    for si, sec in enumerate(data.get("sections", [])):
+        title = tokenize(sec["title"])
+        by_page: Dict[int, List[str]] = {}
+        for blk in sec.get("blocks", []):
+            toks = tokenize(blk.get("normalized_text") or blk["text"])
+            by_page.setdefault(blk["page"], []).extend(toks)
+        if not by_page:
+            by_page[sec["page_start"]] = []
+        for page, toks in sorted(by_page.items()):
+            if title or toks:
+                out.append((si, page, title + toks))
+    return out
+
+
+class TfidfIndex:
+    ARRAYS = ("terms", "idf", "ptr", "post_entry", "post_weight")
+
+    def __init__(
+        self,
+        arrays: Dict[str, np.ndarray],
+        entries: List[Tuple[int, int]],
+        titles: List[str],
+        source: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.terms = arrays["terms"]
+        self.idf = arrays["idf"]
+        self.ptr = arrays["ptr"]
+        self.post_entry = arrays["post_entry"]
+        self.post_weight = arrays["post_weight"]
+        self.entries = entries
+        self.titles = titles
+        self.source = source
+
+    @classmethod
+    def build(
+        cls, data: Dict[str, Any], source: Optional[Dict[str, Any]] = None
+    ) -> "TfidfIndex":
+        passages = _passages(data)
+        vocab: Dict[str, int] = {}
+        rows: List[Tuple[np.ndarray, np.ndarray]] = []
+        for _, _, toks in passages:
+            counts = Counter(toks)
+            ids = np.fromiter((vocab.setdefault(t, len(vocab)) for t in counts), dtype=np.int64)
+            tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+            rows.append((ids, tf))
+        n_terms = len(vocab)
+        df = np.zeros(n_terms, dtype=np.float64)
+        for ids, _ in rows:
+            df[ids] += 1
+        idf = np.log((1 + len(passages)) / (1 + df)) + 1
+
+        term_ids, entry_ids, weights = [], [], []
+        for entry, (ids, tf) in enumerate(rows):
+            w = (1 + np.log(tf)) * idf[ids]
+            norm = float(np.sqrt((w * w).sum())) or 1.0
+            term_ids.append(ids)
+            entry_ids.append(np.full(len(ids), entry, dtype=np.int32))
+            weights.append(w / norm)
+        hashes = np.array([term_hash(t) for t in vocab], dtype=np.uint64)
+        order = np.argsort(hashes)  # term rank in the sorted table
+        rank = np.empty(n_terms, dtype=np.int64)
+        rank[order] = np.arange(n_terms)
+
+        t = rank[np.concatenate(term_ids)] if term_ids else np.zeros(0, dtype=np.int64)
+        by_term = np.argsort(t, kind="stable")
+        ptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(t, minlength=n_terms), out=ptr[1:])
+        arrays = {
+            "terms": hashes[order],
+            "idf": idf[order].astype(np.float32),
+            "ptr": ptr,
+            "post_entry": (
+                np.concatenate(entry_ids)[by_term] if entry_ids else np.zeros(0, np.int32)
+            ),
+            "post_weight": (
+                np.concatenate(weights)[by_term].astype(np.float32)
+                if weights
+                else np.zeros(0, np.float32)
+            ),
+        }
+        entries = [(si, page) for si, page, _ in passages]
+        titles = [sec["title"] for sec in data.get("sections", [])]
+        return cls(arrays, entries, titles, source)
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.tmp{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(tmp, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": TFIDF_VERSION,
+                    "source": self.source,
+                    "entries": self.entries,
+                    "titles": self.titles,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # another process won the race
+
+    @classmethod
+    def load(
+        cls, path: str, source: Optional[Dict[str, Any]] = None
+    ) -> Optional["TfidfIndex"]:
+        """None when missing, stale (built from another source) or unreadable."""
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != TFIDF_VERSION:
+                return None
+            if source is not None and meta.get("source") != source:
+                return None
+            arrays = {
+                name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                for name in cls.ARRAYS
+            }
+        except (OSError, ValueError):
+            return None
+        return cls(
+            arrays, [tuple(e) for e in meta["entries"]], meta["titles"], meta["source"]
+        )
+
+    @classmethod
+    def open(cls, result_path: str) -> "TfidfIndex":
+        """
+        The index saved next to result_path, built and saved on first use
+        and rebuilt once the result has changed.
+        """
+        path = index_dir(result_path)
+        source = source_stamp(result_path)
+        index = cls.load(path, source)
+        if index is None:
+            index = cls.build(load_result(result_path), source)
+            index.save(path)
+        else:
+            try:
+                os.utime(os.path.join(path, "meta.json"))  # last use, for evict_cache
+            except OSError:
+                pass
+        return index
+
+    def scores(self, text: str) -> np.ndarray:
+        """Cosine similarity of text with every passage."""
+        scores = np.zeros(len(self.entries), dtype=np.float32)
+        counts = Counter(tokenize(text))
+        if not counts or not len(self.terms):
+            return scores
+        hashes = np.array([term_hash(t) for t in counts], dtype=np.uint64)
+        pos = np.minimum(np.searchsorted(self.terms, hashes), len(self.terms) - 1)
+        found = self.terms[pos] == hashes
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        qw = (1 + np.log(tf[found])) * self.idf[pos[found]]
+        norm = float(np.sqrt((qw * qw).sum())) or 1.0
+        for p, w in zip(pos[found], qw / norm):
+            lo, hi = self.ptr[p], self.ptr[p + 1]
+            # A term occurs once per passage: no repeated indexes in the slice.
+            scores[self.post_entry[lo:hi]] += w * self.post_weight[lo:hi]
+        return scores
+
+    def search(self, text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k (section, page) passages for a question text."""
+        scores = self.scores(text)
+        k = min(k, int((scores > 0).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {
+                "section": self.entries[i][0],
+                "title": self.titles[self.entries[i][0]],
+                "page": self.entries[i][1],
+                "score": round(float(scores[i]), 4),
+            }
+            for i in top
+        ]
+
+    def search_sections(self, text: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k sections, each scored by its best passage, with its pages."""
+        best: Dict[int, Dict[str, Any]] = {}
+        for hit in self.search(text, k=len(self.entries)):
+            rec = best.get(hit["section"])
+            if rec is None:
+                if len(best) >= k:
+                    continue
+                best[hit["section"]] = {**hit, "pages": [hit["page"]]}
+            else:
+                rec["pages"].append(hit["page"])
+        return list(best.values())
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import argparse
+    import time
+
+    ap = argparse.ArgumentParser(prog="pdf_tfidf.py")
+    ap.add_argument(
+        "result", help="Cached extraction result (.json, .ndjson, .pack or store ref)"
+    )
+    ap.add_argument("query", nargs="+", help="Question text (one per argument)")
+    ap.add_argument("-k", type=int, default=5, help="Number of hits")
+    ap.add_argument("--sections", action="store_true", help="Rank sections, not pages")
+    args = ap.parse_args(argv)
+
+    if not result_exists(args.result):
+        print(f"[err] File not found: {args.result}")
+        return
+    t0 = time.perf_counter()
+    index = TfidfIndex.open(args.result)
+    t1 = time.perf_counter()
+    search = index.search_sections if args.sections else index.search
+    for text in args.query:
+        t = time.perf_counter()
+        hits = search(text, args.k)
+        ms = (time.perf_counter() - t) * 1000
+        print(json.dumps({"query": text, "hits": hits}, ensure_ascii=False, indent=2))
+        print(f"[ok] {len(hits)} hits in {ms:.2f} ms")
+    print(
+        f"[ok] Index: {len(index.entries)} passages, {len(index.terms)} terms"
+        f" ({(t1 - t0) * 1000:.1f} ms) -> {index_dir(args.result)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_evidence import EvidenceIndex, iter_question_evidence, parse_page  # noqa: E402
+
+
+RESULT = {
+    "sections": [
+        {
+            "title": "Tabac et santé publique",
+            "page_start": 1,
+            "blocks": [
+                {"page": 1, "text": "En France la prévalence du tabagisme reste"},
+                {"page": 1, "text": "très élevée chez les jeunes adultes"},
+                {"page": 2, "text": "Le sevrage réduit le risque cardiovasculaire"},
+                {"page": 2, "text": "dès la première année sans tabac"},
+            ],
+        }
+    ]
+}
+
+
+def test_excerpt_spanning_two_lines_matches():
+    index = EvidenceIndex.from_result(RESULT)
+    rec = index.verify(1, "du tabagisme reste très élevée chez les jeunes")
+    assert rec["match"] and rec["score"] == 1.0
+    assert (rec["section"], rec["block"]) == (0, 1)  # most of the excerpt's shingles
+
+    rec = index.verify(2, "risque cardiovasculaire dès la première")
+    assert rec["match"] and rec["block"] == 3
+
+
+def test_excerpt_on_wrong_page_or_invented():
+    index = EvidenceIndex.from_result(RESULT)
+    rec = index.verify(2, "reste très élevée chez les jeunes")
+    assert not rec["match"] and rec["best_page"] == 1 and rec["best_score"] == 1.0
+    assert not index.verify(1, "le tabac protège contre le cancer du poumon")["match"]
+
+
+def test_page_numbers_from_model_output():
+    assert [parse_page(p) for p in (3, "3", "p. 3", "3-4", 2.0)] == [3, 3, 3, 3, 2]
+    assert [parse_page(p) for p in (None, "", "page ?", True, 2.5)] == [None] * 5
+    questions = [{"evidence": [{"page": "p. 2", "excerpt": "x"}, {"page": "?", "excerpt": "y"}]}]
+    assert list(iter_question_evidence(questions)) == [(0, 0, 2, "x"), (0, 1, None, "y")]